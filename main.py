@@ -1,35 +1,126 @@
 """
 Точка входа. Запускает Gradio-интерфейс.
+
+Импорт модуля ничего тяжёлого не делает: gradio импортируется при сборке
+интерфейса, движок с индексом поднимается в фоне при запуске (или при первом
+обращении), модель эмбеддингов — при первом кодировании. Время старта
+печатается и отдаётся метриками startup_seconds / index_load_seconds.
 """
 
 import os
-import gradio as gr
-from src.rag_engine import RAGEngine
-from src.pdf_loader import process_pdf_to_chunks
-from src.feedback_handler import log_feedback
+import threading
+import time
 
-engine = RAGEngine()
+_started = time.perf_counter()
+
+from src import metrics
+from src.feedback_handler import log_feedback
+from src.serving import Overloaded
+
+_services = None
+_services_lock = threading.Lock()
+
+
+class _Services:
+    def __init__(self):
+        from src.micro_batcher import MicroBatcher
+        from src.rag_engine import RAGEngine
+        from src.serving import IngestQueue, QueryPool
+
+        # RAG_RERANKER=default (или имя модели) включает второй этап — cross-encoder;
+        # RAG_TRANSLATION=ingest|query — когда переводить иностранные чанки (пусто — не переводить)
+        self.engine = RAGEngine(chunk_cache_path="models/embeddings.sqlite",
+                                reranker_model=os.environ.get("RAG_RERANKER") or None,
+                                translation=os.environ.get("RAG_TRANSLATION", "query") or None,
+                                translation_cache_path="models/translations.sqlite")
+        # Одновременные вопросы пользователей кодируются и ищутся одной пачкой
+        self.ask_batcher = MicroBatcher(self.engine.ask_many, max_batch_size=32, max_wait_ms=5)
+        # Индексация идёт фоновыми заданиями, вопросы — через пул с лимитом очереди
+        self.ingest_queue = IngestQueue(self.engine)
+        self.query_pool = QueryPool(self.ask_batcher.submit, max_workers=32, max_queued=128)
+        metrics.register_gauge("index_vectors", lambda: self.engine.ntotal)
+        metrics.register_gauge("query_pool_running", lambda: self.query_pool.stats()["running"])
+        metrics.register_gauge("query_pool_queued", lambda: self.query_pool.stats()["queued"])
+        metrics.register_gauge("ingest_jobs_pending", self.ingest_queue.pending)
+        metrics.register_gauge("embedding_model_loaded", lambda: int(self.engine.model.loaded))
+        # Загружаем индекс при старте, если есть
+        try:
+            self.engine.load_index()
+            stats = self.engine.load_stats
+            metrics.register_gauge("index_load_seconds", lambda: stats["seconds"])
+            print(f"✅ Индекс загружен из models/ за {stats['seconds']:.2f} с "
+                  f"({'снимок' if stats['source'] == 'snapshot' else 'сегменты'}, фрагментов: {stats['chunks']})")
+        except (FileNotFoundError, RuntimeError) as e:
+            print("ℹ️ Индекс не найден. Загрузите PDF-инструкции для создания.")
+
+
+def get_services() -> _Services:
+    """Движок и очереди создаются один раз; параллельные вызовы ждут первую сборку."""
+    global _services
+    with _services_lock:
+        if _services is None:
+            _services = _Services()
+            startup = time.perf_counter() - _started
+            metrics.register_gauge("startup_seconds", lambda: startup)
+            print(f"⏱️ Сервис готов через {startup:.2f} с после запуска")
+        return _services
+
+# Метрики включены по умолчанию (RAG_METRICS=0 — выключить) и читаются с локального порта
+metrics.enable(os.environ.get("RAG_METRICS", "1") != "0")
 
 def upload_pdfs(files):
-    all_chunks = []
-    for file in files:
-        chunks = process_pdf_to_chunks(file.name)
-        all_chunks.extend(chunks)
-    engine.add_chunks(all_chunks)
-    engine.save_index()
-    return f"✅ Загружено {len(all_chunks)} фрагментов из {len(files)} файлов."
+    ingest_queue = get_services().ingest_queue
+    try:
+        job = ingest_queue.submit([file.name for file in files])
+    except Overloaded as e:
+        yield f"⏳ {e}"
+        return
+    while True:
+        status = ingest_queue.wait(job.id, timeout=0.5)
+        skipped = status["exact_duplicates"] + status["near_duplicates"]
+        if status["status"] == "failed":
+            yield f"❌ Ошибка индексации: {status['error']}"
+            return
+        if status["status"] == "done":
+            yield (f"✅ Загружено {status['added']} фрагментов из {status['files_total']} файлов. "
+                   f"Пропущено дублей: {skipped}.")
+            return
+        yield (f"🔄 Файлов обработано: {status['files_done']}/{status['files_total']}, "
+               f"фрагментов добавлено: {status['added']}, пропущено дублей: {skipped}")
+
+def document_choices():
+    import gradio as gr
+
+    return gr.update(choices=get_services().engine.get_loaded_documents())
+
+def remove_document(filename):
+    import gradio as gr
+
+    engine = get_services().engine
+    if not filename:
+        return "Выберите документ.", gr.update(choices=engine.get_loaded_documents())
+    removed = engine.remove_document(filename)
+    return (f"🗑️ Документ {filename} удалён, фрагментов: {removed}.",
+            gr.update(choices=engine.get_loaded_documents(), value=None))
 
 def ask_question(query):
-    if engine.index.ntotal == 0:
+    services = get_services()
+    if services.engine.ntotal == 0:
         return "Сначала загрузите инструкции.", ""
-    answer, context = engine.ask(query)
+    try:
+        answer, context = services.query_pool.run(query)
+    except Overloaded as e:
+        return f"⏳ {e}", ""
     return answer, context
 
 def handle_feedback(query, answer, context, bad_fragment, is_correct):
+    engine = get_services().engine
+    log_feedback(query, answer, [context] if context else [], is_correct)
     if not is_correct:
         # Если пользователь выделил фрагмент — сохраняем его как "плохой"
         if bad_fragment.strip():
-            engine.mark_fragment_as_bad(bad_fragment.strip())
+            if not engine.mark_fragment_as_bad(bad_fragment.strip()):
+                return "Выделенный текст не найден в загруженных инструкциях."
             return f"Фрагмент помечен как нерелевантный: \"{bad_fragment[:50]}...\""
         else:
             # Если ничего не выделено — помечаем весь контекст
@@ -38,63 +129,78 @@ def handle_feedback(query, answer, context, bad_fragment, is_correct):
     else:
         return "Спасибо! Ответ подтверждён как верный."
 
-# Загружаем индекс при старте, если есть
-try:
-    engine.load_index()
-    print("✅ Индекс загружен из models/")
-except (FileNotFoundError, RuntimeError) as e:
-    print("ℹ️ Индекс не найден. Загрузите PDF-инструкции для создания.")
-
-with gr.Blocks(title="AI-помощник для инженера") as demo:
-    gr.Markdown("# 🤖 AI-помощник для инженера 1-й линии")
-    gr.Markdown("Загрузите PDF-инструкции (на любом языке). Ответ всегда будет на русском.")
-
-    with gr.Tab("📄 Загрузка инструкций"):
-        pdf_input = gr.File(file_count="multiple", file_types=[".pdf"])
-        upload_btn = gr.Button("🔄 Загрузить и проиндексировать")
-        upload_status = gr.Textbox(label="Статус")
-
-    with gr.Tab("💬 Задать вопрос"):
-        query_input = gr.Textbox(label="Ваш вопрос", placeholder="Как настроить VLAN?")
-        ask_btn = gr.Button("🔍 Получить ответ")
-
-        answer_output = gr.Textbox(
-            label="💬 Ответ ИИ (на русском)",
-            lines=10,
-            interactive=False
+def build_demo():
+    import gradio as gr
+
+    with gr.Blocks(title="AI-помощник для инженера") as demo:
+        gr.Markdown("# 🤖 AI-помощник для инженера 1-й линии")
+        gr.Markdown("Загрузите PDF-инструкции на русском, английском, немецком, французском, испанском "
+                    "или итальянском. Иностранный фрагмент переводится на русский, если установлен пакет "
+                    "Argos для его языка; иначе он показывается в оригинале.")
+
+        with gr.Tab("📄 Загрузка инструкций"):
+            pdf_input = gr.File(file_count="multiple", file_types=[".pdf"])
+            upload_btn = gr.Button("🔄 Загрузить и проиндексировать")
+            upload_status = gr.Textbox(label="Статус")
+            with gr.Row():
+                # Список документов заполняется при открытии страницы, когда индекс уже загружен
+                document_select = gr.Dropdown(label="Загруженные документы", choices=[])
+                remove_btn = gr.Button("🗑️ Удалить документ")
+
+        with gr.Tab("💬 Задать вопрос"):
+            query_input = gr.Textbox(label="Ваш вопрос", placeholder="Как настроить VLAN?")
+            ask_btn = gr.Button("🔍 Получить ответ")
+
+            answer_output = gr.Textbox(
+                label="💬 Ответ ИИ (на русском)",
+                lines=10,
+                interactive=False
+            )
+            context_output = gr.Textbox(
+                label="📄 Использованный контекст (оригинал)",
+                lines=10,
+                interactive=False
+            )
+
+            # Новое поле: пользователь выделяет проблемный фрагмент
+            bad_fragment_input = gr.Textbox(
+                label="✂️ Выделите и вставьте сюда неверную часть текста (или оставьте пустым)",
+                lines=3,
+                placeholder="Например: 'Для получения поддержки звоните по телефону 8-800-XXX-XX-XX'"
+            )
+
+            with gr.Row():
+                yes_btn = gr.Button("✅ Верно")
+                no_btn = gr.Button("❌ Неверно (сохранить выделенное как плохой фрагмент)")
+
+            feedback_status = gr.Textbox(label="Обратная связь")
+
+        demo.load(document_choices, outputs=document_select)
+        upload_btn.click(upload_pdfs, inputs=pdf_input, outputs=upload_status, concurrency_limit=None).then(
+            document_choices, outputs=document_select
         )
-        context_output = gr.Textbox(
-            label="📄 Использованный контекст (оригинал)",
-            lines=10,
-            interactive=False
+        remove_btn.click(remove_document, inputs=document_select, outputs=[upload_status, document_select])
+        ask_btn.click(
+            ask_question,
+            inputs=query_input,
+            outputs=[answer_output, context_output],
+            concurrency_limit=None
         )
-
-        # Новое поле: пользователь выделяет проблемный фрагмент
-        bad_fragment_input = gr.Textbox(
-            label="✂️ Выделите и вставьте сюда неверную часть текста (или оставьте пустым)",
-            lines=3,
-            placeholder="Например: 'Для получения поддержки звоните по телефону 8-800-XXX-XX-XX'"
+        yes_btn.click(
+            handle_feedback,
+            inputs=[query_input, answer_output, context_output, bad_fragment_input, gr.State(True)],
+            outputs=feedback_status
         )
 
-        with gr.Row():
-            yes_btn = gr.Button("✅ Верно")
-            no_btn = gr.Button("❌ Неверно (сохранить выделенное как плохой фрагмент)")
-
-        feedback_status = gr.Textbox(label="Обратная связь")
-
-    upload_btn.click(upload_pdfs, inputs=pdf_input, outputs=upload_status)
-    ask_btn.click(ask_question, inputs=query_input, outputs=[answer_output, context_output])
-    yes_btn.click(
-        handle_feedback,
-        inputs=[query_input, answer_output, context_output, bad_fragment_input, gr.State(True)],
-        outputs=feedback_status
-    )
-
-    no_btn.click(
-        handle_feedback,
-        inputs=[query_input, answer_output, context_output, bad_fragment_input, gr.State(False)],
-        outputs=feedback_status
-    )
+        no_btn.click(
+            handle_feedback,
+            inputs=[query_input, answer_output, context_output, bad_fragment_input, gr.State(False)],
+            outputs=feedback_status
+        )
+    return demo
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
+    metrics.start_metrics_server(int(os.environ.get("RAG_METRICS_PORT", metrics.DEFAULT_PORT)))
+    # Индекс грузится параллельно со сборкой интерфейса; обработчики дождутся его в get_services
+    threading.Thread(target=get_services, name="startup", daemon=True).start()
+    build_demo().launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
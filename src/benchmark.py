@@ -0,0 +1,414 @@
+"""
+Нагрузочный бенчмарк RAGEngine на синтетическом многоязычном корпусе:
+скорость нарезки страниц и длины чанков в токенах модели, скорость
+кодирования и индексации, задержки ask
+(p50/p95/p99, холодный и тёплый кэш), пропускная способность ask_many,
+память и recall@k плотного поиска относительно точного flat-поиска.
+С --translation — ещё задержка перевода пачки чанков и предложений в секунду.
+
+    python -m src.benchmark --sizes 1000 10000 --output benchmarks/results.json \\
+        --baseline benchmarks/baseline.json
+
+С --pdf нарезка замеряется и на настоящих руководствах. Результат — JSON; с --baseline метрики сравниваются с сохранённым прогоном
+и процесс завершается с кодом 1 при регрессии.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from src.embedders import EMBEDDING_BACKENDS, recall_at_k
+from src.index_backends import BACKENDS, detect_backend, extract_vectors, index_ids
+
+# Чанки генерируются блоками с собственным зерном: любой чанк можно
+# воспроизвести, не генерируя корпус с начала
+_BLOCK = 1000
+
+_VOCABULARY = {
+    "ru": (
+        "питание разъём кабель порт индикатор настройка сеть коммутатор маршрутизатор интерфейс "
+        "адрес шлюз пароль пользователь сброс заводские настройки прошивка обновление перезагрузка "
+        "устройство панель кнопка вентилятор температура ошибка журнал событий команда консоль "
+        "подключение отключение резервное копирование конфигурация безопасность доступ модуль "
+        "антенна сигнал канал частота мощность напряжение ток батарея зарядка датчик"
+    ).split(),
+    "en": (
+        "power connector cable port indicator setup network switch router interface address "
+        "gateway password user reset factory settings firmware update reboot device panel button "
+        "fan temperature error event log command console connection backup configuration "
+        "security access module antenna signal channel frequency voltage current battery sensor"
+    ).split(),
+}
+_CODES = ("C1212-1002", "DC-IN", "VLAN", "RJ-45", "SFP+", "PoE", "USB-C", "RS-232", "E-07", "F-13")
+
+# Направление метрик при сравнении с базовым прогоном
+HIGHER_IS_BETTER = ("pages_per_sec", "chunks_per_sec", "queries_per_sec", "sentences_per_sec",
+                    "recall@1", "recall@10")
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "peak_rss_mb", "over_window")
+
+
+def _synthetic_block(block: int, seed: int, languages: Sequence[str]) -> List[str]:
+    rng = np.random.default_rng([seed, block])
+    chunks = []
+    for _ in range(_BLOCK):
+        words = _VOCABULARY[languages[rng.integers(len(languages))]]
+        picked = [words[i] for i in rng.integers(len(words), size=rng.integers(40, 80))]
+        for _ in range(rng.integers(1, 3)):
+            picked.insert(int(rng.integers(len(picked))), f"{_CODES[rng.integers(len(_CODES))]}-{rng.integers(1000)}")
+        chunks.append(" ".join(picked) + ".")
+    return chunks
+
+
+def iter_synthetic_chunks(n_chunks: int, seed: int = 0,
+                          languages: Sequence[str] = ("ru", "en")) -> Iterator[str]:
+    """Детерминированный поток из n_chunks чанков «технической документации» на нескольких языках."""
+    for block in range((n_chunks + _BLOCK - 1) // _BLOCK):
+        chunks = _synthetic_block(block, seed, languages)
+        yield from chunks[:n_chunks - block * _BLOCK]
+
+
+def synthetic_queries(n_chunks: int, n_queries: int, seed: int = 0,
+                      languages: Sequence[str] = ("ru", "en")) -> List[str]:
+    """Запросы из нескольких слов случайных чанков корпуса того же размера и зерна."""
+    rng = np.random.default_rng([seed, n_chunks, n_queries])
+    queries = []
+    blocks = {}
+    for chunk_id in rng.integers(n_chunks, size=n_queries):
+        block = int(chunk_id) // _BLOCK
+        if block not in blocks:
+            blocks[block] = _synthetic_block(block, seed, languages)
+        words = blocks[block][int(chunk_id) % _BLOCK].rstrip(".").split()
+        start = int(rng.integers(max(1, len(words) - 6)))
+        queries.append(" ".join(words[start:start + int(rng.integers(3, 7))]))
+    return queries
+
+
+def synthetic_pages(chunks: Sequence[str], chunks_per_page: int = 3, pages_per_chapter: int = 4,
+                    words_per_line: int = 12, table_every: int = 5) -> List[str]:
+    """
+    Тексты страниц как их отдаёт pdfplumber: колонтитулы, текст, перенесённый
+    по строкам, заголовки глав и таблица на каждой table_every-й странице.
+    """
+    pages = []
+    for page_no, start in enumerate(range(0, len(chunks), chunks_per_page)):
+        chapter = page_no // pages_per_chapter + 1
+        lines = [f"Руководство пользователя. Page {page_no + 1}"]
+        if page_no % pages_per_chapter == 0:
+            lines.append(f"{chapter}.1 Раздел документации")
+        for chunk in chunks[start:start + chunks_per_page]:
+            words = chunk.split()
+            lines += [" ".join(words[i:i + words_per_line]) for i in range(0, len(words), words_per_line)]
+        if table_every and page_no % table_every == table_every - 1:
+            lines.append(f"Таблица {chapter}.{page_no} Параметры питания")
+            lines += [f"{row} Параметр {row * 7} В {row * 30} мА" for row in range(1, 13)]
+        lines.append("© 2024 Technical documentation")
+        pages.append("\n".join(lines))
+    return pages
+
+
+def chunk_token_stats(chunks: Sequence[str], count_tokens: Optional[Callable[[str], int]] = None) -> dict:
+    """
+    Длины чанков в токенах и доля чанков, которые модель обрежет (over_window).
+    Без count_tokens меряет токенизатор модели, если он есть локально, —
+    тогда over_window проверяет бюджет нарезки по настоящим токенам.
+    """
+    from src.chunker import MODEL_MAX_TOKENS, count_chunk_tokens, default_counter, estimate_tokens
+    count_tokens = count_tokens or default_counter()
+    tokens = np.array([count_chunk_tokens(chunk, count_tokens) for chunk in chunks] or [0])
+    # <s> и </s> тоже занимают окно модели
+    return {
+        "token_counter": "estimate" if count_tokens is estimate_tokens else "tokenizer",
+        "mean_tokens": float(tokens.mean()),
+        "max_tokens": int(tokens.max()),
+        "over_window": float(np.mean(tokens + 2 > MODEL_MAX_TOKENS)) if len(chunks) else 0.0,
+    }
+
+
+def latency_stats(seconds: Sequence[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds, dtype="float64") * 1000
+    if not len(ms):
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "mean_ms": float(ms.mean())}
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _clear_query_caches(engine):
+    engine.embedding_cache.clear()
+    engine.result_cache.clear()
+
+
+def measure_chunking(chunks: Sequence[str], count_tokens: Optional[Callable[[str], int]] = None) -> dict:
+    """Фильтры строк, сборка глав и нарезка по токенам на синтетических страницах."""
+    from src.pdf_loader import iter_chapters_from_pages, split_chapter_into_chunks
+    pages = synthetic_pages(chunks)
+    started = time.perf_counter()
+    produced = [chunk for chapter in iter_chapters_from_pages(pages)
+                for chunk in split_chapter_into_chunks(chapter, count_tokens=count_tokens)]
+    elapsed = time.perf_counter() - started
+    return {
+        "pages": len(pages),
+        "chunks": len(produced),
+        "pages_per_sec": len(pages) / elapsed if elapsed else 0.0,
+        "chunks_per_sec": len(produced) / elapsed if elapsed else 0.0,
+        **chunk_token_stats(produced),
+    }
+
+
+def measure_pdf_extraction(pdf_paths: Sequence[str], count_tokens: Optional[Callable[[str], int]] = None) -> dict:
+    """Страниц в секунду на настоящих PDF (извлечение текста + нарезка) и длины их чанков."""
+    from src.pdf_loader import count_pdf_pages, iter_pdf_chunks
+    pages = sum(count_pdf_pages(path) for path in pdf_paths)
+    started = time.perf_counter()
+    produced = [chunk for _, chunk in iter_pdf_chunks(list(pdf_paths), count_tokens=count_tokens)]
+    elapsed = time.perf_counter() - started
+    return {"pages": pages, "chunks": len(produced), "pages_per_sec": pages / elapsed if elapsed else 0.0,
+            **chunk_token_stats(produced)}
+
+
+def synthetic_english_prose(n_chunks: int, seed: int = 0) -> List[str]:
+    """Английские чанки из связных предложений: словарные чанки язык по служебным словам не выдают."""
+    rng = np.random.default_rng([seed, 21])
+    words = _VOCABULARY["en"]
+    templates = ("Check the {} and the {} before you update the {}.",
+                 "The {} is connected to the {} with a {} cable.",
+                 "Press the {} button to reset the {} of this {}.",
+                 "If the {} fails, replace the {} and restart the {}.")
+    return [
+        " ".join(templates[rng.integers(len(templates))].format(*rng.choice(words, 3))
+                 for _ in range(rng.integers(3, 6)))
+        for _ in range(n_chunks)
+    ]
+
+
+def measure_translation(backends: dict, chunks: Sequence[str], batch_size: int = 20) -> dict:
+    """
+    Перевод пачек чанков (как на один ответ ask_many) с холодным кэшем в памяти:
+    задержка пачки и предложений в секунду. backends — модели движка, кэш не трогается.
+    """
+    from src.translator import Translator
+    translator = Translator(backends=backends)
+    seconds = []
+    for start in range(0, len(chunks), batch_size):
+        started = time.perf_counter()
+        translator.translate(chunks[start:start + batch_size])
+        seconds.append(time.perf_counter() - started)
+    stats = translator.stats()
+    return {"chunks": stats["translated"], "sentences_per_sec": stats["sentences_per_sec"],
+            "batch": latency_stats(seconds)}
+
+
+def measure_recall(engine, queries: List[str], ks: Sequence[int] = (1, 10)) -> dict:
+    """
+    recall@k плотного поиска движка относительно точного поиска по тем же
+    векторам. Для IVF-PQ векторы индекса приближённые, поэтому эталон
+    считается по заново закодированным чанкам.
+    """
+    k = min(max(ks), engine.index.ntotal)
+    ids = index_ids(engine.index)
+    if detect_backend(engine.index) == "ivf_pq":
+        vectors = engine._encode_chunks([engine.chunks[int(i)] for i in ids])
+    else:
+        vectors = extract_vectors(engine.index)
+    exact = faiss.IndexIDMap2(faiss.IndexFlatIP(engine.dim))
+    exact.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), ids)
+    embeddings = np.asarray(engine.model.encode(queries, normalize_embeddings=True), dtype="float32")
+    _, reference = exact.search(embeddings, k)
+    _, candidate = engine.search_many(queries, k=k, mode="dense")
+    return {f"recall@{n}": recall_at_k(reference, candidate, min(n, k)) for n in ks}
+
+
+def run_benchmark(size: int, n_queries: int = 200, seed: int = 0, languages: Sequence[str] = ("ru", "en"),
+                  engine_kwargs: Optional[dict] = None, batch_size: int = 32,
+                  pdf_paths: Sequence[str] = (), count_tokens: Optional[Callable[[str], int]] = None) -> dict:
+    """Один прогон: новый движок, индексация size чанков, запросы и recall."""
+    from src.rag_engine import RAGEngine
+    engine = RAGEngine(**(engine_kwargs or {}))
+    result = {"size": size}
+
+    sample = list(iter_synthetic_chunks(min(size, 5000), seed, languages))
+    result["chunking"] = measure_chunking(sample, count_tokens)
+    if pdf_paths:
+        result["pdf_extraction"] = measure_pdf_extraction(pdf_paths, count_tokens)
+    started = time.perf_counter()
+    engine.model.encode(sample[:2000], normalize_embeddings=True)
+    elapsed = time.perf_counter() - started
+    result["encode"] = {"chunks": min(len(sample), 2000), "chunks_per_sec": min(len(sample), 2000) / elapsed}
+
+    started = time.perf_counter()
+    report = engine.add_chunk_stream(iter_synthetic_chunks(size, seed, languages))
+    elapsed = time.perf_counter() - started
+    result["ingest"] = {
+        "seconds": elapsed,
+        "chunks_per_sec": size / elapsed if elapsed else 0.0,
+        "backend": engine.index_backend,
+        **report,
+    }
+
+    queries = synthetic_queries(size, n_queries, seed, languages)
+    _clear_query_caches(engine)
+    cold = []
+    for query in queries:
+        started = time.perf_counter()
+        engine.ask(query)
+        cold.append(time.perf_counter() - started)
+    warm = []
+    for query in queries:
+        started = time.perf_counter()
+        engine.ask(query)
+        warm.append(time.perf_counter() - started)
+    _clear_query_caches(engine)
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        engine.ask_many(queries[start:start + batch_size])
+    elapsed = time.perf_counter() - started
+    result["query"] = {
+        "cold": latency_stats(cold),
+        "warm": latency_stats(warm),
+        "batch": {"batch_size": batch_size, "queries_per_sec": len(queries) / elapsed if elapsed else 0.0},
+    }
+    if engine.translator is not None:
+        english = synthetic_english_prose(min(size, 200), seed)
+        result["translation"] = measure_translation(engine.translator.backends, english)
+        result["translation"]["engine"] = engine.translator.stats()
+    result["recall"] = measure_recall(engine, queries)
+    result["memory"] = {"peak_rss_mb": _peak_rss_mb(), "index_vectors": engine.index.ntotal}
+    return result
+
+
+def _flatten(data: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = 0.2,
+                    recall_tolerance: float = 0.01, latency_floor_ms: float = 0.5) -> List[dict]:
+    """
+    Регрессии относительно базового прогона: скорость и задержки — больше чем
+    на tolerance (доля), recall — больше чем на recall_tolerance (абсолютно).
+    Рост задержки меньше latency_floor_ms считается шумом таймера.
+    Сравниваются только прогоны одинакового размера корпуса.
+    """
+    regressions = []
+    base_runs = {run["size"]: _flatten(run) for run in baseline.get("runs", [])}
+    for run in results.get("runs", []):
+        base = base_runs.get(run["size"])
+        if base is None:
+            continue
+        for name, value in _flatten(run).items():
+            old = base.get(name)
+            metric = name.rsplit(".", 1)[-1]
+            if old is None:
+                continue
+            if metric.startswith("recall@"):
+                regressed = value < old - recall_tolerance
+            elif metric in HIGHER_IS_BETTER:
+                regressed = value < old * (1 - tolerance)
+            elif metric in LOWER_IS_BETTER:
+                regressed = value > old * (1 + tolerance)
+                if metric.endswith("_ms"):
+                    regressed = regressed and value - old > latency_floor_ms
+            else:
+                continue
+            if regressed:
+                change = (value - old) / old if old else float("inf")
+                regressions.append({"size": run["size"], "metric": name, "value": value,
+                                    "baseline": old, "change": change})
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Бенчмарк индексации и поиска RAGEngine")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="размеры корпуса в чанках")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--languages", nargs="+", default=["ru", "en"], choices=sorted(_VOCABULARY))
+    parser.add_argument("--index-backend", default="auto", choices=["auto", *BACKENDS])
+    parser.add_argument("--embedding-backend", default="torch", choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--retrieval-mode", default="hybrid", choices=["dense", "lexical", "hybrid"])
+    parser.add_argument("--chunk-cache", default=None, help="кэш эмбеддингов: повторные прогоны не кодируют корпус")
+    parser.add_argument("--translation", default=None, choices=["ingest", "query"],
+                        help="перевод чанков на русский (нужен пакет Argos en→ru)")
+    parser.add_argument("--pdf", nargs="*", default=[], help="PDF для замера извлечения страниц и нарезки")
+    parser.add_argument("--exact-tokens", action="store_true",
+                        help="резать по токенизатору модели (скачать его при необходимости)")
+    parser.add_argument("--estimate-tokens", action="store_true",
+                        help="резать по оценке estimate_tokens: over_window тогда меряется токенизатором")
+    parser.add_argument("--output", default=None, help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результат в --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    engine_kwargs = {
+        "index_config": {"backend": args.index_backend},
+        "embedding_backend": args.embedding_backend,
+        "retrieval_mode": args.retrieval_mode,
+        "chunk_cache_path": args.chunk_cache,
+        "translation": args.translation,
+    }
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")},
+        "runs": [],
+    }
+    count_tokens = None
+    if args.exact_tokens:
+        from src.chunker import tokenizer_counter
+        count_tokens = tokenizer_counter()
+    elif args.estimate_tokens:
+        from src.chunker import estimate_tokens
+        count_tokens = estimate_tokens
+    for size in args.sizes:
+        run = run_benchmark(size, args.queries, args.seed, args.languages, engine_kwargs, pdf_paths=args.pdf,
+                            count_tokens=count_tokens)
+        results["runs"].append(run)
+        print(f"{size} чанков: индексация {run['ingest']['chunks_per_sec']:.0f} чанков/с, "
+              f"ask p50 {run['query']['cold']['p50_ms']:.1f} мс, p99 {run['query']['cold']['p99_ms']:.1f} мс, "
+              f"recall@10 {run['recall']['recall@10']:.3f}", file=sys.stderr)
+
+    data = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        print(data)
+
+    if args.baseline and args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(data)
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for item in regressions:
+            print(f"Регрессия ({item['size']} чанков) {item['metric']}: {item['baseline']:.4g} → "
+                  f"{item['value']:.4g} ({item['change']:+.0%})", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Лексический поиск BM25 по инвертированному индексу.
+
+Постинги хранятся в array('I') и дописываются по мере добавления чанков,
+при поиске постинги терминов запроса копируются в numpy-массивы под блокировкой,
+а подсчёт идёт уже без неё, поэтому запрос стоит пропорционально длине
+постингов своих терминов, а не размеру корпуса.
+"""
+
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Технические токены целиком: C1212-1002, IEEE802.3ab, switch#vlan, 10/100
+_TOKEN_RE = re.compile(r"\w+(?:[-./#:]\w+)*")
+_PART_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Составной токен и его части: «IEEE802.3ab» → ieee802.3ab, ieee802, 3ab."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_PART_RE.findall(token))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60,
+                           limit: int = 20) -> List[Tuple[int, float]]:
+    """RRF: score(d) = Σ 1 / (k + rank). Идентификаторы < 0 пропускаются."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            if doc_id < 0:
+                continue
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self._doc_ids: List[array] = []
+        self._tfs: List[array] = []
+        self.doc_len = array("I")
+        self.total_len = 0
+        self._norm = None  # k1·(1 - b + b·dl/avgdl), пересчитывается после добавлений
+        # Защищает постинги от дописывания, пока поиск снимает с них копию
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, texts: Iterable[str]):
+        """Добавляет документы с id, продолжающими текущую нумерацию."""
+        docs = []
+        for text in texts:
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            docs.append((counts, len(tokens)))
+        with self._lock:
+            for counts, length in docs:
+                self._add_doc(counts, length)
+
+    def _add_doc(self, counts: Dict[str, int], length: int):
+        doc_id = len(self.doc_len)
+        for token, tf in counts.items():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                term_id = self.vocab[token] = len(self._doc_ids)
+                self._doc_ids.append(array("I"))
+                self._tfs.append(array("I"))
+            self._doc_ids[term_id].append(doc_id)
+            self._tfs[term_id].append(tf)
+        self.doc_len.append(length)
+        self.total_len += length
+        self._norm = None
+
+    def search(self, query: str, k: int = 20,
+               exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Возвращает (scores, ids) длины k, недостающие места заполнены id=-1.
+        exclude — отсортированный массив id, которые не попадают в выдачу.
+        """
+        tokens = tokenize(query)
+        # Под блокировкой постинги терминов запроса только копируются; подсчёт идёт
+        # без неё, так что параллельные запросы не выстраиваются друг за другом
+        with self._lock:
+            postings, n_docs, norm = self._snapshot(tokens)
+        return self._score(postings, n_docs, norm, k, exclude)
+
+    def _snapshot(self, tokens: List[str]) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], int, Optional[np.ndarray]]:
+        term_ids = {self.vocab[t] for t in tokens if t in self.vocab}
+        n_docs = len(self.doc_len)
+        if not term_ids:
+            return [], n_docs, None
+        if self._norm is None:
+            doc_len = np.frombuffer(self.doc_len, dtype=np.uint32).astype("float32")
+            avgdl = max(self.total_len / n_docs, 1.0)
+            self._norm = self.k1 * (1.0 - self.b + self.b * doc_len / avgdl)
+        # _norm после добавлений не меняется на месте, а заменяется — ссылки на него достаточно
+        postings = [(np.array(self._doc_ids[t], dtype=np.uint32), np.array(self._tfs[t], dtype=np.uint32))
+                    for t in term_ids]
+        return postings, n_docs, self._norm
+
+    def _score(self, postings: List[Tuple[np.ndarray, np.ndarray]], n_docs: int, norm: Optional[np.ndarray],
+               k: int, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        scores_out = np.zeros(k, dtype="float32")
+        ids_out = np.full(k, -1, dtype="int64")
+        if not postings or k <= 0:
+            return scores_out, ids_out
+
+        all_ids, all_scores = [], []
+        for ids, tfs in postings:
+            tfs = tfs.astype("float32")
+            idf = np.log(1.0 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm[ids]))
+
+        ids = np.concatenate(all_ids)
+        weights = np.concatenate(all_scores)
+        if len(ids) > n_docs // 16:
+            # Частые термины: плотный аккумулятор дешевле сортировки в np.unique
+            totals = np.bincount(ids, weights=weights, minlength=n_docs)
+            unique_ids = np.flatnonzero(totals)
+            totals = totals[unique_ids]
+        else:
+            unique_ids, inverse = np.unique(ids, return_inverse=True)
+            totals = np.bincount(inverse, weights=weights)
+        if exclude is not None and len(exclude):
+            keep = ~np.isin(unique_ids, exclude, assume_unique=True)
+            unique_ids, totals = unique_ids[keep], totals[keep]
+            if not len(unique_ids):
+                return scores_out, ids_out
+        top = min(k, len(unique_ids))
+        best = np.argpartition(-totals, top - 1)[:top]
+        best = best[np.argsort(-totals[best], kind="stable")]
+        scores_out[:top] = totals[best]
+        ids_out[:top] = unique_ids[best]
+        return scores_out, ids_out
+
+    def merge(self, other: "BM25Index"):
+        """Дописывает другой индекс, сдвигая его id на текущее число документов."""
+        with self._lock:
+            self._merge(other)
+
+    def _merge(self, other: "BM25Index"):
+        offset = len(self.doc_len)
+        for token, other_id in other.vocab.items():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                term_id = self.vocab[token] = len(self._doc_ids)
+                self._doc_ids.append(array("I"))
+                self._tfs.append(array("I"))
+            shifted = np.frombuffer(other._doc_ids[other_id], dtype=np.uint32) + np.uint32(offset)
+            self._doc_ids[term_id].frombytes(shifted.tobytes())
+            self._tfs[term_id].extend(other._tfs[other_id])
+        self.doc_len.extend(other.doc_len)
+        self.total_len += other.total_len
+        self._norm = None
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            self.save_to(f)
+
+    def save_to(self, f):
+        with self._lock:
+            terms = sorted(self.vocab, key=self.vocab.get)
+            lengths = np.array([len(self._doc_ids[self.vocab[t]]) for t in terms], dtype=np.uint64)
+            ids = b"".join(self._doc_ids[self.vocab[t]].tobytes() for t in terms)
+            tfs = b"".join(self._tfs[self.vocab[t]].tobytes() for t in terms)
+            doc_len = self.doc_len.tobytes()
+        np.savez(
+            f,
+            terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            lengths=lengths,
+            ids=np.frombuffer(ids, dtype=np.uint32),
+            tfs=np.frombuffer(tfs, dtype=np.uint32),
+            doc_len=np.frombuffer(doc_len, dtype=np.uint32),
+            params=np.array([self.k1, self.b]),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            k1, b = data["params"]
+            index = cls(k1=float(k1), b=float(b))
+            text = data["terms"].tobytes().decode("utf-8")
+            terms = text.split("\n") if text else []
+            bounds = np.concatenate([[0], np.cumsum(data["lengths"])]).astype(np.int64)
+            ids, tfs = data["ids"], data["tfs"]
+            for term_id, term in enumerate(terms):
+                index.vocab[term] = term_id
+                start, end = bounds[term_id], bounds[term_id + 1]
+                index._doc_ids.append(array("I", ids[start:end].tobytes()))
+                index._tfs.append(array("I", tfs[start:end].tobytes()))
+            index.doc_len = array("I", data["doc_len"].tobytes())
+            index.total_len = int(np.sum(data["doc_len"], dtype=np.int64))
+        return index
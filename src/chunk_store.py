@@ -0,0 +1,204 @@
+"""
+Компактное хранилище текстов чанков: массив смещений (uint64) и UTF-8 blob.
+Оба файла открываются через mmap, поэтому текст чанка декодируется только при
+обращении к нему, а страницы файла делятся между процессами через page cache.
+"""
+
+import bisect
+import mmap
+import os
+from array import array
+from typing import Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+OFFSETS_SUFFIX = ".offsets.npy"
+BLOB_SUFFIX = ".blob"
+# Метаданные чанка: id документа (0 — неизвестен), страница и номер главы с 1
+CHUNK_META_DTYPE = np.dtype([("doc", "<u4"), ("page", "<u4"), ("chapter", "<u4")])
+
+
+def chunk_store_exists(prefix: str) -> bool:
+    return os.path.exists(prefix + OFFSETS_SUFFIX) and os.path.exists(prefix + BLOB_SUFFIX)
+
+
+def _replace_synced(tmp_path: str, path: str):
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_chunk_store(prefix: str, chunks: Iterable[str]) -> int:
+    """Пишет чанки потоково и возвращает их число. Файлы появляются атомарно."""
+    offsets = [0]
+    blob_tmp = prefix + BLOB_SUFFIX + ".tmp"
+    with open(blob_tmp, "wb") as f:
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    _write_offsets(prefix, np.asarray(offsets, dtype="uint64"))
+    _replace_synced(blob_tmp, prefix + BLOB_SUFFIX)
+    return len(offsets) - 1
+
+
+def concat_chunk_stores(prefix: str, parts: Sequence["ChunkStore"]) -> int:
+    """Склеивает хранилища копированием байтов, без декодирования текста."""
+    offsets = [np.zeros(1, dtype="uint64")]
+    shift = 0
+    blob_tmp = prefix + BLOB_SUFFIX + ".tmp"
+    with open(blob_tmp, "wb") as f:
+        for part in parts:
+            f.write(part.raw_bytes())
+            offsets.append(part.offsets[1:] + np.uint64(shift))
+            shift += int(part.offsets[-1])
+    merged = np.concatenate(offsets)
+    _write_offsets(prefix, merged)
+    _replace_synced(blob_tmp, prefix + BLOB_SUFFIX)
+    return len(merged) - 1
+
+
+def _write_offsets(prefix: str, offsets: np.ndarray):
+    tmp_path = prefix + OFFSETS_SUFFIX + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, offsets)
+    _replace_synced(tmp_path, prefix + OFFSETS_SUFFIX)
+
+
+class ChunkStore:
+    """Неизменяемая последовательность чанков поверх mmap."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.offsets = np.load(prefix + OFFSETS_SUFFIX, mmap_mode="r")
+        size = os.path.getsize(prefix + BLOB_SUFFIX)
+        if size:
+            with open(prefix + BLOB_SUFFIX, "rb") as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b""
+
+    @classmethod
+    def from_buffers(cls, offsets: np.ndarray, blob) -> "ChunkStore":
+        """Хранилище поверх готовых буферов (например, секций одного mmap снимка)."""
+        store = cls.__new__(cls)
+        store.prefix = None
+        store.offsets = offsets
+        store._blob = blob
+        return store
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self._blob[int(self.offsets[i]):int(self.offsets[i + 1])]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw_bytes(self) -> bytes:
+        return bytes(self._blob[:int(self.offsets[-1])])
+
+
+class ChunkList:
+    """
+    Чанки движка: несколько неизменяемых частей (ChunkStore из сегментов)
+    и хвост ещё не сохранённых строк в памяти. Индекс в списке — id FAISS.
+    """
+
+    def __init__(self, parts: Iterable[Sequence[str]] = ()):
+        self._parts = [part for part in parts if len(part)]
+        self._starts = []
+        total = 0
+        for part in self._parts:
+            self._starts.append(total)
+            total += len(part)
+        self._frozen_len = total
+        self._tail = []
+
+    @property
+    def parts(self) -> List[Sequence[str]]:
+        return self._parts + ([self._tail] if self._tail else [])
+
+    def __len__(self) -> int:
+        return self._frozen_len + len(self._tail)
+
+    def _get(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i >= self._frozen_len:
+            return self._tail[i - self._frozen_len]
+        part_no = bisect.bisect_right(self._starts, i) - 1
+        return self._parts[part_no][i - self._starts[part_no]]
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self)))]
+        return self._get(int(i))
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (ChunkList, list)) or len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    def persist_tail(self, part: Sequence[str]):
+        """Заменяет сохранённый хвост его копией на диске, освобождая память."""
+        if len(part) != len(self._tail):
+            raise ValueError("Сохранённая часть не совпадает с хвостом")
+        if len(part):
+            self._parts.append(part)
+            self._starts.append(self._frozen_len)
+            self._frozen_len += len(part)
+        self._tail = []
+
+    def append(self, chunk: str):
+        self._tail.append(chunk)
+
+    def extend(self, chunks: Iterable[str]):
+        self._tail.extend(chunks)
+
+
+class ChunkMeta:
+    """Метаданные чанков по id: три массива uint32, дописываемых вместе с чанками."""
+
+    def __init__(self, rows: Union[np.ndarray, None] = None):
+        self.doc = array("I")
+        self.page = array("I")
+        self.chapter = array("I")
+        if rows is not None:
+            self.doc.frombytes(np.ascontiguousarray(rows["doc"], dtype="<u4").tobytes())
+            self.page.frombytes(np.ascontiguousarray(rows["page"], dtype="<u4").tobytes())
+            self.chapter.frombytes(np.ascontiguousarray(rows["chapter"], dtype="<u4").tobytes())
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    def __getitem__(self, i: int) -> Tuple[int, int, int]:
+        return self.doc[i], self.page[i], self.chapter[i]
+
+    def __setitem__(self, i: int, row: Tuple[int, int, int]):
+        self.doc[i], self.page[i], self.chapter[i] = row
+
+    def append(self, doc: int, page: int = 0, chapter: int = 0):
+        self.doc.append(doc)
+        self.page.append(page)
+        self.chapter.append(chapter)
+
+    def to_array(self, start: int = 0, end: Union[int, None] = None) -> np.ndarray:
+        end = len(self) if end is None else end
+        rows = np.zeros(end - start, dtype=CHUNK_META_DTYPE)
+        rows["doc"] = self.doc[start:end]
+        rows["page"] = self.page[start:end]
+        rows["chapter"] = self.chapter[start:end]
+        return rows
@@ -0,0 +1,238 @@
+"""
+Нарезка глав на чанки по бюджету токенов модели эмбеддингов.
+
+MiniLM видит 128 токенов вместе со служебными <s> и </s>, всё длиннее
+обрезается при кодировании. Чанк набирается из целых предложений, пока они
+помещаются в бюджет; следующий чанк начинается с хвоста предыдущего
+(перекрытие до overlap_tokens), чтобы ответ на стыке чанков не терялся.
+Таблица («Таблица 7.10 …» и строки за ней) режется только между строками,
+а её продолжение в следующем чанке снова начинается с подписи таблицы.
+
+Токены по умолчанию считает токенизатор модели (default_counter), если он уже
+лежит в локальном кэше HuggingFace; без него — оценка estimate_tokens с запасом,
+откалиброванная по токенизатору (tests/test_chunker.py).
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+
+MODEL_MAX_TOKENS = 128
+# Запас на <s>, </s> и погрешность оценки
+CHUNK_TOKENS = MODEL_MAX_TOKENS - 8
+OVERLAP_TOKENS = 24
+# Чанки короче этого (обрывки строк, одинокие номера) не индексируются
+MIN_CHUNK_CHARS = 30
+
+_TABLE_CAPTION_RE = re.compile(r"(?:таблица|табл\.|table)\s*\d+(?:\.\d+)*", re.IGNORECASE)
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+_SENTENCE_END = (".", "!", "?", ";")
+_PROSE_END = (".", "!", "?")
+
+
+@lru_cache(maxsize=1 << 16)
+def estimate_tokens(word: str) -> int:
+    """
+    Оценка числа токенов sentencepiece (XLM-R) для одного слова: буквенные
+    куски — по 5 символов кириллицы или 6 латиницы на токен, числа — по 3 цифры,
+    каждый знак препинания — отдельный токен.
+    """
+    tokens = 0
+    for piece in _PIECE_RE.findall(word):
+        first = piece[0]
+        if first.isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif first.isalpha():
+            size = 6 if first.isascii() else 5
+            tokens += (len(piece) + size - 1) // size
+        else:
+            tokens += 1
+    return max(tokens, 1)
+
+
+def tokenizer_counter(model_name: Optional[str] = None, local_files_only: bool = False) -> Callable[[str], int]:
+    """Точный счётчик токенов слова по токенизатору модели (transformers импортируется здесь)."""
+    from transformers import AutoTokenizer
+
+    from src.embedders import MODEL_NAME
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name or MODEL_NAME, local_files_only=local_files_only)
+
+    @lru_cache(maxsize=1 << 16)
+    def count(word: str) -> int:
+        return max(1, len(tokenizer.tokenize(word)))
+
+    return count
+
+
+@lru_cache(maxsize=None)
+def default_counter() -> Callable[[str], int]:
+    """Токенизатор модели из локального кэша (без сети), иначе estimate_tokens."""
+    try:
+        return tokenizer_counter(local_files_only=True)
+    except (ImportError, OSError, ValueError):
+        return estimate_tokens
+
+
+def is_table_caption(line: str) -> bool:
+    return _TABLE_CAPTION_RE.match(line) is not None
+
+
+def is_prose_line(line: str) -> bool:
+    """Строка связного текста, а не строка таблицы: не меньше 6 слов и конец предложения."""
+    return line.endswith(_PROSE_END) and len(line.split()) >= 6
+
+
+class _Piece:
+    """Предложение, строка таблицы или подпись: слова, их токены и номера строк главы."""
+
+    __slots__ = ("kind", "words", "costs", "lines", "tokens")
+
+    def __init__(self, kind: str, words: List[str], costs: List[int], lines: List[int]):
+        self.kind = kind  # "text", "row" или "caption"
+        self.words = words
+        self.costs = costs
+        self.lines = lines
+        self.tokens = sum(costs)
+
+    def slice(self, start: int, end: Optional[int] = None) -> "_Piece":
+        return _Piece(self.kind, self.words[start:end], self.costs[start:end], self.lines[start:end])
+
+    def text(self) -> str:
+        return " ".join(self.words)
+
+
+def _pieces(lines: Sequence[str], count: Callable[[str], int]) -> List[_Piece]:
+    pieces = []
+    words, costs, owners = [], [], []
+
+    def flush():
+        if words:
+            pieces.append(_Piece("text", words[:], costs[:], owners[:]))
+            del words[:], costs[:], owners[:]
+
+    in_table = False
+    for line_no, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        line_words = line.split()
+        if is_table_caption(line) or (in_table and not is_prose_line(line)):
+            flush()
+            kind = "caption" if is_table_caption(line) else "row"
+            pieces.append(_Piece(kind, line_words, [count(w) for w in line_words], [line_no] * len(line_words)))
+            in_table = True
+            continue
+        in_table = False
+        # Связный текст собирается в предложения через переносы строк; слова
+        # переносятся срезами между концами предложений, а не по одному
+        line_costs = list(map(count, line_words))
+        start = 0
+        for end in [i + 1 for i, word in enumerate(line_words) if word.endswith(_SENTENCE_END)]:
+            words.extend(line_words[start:end])
+            costs.extend(line_costs[start:end])
+            owners.extend([line_no] * (end - start))
+            flush()
+            start = end
+        words.extend(line_words[start:])
+        costs.extend(line_costs[start:])
+        owners.extend([line_no] * (len(line_words) - start))
+    flush()
+    return pieces
+
+
+def _split_oversized(piece: _Piece, limit: int) -> List[_Piece]:
+    """Предложение или строка длиннее бюджета режется по словам."""
+    parts, start, used = [], 0, 0
+    for i, cost in enumerate(piece.costs):
+        if used + cost > limit and i > start:
+            parts.append(piece.slice(start, i))
+            start, used = i, 0
+        used += cost
+    parts.append(piece.slice(start))
+    return parts
+
+
+def _tail(pieces: List[_Piece], budget: int) -> List[_Piece]:
+    """Перекрытие: последние целые предложения чанка, иначе хвост последнего по словам."""
+    carry, used = [], 0
+    for piece in reversed(pieces):
+        if piece.kind != "text" or used + piece.tokens > budget:
+            break
+        carry.insert(0, piece)
+        used += piece.tokens
+    if carry or not pieces or pieces[-1].kind != "text":
+        return carry
+    last = pieces[-1]
+    start, used = len(last.costs), 0
+    while start > 0 and used + last.costs[start - 1] <= budget:
+        start -= 1
+        used += last.costs[start]
+    return [last.slice(start)] if start < len(last.costs) else []
+
+
+def _head(piece: _Piece, budget: int) -> List[_Piece]:
+    """Начало подписи таблицы, которое помещается в перекрытие."""
+    end, used = 0, 0
+    while end < len(piece.costs) and used + piece.costs[end] <= budget:
+        used += piece.costs[end]
+        end += 1
+    return [piece.slice(0, end)] if end else []
+
+
+def _render(pieces: List[_Piece]) -> str:
+    # Предложения идут через пробел, строки таблицы — каждая с новой строки
+    out = []
+    for i, piece in enumerate(pieces):
+        if i:
+            out.append(" " if piece.kind == "text" and pieces[i - 1].kind == "text" else "\n")
+        out.append(piece.text())
+    return "".join(out)
+
+
+def chunk_lines(lines: Sequence[str], max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                count_tokens: Optional[Callable[[str], int]] = None) -> List[Tuple[int, str]]:
+    """
+    Режет строки главы на чанки не длиннее max_tokens токенов.
+    Возвращает пары (номер строки главы, с которой начинается чанк, текст).
+    """
+    if not 0 <= overlap_tokens < max_tokens // 2:
+        raise ValueError("overlap_tokens должен быть меньше половины max_tokens")
+    count = count_tokens or default_counter()
+    chunks = []
+    current, used, fresh = [], 0, 0
+    caption = None
+
+    def emit():
+        text = _render(current)
+        if fresh and len(text) > MIN_CHUNK_CHARS:
+            chunks.append((current[0].lines[0], text))
+
+    for unit in _pieces(lines, count):
+        caption = unit if unit.kind == "caption" else (caption if unit.kind == "row" else None)
+        for piece in _split_oversized(unit, max_tokens - overlap_tokens):
+            if used + piece.tokens > max_tokens and fresh:
+                emit()
+                if piece.kind == "row" and caption is not None:
+                    carry = _head(caption, overlap_tokens)
+                elif piece.kind == "text":
+                    carry = _tail(current, overlap_tokens)
+                else:
+                    carry = []
+                current, used, fresh = carry, sum(p.tokens for p in carry), 0
+            current.append(piece)
+            used += piece.tokens
+            fresh += 1
+    if current:
+        emit()
+    return chunks
+
+
+def split_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+               count_tokens: Optional[Callable[[str], int]] = None) -> List[str]:
+    return [chunk for _, chunk in chunk_lines(text.splitlines(), max_tokens, overlap_tokens, count_tokens)]
+
+
+def count_chunk_tokens(chunk: str, count_tokens: Optional[Callable[[str], int]] = None) -> int:
+    count = count_tokens or default_counter()
+    return sum(count(word) for word in chunk.split())
@@ -0,0 +1,156 @@
+"""
+Дедупликация чанков при индексации: точные дубли по хешу нормализованного
+текста и почти-дубли по SimHash (64 бита, поиск кандидатов по 4 полосам).
+"""
+
+import hashlib
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+SIMHASH_BANDS = 4
+_BAND_BITS = 64 // SIMHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def content_hash(text: str) -> int:
+    """Регистр и пробелы не влияют на хеш."""
+    return _hash64(" ".join(text.split()).lower())
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < shingle:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle]) for i in range(len(words) - shingle + 1)]
+    hashes = np.array([_hash64(s) for s in shingles], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.astype(np.int32).sum(axis=0) * 2 - len(shingles)
+    packed = np.packbits(votes > 0, bitorder="little")
+    return int(packed.view(np.uint64)[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class DedupIndex:
+    """
+    Хеши уже проиндексированных чанков: id FAISS по хешу содержимого и
+    таблицы полос SimHash. При расстоянии Хэмминга ≤ 3 хотя бы одна из
+    4 полос по 16 бит совпадает, поэтому кандидатов ищем по полосам.
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self._by_content: Dict[int, int] = {}
+        self._digests: Dict[int, int] = {}
+        self._simhashes: Dict[int, int] = {}
+        self._bands: Optional[List[Dict[int, List[int]]]] = None
+        # Массивы из register_many раскладываются по словарям при первом обращении:
+        # загрузка индекса не платит за миллион вставок, пока дедупликация не нужна
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._simhashes) + sum(len(ids) for ids, _, _ in self._pending)
+
+    def _materialize(self):
+        with self._lock:
+            for ids, digests, fingerprints in self._pending:
+                for doc_id, digest, fingerprint in zip(ids.tolist(), digests.tolist(), fingerprints.tolist()):
+                    self._register(doc_id, digest, fingerprint)
+            self._pending = []
+
+    @property
+    def by_content(self) -> Dict[int, int]:
+        if self._pending:
+            self._materialize()
+        return self._by_content
+
+    @property
+    def digests(self) -> Dict[int, int]:
+        if self._pending:
+            self._materialize()
+        return self._digests
+
+    @property
+    def simhashes(self) -> Dict[int, int]:
+        if self._pending:
+            self._materialize()
+        return self._simhashes
+
+    def find_exact(self, digest: int) -> Optional[int]:
+        return self.by_content.get(digest)
+
+    def find_near(self, fingerprint: int) -> Optional[int]:
+        bands = self._band_tables()
+        for band_no in range(SIMHASH_BANDS):
+            key = (fingerprint >> (band_no * _BAND_BITS)) & _BAND_MASK
+            for doc_id in bands[band_no].get(key, ()):
+                if hamming(fingerprint, self.simhashes[doc_id]) <= self.max_distance:
+                    return doc_id
+        return None
+
+    def register(self, doc_id: int, digest: int, fingerprint: int):
+        if self._pending:
+            self._materialize()
+        self._register(doc_id, digest, fingerprint)
+
+    def _register(self, doc_id: int, digest: int, fingerprint: int):
+        self._by_content.setdefault(digest, doc_id)
+        self._digests[doc_id] = digest
+        self._simhashes[doc_id] = fingerprint
+        if self._bands is not None:
+            self._add_to_bands(doc_id, fingerprint)
+
+    def unregister(self, doc_id: int):
+        """Забывает чанк, чтобы такой же текст снова можно было проиндексировать."""
+        digest = self.digests.pop(doc_id, None)
+        if digest is None:
+            return
+        if self.by_content.get(digest) == doc_id:
+            del self.by_content[digest]
+        fingerprint = self.simhashes.pop(doc_id)
+        if self._bands is not None:
+            for band_no in range(SIMHASH_BANDS):
+                key = (fingerprint >> (band_no * _BAND_BITS)) & _BAND_MASK
+                bucket = self._bands[band_no].get(key)
+                if bucket and doc_id in bucket:
+                    bucket.remove(doc_id)
+
+    def register_many(self, ids: Sequence[int], digests: Sequence[int], fingerprints: Sequence[int]):
+        self._pending.append((np.asarray(ids, dtype=np.int64), np.asarray(digests, dtype=np.uint64),
+                              np.asarray(fingerprints, dtype=np.uint64)))
+
+    def export(self, ids: Iterable[int]) -> np.ndarray:
+        """Хеши чанков с заданными id в формате hash_chunks; у забытых чанков — нули."""
+        rows = [(self.digests.get(doc_id, 0), self.simhashes.get(doc_id, 0)) for doc_id in ids]
+        return np.array(rows, dtype=np.uint64).reshape(-1, 2)
+
+    def _band_tables(self) -> List[Dict[int, List[int]]]:
+        # Таблицы полос строятся лениво: без поиска почти-дублей они не нужны
+        if self._bands is None:
+            self._bands = [{} for _ in range(SIMHASH_BANDS)]
+            for doc_id, fingerprint in self.simhashes.items():
+                self._add_to_bands(doc_id, fingerprint)
+        return self._bands
+
+    def _add_to_bands(self, doc_id: int, fingerprint: int):
+        for band_no in range(SIMHASH_BANDS):
+            key = (fingerprint >> (band_no * _BAND_BITS)) & _BAND_MASK
+            self._bands[band_no].setdefault(key, []).append(doc_id)
+
+
+def hash_chunks(chunks) -> np.ndarray:
+    """Массив (n, 2) uint64: хеш содержимого и SimHash каждого чанка."""
+    rows = [(content_hash(chunk), simhash(chunk)) for chunk in chunks]
+    return np.array(rows, dtype=np.uint64).reshape(-1, 2)
@@ -0,0 +1,254 @@
+"""
+Бэкенды эмбеддингов для CPU: исходная модель на PyTorch, экспорт в ONNX Runtime
+и ONNX с динамическим int8-квантованием. Перед переключением на быстрый
+бэкенд стоит проверить его parity_report на своих чанках:
+
+    python -m src.embedders --folder models --backends onnx onnx_int8
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+if TYPE_CHECKING:
+    # sentence_transformers тянет torch — импортируется только при загрузке модели
+    from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+# Набор инструкций для квантования: avx2 работает почти на любом x86-сервере
+DEFAULT_QUANTIZATION = "avx2"
+
+
+class Embedder:
+    """
+    Обёртка над SentenceTransformer с фиксированным размером батча.
+    Повторяет интерфейс модели, которым пользуется RAGEngine.
+    """
+
+    def __init__(self, model, backend: str, batch_size: int = 32, name: Optional[str] = None):
+        self.model = model
+        self.backend = backend
+        self.batch_size = batch_size
+        # Имя различает векторы разных бэкендов одной модели в постоянном кэше
+        self.name = name or backend
+
+    def encode(self, texts: Sequence[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        kwargs.setdefault("batch_size", self.batch_size)
+        embeddings = self.model.encode(
+            list(texts), normalize_embeddings=normalize_embeddings, convert_to_numpy=True, **kwargs,
+        )
+        return np.asarray(embeddings, dtype="float32")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+def _onnx_model_kwargs(num_threads: Optional[int], file_name: Optional[str] = None) -> dict:
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(
+            "Для ONNX-бэкенда нужен onnxruntime: pip install sentence-transformers[onnx]"
+        ) from e
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+    if file_name:
+        kwargs["file_name"] = file_name
+    return kwargs
+
+
+def _quantized_model(model_name: str, cache_dir: str, quantization: str,
+                     num_threads: Optional[int]) -> "SentenceTransformer":
+    """Квантованная модель экспортируется один раз и дальше берётся из cache_dir."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    target = os.path.join(cache_dir, model_name.replace("/", "__") + "-onnx")
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(target, file_name)):
+        model = SentenceTransformer(model_name, backend="onnx", model_kwargs=_onnx_model_kwargs(num_threads))
+        model.save(target)
+        export_dynamic_quantized_onnx_model(model, quantization, target)
+    return SentenceTransformer(
+        target, backend="onnx", model_kwargs=_onnx_model_kwargs(num_threads, file_name),
+    )
+
+
+def embedder_name(backend: str = "torch", model_name: str = MODEL_NAME,
+                  quantization: str = DEFAULT_QUANTIZATION) -> str:
+    """Имя векторов модели и бэкенда (ключ постоянного кэша) без загрузки модели."""
+    name = model_name if backend == "torch" else f"{model_name}#{backend}"
+    if backend == "onnx_int8":
+        name += f"_{quantization}"
+    return name
+
+
+def _load_model(backend: str, model_name: str, num_threads: Optional[int], cache_dir: str,
+                quantization: str) -> "SentenceTransformer":
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs=_onnx_model_kwargs(num_threads))
+    return _quantized_model(model_name, cache_dir, quantization, num_threads)
+
+
+def load_embedder(backend: str = "torch", model_name: str = MODEL_NAME,
+                  num_threads: Optional[int] = None, batch_size: int = 32,
+                  cache_dir: str = "models/embedders",
+                  quantization: str = DEFAULT_QUANTIZATION) -> Embedder:
+    """
+    backend: "torch" — исходная модель, "onnx" — та же модель в ONNX Runtime,
+    "onnx_int8" — ONNX с динамическим int8-квантованием весов.
+    num_threads ограничивает внутрипоточный параллелизм (None — по числу ядер).
+    """
+    model = _load_model(backend, model_name, num_threads, cache_dir, quantization)
+    return Embedder(model, backend, batch_size, embedder_name(backend, model_name, quantization))
+
+
+_shared_models = {}
+_shared_lock = threading.Lock()
+
+
+def shared_embedder(backend: str = "torch", model_name: str = MODEL_NAME,
+                    num_threads: Optional[int] = None, batch_size: int = 32,
+                    cache_dir: str = "models/embedders",
+                    quantization: str = DEFAULT_QUANTIZATION) -> Embedder:
+    """Как load_embedder, но одна модель на процесс для одинаковых параметров."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+    key = (backend, model_name, num_threads, cache_dir, quantization)
+    with _shared_lock:
+        model = _shared_models.get(key)
+        if model is None:
+            model = _shared_models[key] = _load_model(backend, model_name, num_threads, cache_dir, quantization)
+    return Embedder(model, backend, batch_size, embedder_name(backend, model_name, quantization))
+
+
+class LazyEmbedder:
+    """
+    Embedder, который загружает (общую на процесс) модель при первом encode.
+    Имя известно сразу, поэтому кэш эмбеддингов и загрузка индекса модель не трогают.
+    """
+
+    def __init__(self, backend: str = "torch", model_name: str = MODEL_NAME, **kwargs):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+        self.backend = backend
+        self.batch_size = kwargs.get("batch_size", 32)
+        self.name = embedder_name(backend, model_name, kwargs.get("quantization", DEFAULT_QUANTIZATION))
+        self._args = dict(kwargs, backend=backend, model_name=model_name)
+        self._embedder = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._embedder is not None
+
+    def _get(self) -> Embedder:
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    self._embedder = shared_embedder(**self._args)
+        return self._embedder
+
+    @property
+    def model(self):
+        return self._get().model
+
+    def encode(self, texts: Sequence[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        return self._get().encode(texts, normalize_embeddings=normalize_embeddings, **kwargs)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._get().get_sentence_embedding_dimension()
+
+
+def recall_at_k(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """Средняя доля общих id в top-k двух выдач одинаковой формы (nq, ≥k)."""
+    hits = [len(set(ref[:k]) & set(cand[:k])) for ref, cand in zip(reference, candidate)]
+    return float(np.mean(hits) / k) if hits else 0.0
+
+
+def _timed_encode(embedder, texts: List[str]):
+    started = time.perf_counter()
+    embeddings = np.asarray(embedder.encode(texts, normalize_embeddings=True), dtype="float32")
+    return embeddings, time.perf_counter() - started
+
+
+def parity_report(reference, candidate, chunks: Sequence[str], queries: Optional[Sequence[str]] = None,
+                  k: int = 10, max_chunks: Optional[int] = 2000, seed: int = 0) -> dict:
+    """
+    Сравнивает кандидата с эталонной float-моделью на наших чанках: оба
+    кодируют один и тот же корпус и запросы, точный поиск по каждому
+    пространству даёт top-k, recall@k — доля совпавших id.
+    Без явных запросов запросами служат первые предложения случайных чанков.
+    """
+    chunks = list(chunks)
+    rng = np.random.default_rng(seed)
+    if max_chunks is not None and len(chunks) > max_chunks:
+        chunks = [chunks[i] for i in sorted(rng.choice(len(chunks), max_chunks, replace=False))]
+    if queries is None:
+        picked = rng.choice(len(chunks), min(len(chunks), 200), replace=False)
+        queries = [chunks[i].split(". ")[0][:200] for i in picked]
+    queries = list(queries)
+    k = min(k, len(chunks))
+
+    report = {"chunks": len(chunks), "queries": len(queries), "k": k}
+    results = []
+    for name, embedder in (("reference", reference), ("candidate", candidate)):
+        corpus, elapsed = _timed_encode(embedder, chunks)
+        query_embs, _ = _timed_encode(embedder, queries)
+        index = faiss.IndexFlatIP(corpus.shape[1])
+        index.add(corpus)
+        _, ids = index.search(query_embs, k)
+        results.append((corpus, ids))
+        report[f"{name}_chunks_per_sec"] = len(chunks) / elapsed if elapsed else float("inf")
+    (ref_corpus, ref_ids), (cand_corpus, cand_ids) = results
+    report[f"recall@{k}"] = recall_at_k(ref_ids, cand_ids, k)
+    if ref_corpus.shape == cand_corpus.shape:
+        cosines = np.sum(ref_corpus * cand_corpus, axis=1)
+        report["mean_cosine"] = float(np.mean(cosines))
+        report["min_cosine"] = float(np.min(cosines))
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Проверка быстрых бэкендов эмбеддингов на чанках индекса")
+    parser.add_argument("--folder", default="models", help="папка сохранённого индекса")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx_int8"], choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--max-chunks", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    from src.segment_store import SegmentStore
+    store = SegmentStore(args.folder)
+    manifest = store.read_manifest()
+    if manifest is None:
+        raise SystemExit(f"Индекс не найден в {args.folder}")
+    _, _, chunks = store.load(manifest)
+    reference = load_embedder("torch", num_threads=args.threads, batch_size=args.batch_size)
+    for backend in args.backends:
+        candidate = load_embedder(backend, num_threads=args.threads, batch_size=args.batch_size)
+        report = parity_report(reference, candidate, chunks, k=args.k, max_chunks=args.max_chunks)
+        print(json.dumps({"backend": backend, **report}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
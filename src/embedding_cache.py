@@ -0,0 +1,205 @@
+"""
+Постоянный кэш эмбеддингов чанков в SQLite (WAL). Ключ — имя модели и хеш
+точного текста чанка, поэтому после смены типа индекса, правки чанкера или
+восстановления индекса перекодируются только действительно новые чанки.
+
+Удалить векторы чанков, которых больше нет в индексе:
+
+    python -m src.embedding_cache prune --db models/embeddings.sqlite --folder models
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQL_BATCH = 500
+
+
+def text_key(text: str) -> bytes:
+    """Хеш точного текста: в отличие от dedup.content_hash регистр здесь важен для модели."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    Векторы хранятся как float32 BLOB. При превышении max_entries вытесняются
+    записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = 1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, key BLOB NOT NULL, vector BLOB NOT NULL,"
+                " last_used INTEGER NOT NULL, PRIMARY KEY (model, key)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+            # Число записей считается один раз при открытии и дальше ведётся счётчиком
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, model: str, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """Найденные векторы по ключу; время обращения обновляется одним запросом."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time_ns()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for start in range(0, len(unique), _SQL_BATCH):
+                    batch = unique[start:start + _SQL_BATCH]
+                    marks = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({marks})",
+                        [model, *batch],
+                    ).fetchall()
+                    for key, vector in rows:
+                        found[key] = np.frombuffer(vector, dtype="float32")
+                    if rows:
+                        hit_keys = [key for key, _ in rows]
+                        self._conn.execute(
+                            f"UPDATE embeddings SET last_used = ? WHERE model = ?"
+                            f" AND key IN ({','.join('?' * len(hit_keys))})",
+                            [now, model, *hit_keys],
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, model: str, keys: Sequence[bytes], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        now = time.time_ns()
+        rows = list({key: (model, key, vector.tobytes(), now) for key, vector in zip(keys, vectors)}.values())
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                added = len(rows) - self._count_existing(model, [row[1] for row in rows])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                evicted = self._evict(self._count + added)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count += added - evicted
+
+    def _count_existing(self, model: str, keys: List[bytes]) -> int:
+        """Сколько ключей уже есть в кэше: поиск по первичному ключу, без обхода таблицы."""
+        existing = 0
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            existing += self._conn.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                [model, *batch],
+            ).fetchone()[0]
+        return existing
+
+    def _evict(self, count: int) -> int:
+        if self.max_entries is None or count <= self.max_entries:
+            return 0
+        cursor = self._conn.execute(
+            "DELETE FROM embeddings WHERE (model, key) IN"
+            " (SELECT model, key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (count - self.max_entries,),
+        )
+        return cursor.rowcount
+
+    def prune(self, model: Optional[str], live_texts: Iterable[str]) -> int:
+        """
+        Удаляет векторы чанков, которых нет среди live_texts. model=None —
+        чистить записи всех моделей. Возвращает число удалённых записей.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_keys (key BLOB PRIMARY KEY)")
+                self._conn.execute("DELETE FROM live_keys")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO live_keys (key) VALUES (?)",
+                    ((text_key(text),) for text in live_texts),
+                )
+                condition = "key NOT IN (SELECT key FROM live_keys)"
+                if model is None:
+                    cursor = self._conn.execute(f"DELETE FROM embeddings WHERE {condition}")
+                else:
+                    cursor = self._conn.execute(
+                        f"DELETE FROM embeddings WHERE model = ? AND {condition}", (model,)
+                    )
+                self._conn.execute("DROP TABLE live_keys")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count -= cursor.rowcount
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": dict(rows),
+            }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Обслуживание постоянного кэша эмбеддингов")
+    parser.add_argument("command", choices=["prune", "stats"])
+    parser.add_argument("--db", default="models/embeddings.sqlite", help="файл кэша")
+    parser.add_argument("--folder", default="models", help="папка сохранённого индекса")
+    parser.add_argument("--model", default=None, help="чистить только записи этой модели")
+    args = parser.parse_args(argv)
+
+    cache = EmbeddingCache(args.db, max_entries=None)
+    if args.command == "prune":
+        from src.segment_store import SegmentStore, migrate_legacy_index
+        store = SegmentStore(args.folder)
+        migrate_legacy_index(args.folder)
+        manifest = store.read_manifest()
+        if manifest is None:
+            raise SystemExit(f"Индекс не найден в {args.folder}")
+        chunks = store.open_chunks(manifest)
+        # Чанки удалённых документов лежат в файлах до компакции, но живыми не считаются
+        removed_documents = np.array(manifest.get("removed_documents", []), dtype=np.uint32)
+        dead = np.isin(store.load_meta(manifest)["doc"], removed_documents)
+        removed = cache.prune(args.model, (chunks[int(i)] for i in np.flatnonzero(~dead)))
+        print(f"Удалено записей: {removed}")
+    print(json.dumps(cache.stats(), ensure_ascii=False))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,265 @@
+"""
+Журнал обратной связи в SQLite (режим WAL). Записи копятся в буфере и
+пишутся фоновым потоком одной транзакцией, поэтому клик пользователя не ждёт
+диска, а одновременные пользователи Gradio не портят файл. Старый
+feedback/feedback.json переносится в базу при первом открытии.
+"""
+
+import atexit
+import glob
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
+
+from src.embedding_cache import text_key
+from src.query_cache import normalize_query
+
+FEEDBACK_DIR = "feedback"
+FEEDBACK_DB = os.path.join(FEEDBACK_DIR, "feedback.sqlite")
+LEGACY_FEEDBACK_FILE = os.path.join(FEEDBACK_DIR, "feedback.json")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS feedback ("
+    " id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, query TEXT NOT NULL,"
+    " query_key TEXT NOT NULL, answer TEXT NOT NULL, is_correct INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS feedback_chunks ("
+    " feedback_id INTEGER NOT NULL REFERENCES feedback (id), chunk_key TEXT NOT NULL, chunk TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS feedback_by_query ON feedback (query_key)",
+    "CREATE INDEX IF NOT EXISTS feedback_chunks_by_key ON feedback_chunks (chunk_key)",
+)
+
+
+def chunk_key(chunk: str) -> str:
+    return text_key(chunk.strip()).hex()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+class FeedbackStore:
+    """
+    log() только кладёт запись в буфер; фоновый поток сбрасывает его раз в
+    flush_interval секунд или по заполнении max_buffer записей. После
+    rotate_max_rows записей файл уходит в архив archive/feedback_<время>.sqlite,
+    агрегирующие запросы по умолчанию учитывают и архивы.
+    """
+
+    def __init__(self, path: str = FEEDBACK_DB, flush_interval: float = 0.5, max_buffer: int = 256,
+                 rotate_max_rows: Optional[int] = 1_000_000, legacy_json: Optional[str] = None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.rotate_max_rows = rotate_max_rows
+        self.archive_dir = os.path.join(os.path.dirname(path) or ".", "archive")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = _connect(path)
+        self._lock = threading.Lock()  # соединение и счётчик строк
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writer = None
+        if legacy_json and os.path.exists(legacy_json):
+            self.migrate_json(legacy_json)
+
+    def log(self, query: str, answer: str, chunks: List[str], is_correct: bool):
+        entry = (datetime.now().isoformat(), query, answer, list(chunks), bool(is_correct))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Журнал обратной связи закрыт")
+            self._buffer.append(entry)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+                self._writer.start()
+            if len(self._buffer) >= self.max_buffer:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.max_buffer and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Синхронно записывает всё, что накопилось в буфере."""
+        with self._lock:
+            # Буфер забирается под блокировкой записи, чтобы пачки не переставлялись
+            with self._cond:
+                entries, self._buffer = self._buffer, []
+            if entries:
+                self._write(entries)
+                if self.rotate_max_rows is not None and self._rows >= self.rotate_max_rows:
+                    self._rotate()
+
+    def _write(self, entries):
+        self._conn.execute("BEGIN")
+        try:
+            for timestamp, query, answer, chunks, is_correct in entries:
+                cursor = self._conn.execute(
+                    "INSERT INTO feedback (timestamp, query, query_key, answer, is_correct)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (timestamp, query, normalize_query(query), answer, int(is_correct)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO feedback_chunks (feedback_id, chunk_key, chunk) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, chunk_key(chunk), chunk) for chunk in chunks if chunk],
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._rows += len(entries)
+
+    def rotate(self) -> Optional[str]:
+        """Переносит текущий файл в архив и начинает новый. Возвращает путь архива."""
+        self.flush()
+        with self._lock:
+            return self._rotate()
+
+    def _rotate(self) -> Optional[str]:
+        if not self._rows:
+            return None
+        self._conn.close()  # закрытие последнего соединения сливает WAL в основной файл
+        os.makedirs(self.archive_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        archive_path = os.path.join(self.archive_dir, f"feedback_{stamp}.sqlite")
+        os.replace(self.path, archive_path)
+        self._conn = _connect(self.path)
+        self._rows = 0
+        return archive_path
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def migrate_json(self, json_path: str) -> int:
+        """Импортирует старый feedback.json и переименовывает его в *.migrated."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = [
+            (item.get("timestamp") or datetime.now().isoformat(), item.get("query", ""),
+             item.get("answer", ""), item.get("chunks") or [], bool(item.get("is_correct")))
+            for item in data
+        ]
+        with self._lock:
+            self._write(entries)
+        os.replace(json_path, json_path + ".migrated")
+        return len(entries)
+
+    def _databases(self, include_archived: bool) -> List[str]:
+        paths = sorted(glob.glob(os.path.join(self.archive_dir, "feedback_*.sqlite"))) if include_archived else []
+        return paths + [self.path]
+
+    def _aggregate(self, sql: str, params: tuple, include_archived: bool) -> List[tuple]:
+        self.flush()
+        rows = []
+        for path in self._databases(include_archived):
+            if path == self.path:
+                with self._lock:
+                    rows.extend(self._conn.execute(sql, params).fetchall())
+            else:
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    rows.extend(conn.execute(sql, params).fetchall())
+                finally:
+                    conn.close()
+        return rows
+
+    def query_stats(self, query: Optional[str] = None, include_archived: bool = True) -> Dict[str, dict]:
+        """Число верных и неверных ответов по нормализованному тексту вопроса."""
+        sql = ("SELECT query_key, MIN(query), SUM(is_correct), SUM(1 - is_correct), MAX(timestamp)"
+               " FROM feedback")
+        params = ()
+        if query is not None:
+            sql += " WHERE query_key = ?"
+            params = (normalize_query(query),)
+        sql += " GROUP BY query_key"
+        stats = {}
+        for key, text, correct, incorrect, last in self._aggregate(sql, params, include_archived):
+            item = stats.setdefault(key, {"query": text, "correct": 0, "incorrect": 0, "last": last})
+            item["correct"] += correct
+            item["incorrect"] += incorrect
+            item["last"] = max(item["last"], last)
+        return stats
+
+    def chunk_stats(self, chunk: Optional[str] = None, include_archived: bool = True) -> Dict[str, dict]:
+        """Число верных и неверных ответов, в которых участвовал чанк (ключ — chunk_key)."""
+        sql = ("SELECT c.chunk_key, MIN(c.chunk), SUM(f.is_correct), SUM(1 - f.is_correct)"
+               " FROM feedback_chunks c JOIN feedback f ON f.id = c.feedback_id")
+        params = ()
+        if chunk is not None:
+            sql += " WHERE c.chunk_key = ?"
+            params = (chunk_key(chunk),)
+        sql += " GROUP BY c.chunk_key"
+        stats = {}
+        for key, text, correct, incorrect in self._aggregate(sql, params, include_archived):
+            item = stats.setdefault(key, {"chunk": text, "correct": 0, "incorrect": 0})
+            item["correct"] += correct
+            item["incorrect"] += incorrect
+        return stats
+
+    def recent(self, limit: int = 100) -> List[dict]:
+        """Последние записи текущего файла, новые первыми."""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, timestamp, query, answer, is_correct FROM feedback ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+            result = []
+            for feedback_id, timestamp, query, answer, is_correct in rows:
+                chunks = [c for (c,) in self._conn.execute(
+                    "SELECT chunk FROM feedback_chunks WHERE feedback_id = ?", (feedback_id,))]
+                result.append({"timestamp": timestamp, "query": query, "answer": answer,
+                               "chunks": chunks, "is_correct": bool(is_correct)})
+        return result
+
+
+_default_store: Optional[FeedbackStore] = None
+_default_lock = threading.Lock()
+
+
+def get_feedback_store() -> FeedbackStore:
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = FeedbackStore(FEEDBACK_DB, legacy_json=LEGACY_FEEDBACK_FILE)
+            atexit.register(_default_store.close)
+        return _default_store
+
+
+def close_feedback_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is not None:
+            atexit.unregister(_default_store.close)
+            _default_store.close()
+            _default_store = None
 
-FEEDBACK_FILE = "feedback/feedback.json"
 
 def init_feedback_file():
-    os.makedirs("feedback", exist_ok=True)
-    if not os.path.exists(FEEDBACK_FILE):
-        with open(FEEDBACK_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f)
+    get_feedback_store()
+
 
 def log_feedback(query: str, answer: str, chunks: List[str], is_correct: bool):
-    init_feedback_file()
-    feedback_entry = {
-        "timestamp": datetime.now().isoformat(),
-        "query": query,
-        "answer": answer,
-        "chunks": chunks,
-        "is_correct": is_correct
-    }
-    with open(FEEDBACK_FILE, "r+", encoding="utf-8") as f:
-        data = json.load(f)
-        data.append(feedback_entry)
-        f.seek(0)
-        json.dump(data, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+    get_feedback_store().log(query, answer, chunks, is_correct)
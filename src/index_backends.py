@@ -0,0 +1,201 @@
+"""
+Бэкенды ANN-индекса FAISS: flat, IVF-Flat, HNSW, IVF-PQ.
+
+Все индексы строятся по скалярному произведению (эмбеддинги нормализованы),
+поэтому результаты поиска совместимы с исходным IndexFlatIP.
+"""
+
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+BACKENDS = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+TRAINABLE_BACKENDS = ("ivf_flat", "ivf_pq")
+
+DEFAULT_INDEX_CONFIG = {
+    # "auto" — начинаем с flat и повышаем бэкенд по порогам auto_thresholds
+    "backend": "auto",
+    "auto_thresholds": {"ivf_flat": 20_000, "ivf_pq": 1_000_000},
+    "min_train_size": 1000,
+    "nlist": None,          # None — подбирается по размеру корпуса
+    "nprobe": 16,
+    "hnsw_m": 32,
+    "ef_construction": 80,
+    "ef_search": 64,
+    "pq_m": 16,
+    "pq_nbits": 8,
+}
+
+
+def make_index_config(overrides: Optional[dict] = None) -> dict:
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config["auto_thresholds"] = dict(DEFAULT_INDEX_CONFIG["auto_thresholds"])
+    if overrides:
+        for key, value in overrides.items():
+            if key not in DEFAULT_INDEX_CONFIG:
+                raise ValueError(f"Неизвестный параметр индекса: {key}")
+            config[key] = dict(value) if isinstance(value, dict) else value
+    if config["backend"] != "auto" and config["backend"] not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд индекса: {config['backend']}")
+    return config
+
+
+def resolve_backend(config: dict, ntotal: int) -> str:
+    """Целевой бэкенд для корпуса из ntotal векторов."""
+    backend = config["backend"]
+    if backend != "auto":
+        return backend
+    target = "flat"
+    for name, threshold in sorted(config["auto_thresholds"].items(), key=lambda item: item[1]):
+        if ntotal >= threshold:
+            target = name
+    return target
+
+
+def can_build(backend: str, config: dict, ntotal: int) -> bool:
+    """IVF-бэкендам нужна обучающая выборка, flat и HNSW строятся сразу."""
+    if backend not in TRAINABLE_BACKENDS:
+        return True
+    needed = config["min_train_size"]
+    if backend == "ivf_pq":
+        needed = max(needed, 2 ** config["pq_nbits"])
+    return ntotal >= needed
+
+
+def _choose_nlist(config: dict, ntotal: int) -> int:
+    if config["nlist"]:
+        return int(config["nlist"])
+    # ~4·sqrt(N) кластеров, но не меньше 39 точек на кластер при обучении
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+
+def create_index(backend: str, dim: int, config: dict, ntotal: int = 0) -> faiss.Index:
+    if backend == "flat":
+        return faiss.IndexFlatIP(dim)
+    if backend == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{config['hnsw_m']}", faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config["ef_construction"]
+        return index
+    nlist = _choose_nlist(config, ntotal)
+    if backend == "ivf_flat":
+        return faiss.index_factory(dim, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+    if backend == "ivf_pq":
+        if dim % config["pq_m"] != 0:
+            raise ValueError(f"Размерность {dim} не делится на pq_m={config['pq_m']}")
+        return faiss.index_factory(
+            dim, f"IVF{nlist},PQ{config['pq_m']}x{config['pq_nbits']}", faiss.METRIC_INNER_PRODUCT
+        )
+    raise ValueError(f"Неизвестный бэкенд индекса: {backend}")
+
+
+def build_index(backend: str, vectors: np.ndarray, dim: int, config: dict,
+                ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Создаёт индекс, при необходимости обучает его и заполняет векторами.
+    С ids индекс оборачивается в IndexIDMap2 и поиск возвращает эти id.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = create_index(backend, dim, config, len(vectors))
+    if not index.is_trained:
+        index.train(_training_sample(vectors, config))
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        if len(vectors):
+            index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    elif len(vectors):
+        index.add(vectors)
+    apply_search_params(index, config)
+    return index
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """id векторов в порядке хранения: из IndexIDMap или 0..ntotal-1."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def add_vectors(index: faiss.Index, vectors: np.ndarray, start_id: int):
+    """Добавляет векторы с id start_id, start_id + 1, ... в индекс любого вида."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index.add_with_ids(vectors, np.arange(start_id, start_id + len(vectors), dtype="int64"))
+    elif start_id != index.ntotal:
+        raise ValueError("Индекс без IndexIDMap не может хранить произвольные id")
+    else:
+        index.add(vectors)
+
+
+def unwrap_index(index: faiss.Index) -> faiss.Index:
+    """Внутренний индекс IndexIDMap/IndexIDMap2 (или сам индекс)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def _training_sample(vectors: np.ndarray, config: dict, per_list: int = 256) -> np.ndarray:
+    limit = max(config["min_train_size"], _choose_nlist(config, len(vectors)) * per_list)
+    if len(vectors) <= limit:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[np.sort(rng.choice(len(vectors), limit, replace=False))]
+
+
+def extract_vectors(index: faiss.Index) -> np.ndarray:
+    """Векторы индекса для перестроения (для IVF-PQ — приближённые)."""
+    index = unwrap_index(index)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def reconstruct_ids(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """
+    Векторы с данными id (как их возвращает поиск) без чтения остальных:
+    у индекса, открытого через mmap, в память попадают только их страницы.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    if not len(ids):
+        return np.zeros((0, index.d), dtype="float32")
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype="int64"))
+
+
+def apply_search_params(index: faiss.Index, config: dict):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(config["nprobe"], ivf.nlist)
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config["ef_search"]
+
+
+def make_search_params(index: faiss.Index, config: dict,
+                       selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Параметры поиска с фильтром id. Переданные в search параметры заменяют
+    настройки индекса целиком, поэтому nprobe/efSearch повторяются здесь.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(config["nprobe"], ivf.nlist))
+    if isinstance(unwrap_index(index), faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=config["ef_search"])
+    return faiss.SearchParameters(sel=selector)
+
+
+def detect_backend(index: faiss.Index) -> str:
+    """Определяет бэкенд по типу индекса (для индексов без метаданных)."""
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "flat"
@@ -0,0 +1,311 @@
+"""
+Встроенные метрики горячего пути: интервалы (span) этапов — кодирование,
+поиск, форматирование ответа, извлечение PDF — и счётчики событий.
+
+Выключенные метрики почти ничего не стоят: span() возвращает общий пустой
+контекст, increment() сразу выходит. Включаются через enable() или
+переменную окружения RAG_METRICS=1. Метрики отдаются в текстовом формате
+Prometheus через start_metrics_server (по умолчанию 127.0.0.1:9464):
+
+    GET /metrics                      — метрики
+    GET /debug/metrics?enabled=0|1    — выключить/включить сбор
+    GET /debug/trace?path=logs/trace.jsonl  — журнал трасс запросов (без path — выключить)
+    GET /debug/profile?rate=0.01      — профилировать cProfile каждый сотый запрос (0 — выключить)
+"""
+
+import bisect
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Границы корзин гистограммы длительностей, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_PORT = 9464
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class _State:
+    def __init__(self):
+        self.enabled = os.environ.get("RAG_METRICS", "0") not in ("", "0")
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.trace_path = None
+        self.trace_lock = threading.Lock()
+        self.profile_rate = 0.0
+        self.profile_folder = "profiles"
+        # cProfile допускает один активный профилировщик на процесс
+        self.profile_lock = threading.Lock()
+        self.local = threading.local()
+
+
+_state = _State()
+
+
+class _NoopContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopContext()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        with _state.lock:
+            histogram = _state.histograms.get(self.name)
+            if histogram is None:
+                histogram = _state.histograms[self.name] = _Histogram()
+            histogram.observe(elapsed)
+        trace = getattr(_state.local, "trace", None)
+        if trace is not None:
+            trace["spans"].append({
+                "name": self.name,
+                "start_ms": round((self.start - trace["started"]) * 1000, 3),
+                "ms": round(elapsed * 1000, 3),
+            })
+        return False
+
+
+class _Request:
+    """Корень трассы: собирает span'ы своего потока и по завершении пишет одну строку журнала."""
+
+    __slots__ = ("name", "attrs", "span", "trace", "profiler")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.span = _Span(name)
+        self.trace = None
+        self.profiler = None
+
+    def __enter__(self):
+        if _state.trace_path and getattr(_state.local, "trace", None) is None:
+            self.trace = {"started": time.perf_counter(), "spans": []}
+            _state.local.trace = self.trace
+        if (_state.profile_rate and random.random() < _state.profile_rate
+                and _state.profile_lock.acquire(blocking=False)):
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:  # профилировщик уже запущен кем-то ещё
+                self.profiler = None
+                _state.profile_lock.release()
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.span.__exit__(*exc)
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                _dump_profile(self.profiler, self.name)
+            finally:
+                _state.profile_lock.release()
+        if self.trace is not None:
+            _state.local.trace = None
+            _write_trace({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "request": self.name,
+                "ms": round((time.perf_counter() - self.trace["started"]) * 1000, 3),
+                **self.attrs,
+                "spans": self.trace["spans"],
+            })
+        return False
+
+
+def enabled() -> bool:
+    return _state.enabled
+
+
+def enable(on: bool = True):
+    _state.enabled = on
+
+
+def span(name: str):
+    """Замер этапа: with span("encode_query"): ... Без включённых метрик — пустой контекст."""
+    if not _state.enabled:
+        return _NOOP
+    return _Span(name)
+
+
+def request(name: str, **attrs):
+    """
+    Замер запроса целиком. Если включён журнал трасс, span'ы этого потока
+    внутри запроса пишутся одной JSON-строкой; при профилировании запрос с
+    вероятностью profile_rate выполняется под cProfile.
+    """
+    if not (_state.enabled or _state.profile_rate):
+        return _NOOP
+    return _Request(name, attrs)
+
+
+def increment(name: str, value: float = 1):
+    if not _state.enabled:
+        return
+    with _state.lock:
+        _state.counters[name] = _state.counters.get(name, 0) + value
+
+
+def register_gauge(name: str, fn: Callable[[], float]):
+    """Значение вычисляется только при чтении метрик, горячий путь не затрагивается."""
+    with _state.lock:
+        _state.gauges[name] = fn
+
+
+def set_tracing(path: Optional[str]):
+    """Журнал трасс запросов в JSON Lines; None — выключить. Трассы включают и сбор метрик."""
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _state.enabled = True
+    _state.trace_path = path
+
+
+def set_profiling(rate: float, folder: str = "profiles"):
+    """Доля запросов под cProfile (0 — выключить); профили пишутся в folder/*.prof."""
+    _state.profile_folder = folder
+    _state.profile_rate = max(0.0, min(1.0, rate))
+
+
+def _write_trace(record: dict):
+    path = _state.trace_path
+    if not path:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _state.trace_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str):
+    os.makedirs(_state.profile_folder, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(_state.profile_folder, f"{name}-{stamp}-{threading.get_ident()}.prof")
+    profiler.dump_stats(path)
+    increment("profiles_written")
+
+
+def snapshot() -> dict:
+    """Счётчики и сводка по этапам: {"counters": {...}, "stages": {этап: {"count", "sum"}}}."""
+    with _state.lock:
+        return {
+            "counters": dict(_state.counters),
+            "stages": {name: {"count": h.count, "sum": h.total} for name, h in _state.histograms.items()},
+        }
+
+
+def reset():
+    with _state.lock:
+        _state.histograms.clear()
+        _state.counters.clear()
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def prometheus_text() -> str:
+    with _state.lock:
+        histograms = {name: (list(h.counts), h.total, h.count) for name, h in _state.histograms.items()}
+        counters = dict(_state.counters)
+        gauges = dict(_state.gauges)
+    lines = []
+    if histograms:
+        lines += ["# HELP rag_stage_seconds Длительность этапов обработки",
+                  "# TYPE rag_stage_seconds histogram"]
+        for name in sorted(histograms):
+            counts, total, count = histograms[name]
+            cumulative = 0
+            for bound, bucket_count in zip([*BUCKETS, "+Inf"], counts):
+                cumulative += bucket_count
+                le = bound if isinstance(bound, str) else repr(bound)
+                lines.append(f'rag_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'rag_stage_seconds_sum{{stage="{name}"}} {total!r}')
+            lines.append(f'rag_stage_seconds_count{{stage="{name}"}} {count}')
+    for name in sorted(counters):
+        lines += [f"# TYPE rag_{name}_total counter", f"rag_{name}_total {_format_value(counters[name])}"]
+    for name in sorted(gauges):
+        try:
+            value = gauges[name]()
+        except Exception:
+            continue
+        lines += [f"# TYPE rag_{name} gauge", f"rag_{name} {_format_value(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/metrics":
+            self._reply(200, prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/debug/metrics":
+            enable(params.get("enabled", "1") not in ("", "0"))
+            self._reply(200, f"enabled={_state.enabled}\n")
+        elif url.path == "/debug/trace":
+            set_tracing(params.get("path") or None)
+            self._reply(200, f"trace_path={_state.trace_path}\n")
+        elif url.path == "/debug/profile":
+            try:
+                rate = float(params.get("rate", "0"))
+            except ValueError:
+                self._reply(400, "rate должен быть числом\n")
+                return
+            set_profiling(rate, params.get("folder", _state.profile_folder))
+            self._reply(200, f"profile_rate={_state.profile_rate} folder={_state.profile_folder}\n")
+        else:
+            self._reply(404, "not found\n")
+
+    def _reply(self, status: int, body: str, content_type: str = "text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = DEFAULT_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """HTTP-сервер метрик в фоновом потоке; по умолчанию слушает только локальный адрес."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
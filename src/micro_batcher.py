@@ -0,0 +1,66 @@
+"""
+Микробатчинг: запросы, пришедшие из разных потоков в пределах нескольких
+миллисекунд, собираются в одну пачку и обрабатываются одним вызовом.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Any:
+        """Блокирует вызывающий поток до готовности результата своей пачки."""
+        return self.submit_async(item).result()
+
+    def submit_async(self, item: Any) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(batch):
+                    # Иначе zip молча оборвётся и хвостовые запросы будут ждать вечно
+                    raise RuntimeError(f"batch_fn вернула {len(results)} результатов на {len(batch)} запросов")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -1,80 +1,186 @@
+import os
 import pdfplumber
 import re
-from typing import List
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from src import metrics
+from src.chunker import CHUNK_TOKENS, OVERLAP_TOKENS, chunk_lines, is_prose_line, is_table_caption
+
+# Сколько страниц одного PDF извлекает процесс-воркер за одну задачу
+PAGES_PER_TASK = 16
+# Заголовок главы в метаданных документа обрезается до этой длины
+CHAPTER_TITLE_LENGTH = 120
+
+# Фильтры строки скомпилированы один раз и работают по строке в нижнем регистре
+# (IGNORECASE в re заметно медленнее): заголовок — одно сопоставление с началом
+# строки, мусор — один поиск по всем фразам сразу. Заголовки бывают «сильные»
+# (Глава 3, 1.2 Установка) и «слабые» (3 Установка, IV. Обслуживание) — слабые
+# внутри таблицы считаются её строками
+_STRONG_HEADING = r'(?:глава|chapter|раздел|section)\s+\d+|\d+(?:\.\d+)+\s+[a-zа-я]'
+_WEAK_HEADING = r'\d+\s+[a-zа-я]|[ivxlcdm]+[.\s_]+[a-zа-я]'
+_JUNK = (r'[0-9]{3}(?:-[0-9]{3}-[0-9]{4}|[0-9]{7})|http|www\.|@|8-800|confidential|поддержка|телефон'
+         r'|support|page|©|дата выпуска|technical documentation')
+_HEADING_RE = re.compile(f'(?P<heading>{_STRONG_HEADING})|(?P<weak_heading>{_WEAK_HEADING})')
+_JUNK_RE = re.compile(_JUNK)
+
+def _is_junk_rest(line: str, lower: str) -> bool:
+    # Проверки мусора, которые дешевле сделать без регулярного выражения
+    return len(line) < 8 or line.isdecimal() or ("документ" in lower and "id" in lower)
+
+def classify_line(line: str) -> Optional[str]:
+    """"heading", "weak_heading", "junk" или None (обычная строка) для строки без краевых пробелов."""
+    lower = line.lower()
+    match = _HEADING_RE.match(lower)
+    if match:
+        return match.lastgroup
+    if _is_junk_rest(line, lower) or _JUNK_RE.search(lower):
+        return "junk"
+    return None
 
 def is_chapter_heading(line: str) -> bool:
-    line = line.strip()
-    if not line:
-        return False
-    patterns = [
-        r'^\s*(глава|chapter|раздел|section)\s+\d+[^a-zA-Zа-яА-Я]*',
-        r'^\s*\d+(\.\d+)*\s+[A-ZА-Я]',                          # 1.1 Введение
-        r'^\s*[IVXLCDM]+[.\s_]+[A-ZА-Я]',                      # IV. Обслуживание, IV_Обслуживание
-    ]
-    for pattern in patterns:
-        if re.match(pattern, line, re.IGNORECASE):
-            return True
-    return False
+    return _HEADING_RE.match(line.strip().lower()) is not None
 
 def is_junk_line(line: str) -> bool:
     line = line.strip()
-    if not line or len(line) < 8:
-        return True
-    if re.search(r'(http|www\.|@|8\-800|\d{3}\-\d{3}\-\d{4}|\d{10,})', line, re.IGNORECASE):
-        return True
-    line_lower = line.lower()
-    junk_phrases = [
-        'confidential', 'поддержка', 'телефон', 'support', 'page',
-        '©', 'дата выпуска', 'technical documentation'
-    ]
-    # Проверяем вхождение подстрок (а не точное совпадение)
-    if any(phrase in line_lower for phrase in junk_phrases):
-        return True
-    if 'документ' in line_lower and 'id' in line_lower:
-        return True
-    if re.fullmatch(r'\d+', line):
-        return True
-    return False
+    lower = line.lower()
+    return _is_junk_rest(line, lower) or _JUNK_RE.search(lower) is not None
 
-def extract_chapters_from_pdf(pdf_path: str) -> List[str]:
-    chapters = []
+def _iter_chapter_lines(pages: Iterable[str]) -> Iterator[List[Tuple[int, str]]]:
+    """Главы из потока страниц как списки (номер страницы с 1, строка)."""
     current_chapter_lines = []
     in_chapter = False
+    in_table = False
+
+    for page_no, page_text in enumerate(pages, 1):
+        if not page_text:
+            continue
+        for line in page_text.splitlines():
+            stripped = line.strip()
+            kind = classify_line(stripped)
+            if kind == "heading" or (kind == "weak_heading" and not in_table):
+                if current_chapter_lines:
+                    yield current_chapter_lines
+                    current_chapter_lines = []
+                current_chapter_lines.append((page_no, line))
+                in_chapter = True
+                in_table = False
+            elif in_chapter and kind != "junk":
+                # «1 Напряжение 12 В» в таблице — строка таблицы, а не новая глава
+                current_chapter_lines.append((page_no, line))
+                if is_table_caption(stripped):
+                    in_table = True
+                elif in_table and kind is None and is_prose_line(stripped):
+                    in_table = False
+
+    if current_chapter_lines:
+        yield current_chapter_lines
 
+def iter_chapters_from_pages(pages: Iterable[str]) -> Iterator[str]:
+    """Собирает главы из потока текстов страниц, отдавая каждую сразу по завершении."""
+    for chapter_lines in _iter_chapter_lines(pages):
+        yield "\n".join(line for _, line in chapter_lines)
+
+def extract_chapters_from_pdf(pdf_path: str) -> List[str]:
+    with metrics.span("pdf_extract"), pdfplumber.open(pdf_path) as pdf:
+        metrics.increment("pdf_pages", len(pdf.pages))
+        return list(iter_chapters_from_pages(page.extract_text() for page in pdf.pages))
+
+def count_pdf_pages(pdf_path: str) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def _extract_page_range(task: Tuple[str, int, int]) -> List[str]:
+    pdf_path, start, end = task
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if not page_text:
-                continue
-            lines = page_text.splitlines()
-
-            for line in lines:
-                if is_chapter_heading(line):
-                    if current_chapter_lines:
-                        chapters.append("\n".join(current_chapter_lines))
-                        current_chapter_lines = []
-                    current_chapter_lines.append(line)
-                    in_chapter = True
-                else:
-                    if in_chapter and not is_junk_line(line):
-                        current_chapter_lines.append(line)
-
-        if current_chapter_lines:
-            chapters.append("\n".join(current_chapter_lines))
-
-    return chapters
-
-def split_chapter_into_chunks(chapter_text: str, chunk_size: int = 250) -> List[str]:
-    clean_text = re.sub(r'\s+', ' ', chapter_text.strip())
-    if not clean_text:
-        return []
-    words = clean_text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i + chunk_size])
-        if len(chunk) > 30:
-            chunks.append(chunk)
-    return chunks
+        return [page.extract_text() or "" for page in pdf.pages[start:end]]
+
+def iter_page_batches(pdf_paths: List[str], workers: Optional[int] = None,
+                      pages_per_task: int = PAGES_PER_TASK) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Извлекает страницы всех файлов в пуле процессов (файлы режутся на диапазоны страниц)
+    и отдаёт пачки (номер файла, тексты страниц) в исходном порядке.
+    В работе одновременно не больше 2·workers диапазонов, поэтому память ограничена.
+    """
+    tasks = (
+        (file_no, (path, start, min(start + pages_per_task, n_pages)))
+        for file_no, path in enumerate(pdf_paths)
+        for n_pages in [count_pdf_pages(path)]
+        for start in range(0, n_pages, pages_per_task)
+    )
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for file_no, task in tasks:
+            with metrics.span("pdf_extract"):
+                pages = _extract_page_range(task)
+            metrics.increment("pdf_pages", len(pages))
+            yield file_no, pages
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for file_no, task in tasks:
+            pending.append((file_no, pool.submit(_extract_page_range, task)))
+            if len(pending) >= 2 * workers:
+                done_no, future = pending.popleft()
+                yield done_no, _wait_pages(future)
+        while pending:
+            done_no, future = pending.popleft()
+            yield done_no, _wait_pages(future)
+
+def _wait_pages(future) -> List[str]:
+    # Извлечение идёт в воркерах, в этом процессе видно только ожидание результата
+    with metrics.span("pdf_extract_wait"):
+        pages = future.result()
+    metrics.increment("pdf_pages", len(pages))
+    return pages
+
+def iter_pdf_chunks(pdf_paths: List[str], workers: Optional[int] = None,
+                    pages_per_task: int = PAGES_PER_TASK,
+                    count_tokens: Optional[Callable[[str], int]] = None) -> Iterator[Tuple[str, str]]:
+    """Потоково отдаёт пары (путь к PDF, чанк) по мере извлечения страниц."""
+    for path, chunk, _, _, _ in iter_pdf_chunk_records(pdf_paths, workers, pages_per_task, count_tokens):
+        yield path, chunk
+
+def iter_pdf_chunk_records(pdf_paths: List[str], workers: Optional[int] = None,
+                           pages_per_task: int = PAGES_PER_TASK,
+                           count_tokens: Optional[Callable[[str], int]] = None
+                           ) -> Iterator[Tuple[str, str, int, int, str]]:
+    """
+    Как iter_pdf_chunks, но с местом чанка в документе: (путь, чанк, страница
+    первого слова чанка, номер главы с 1, заголовок главы).
+    count_tokens — счётчик токенов слова (по умолчанию оценка, см. src/chunker.py).
+    """
+    batches = iter_page_batches(pdf_paths, workers, pages_per_task)
+    for file_no, group in groupby(batches, key=lambda batch: batch[0]):
+        pages = (page for _, batch_pages in group for page in batch_pages)
+        for chapter_no, chapter_lines in enumerate(_iter_chapter_lines(pages), 1):
+            with metrics.span("chunking"):
+                title = chapter_lines[0][1].strip()[:CHAPTER_TITLE_LENGTH]
+                chunks = chunk_lines([line for _, line in chapter_lines], count_tokens=count_tokens)
+            for line_no, chunk in chunks:
+                yield pdf_paths[file_no], chunk, chapter_lines[line_no][0], chapter_no, title
+
+# Устаревший chunk_size задавал размер чанка в словах; русское слово — около двух токенов
+_TOKENS_PER_WORD = 2
+
+def split_chapter_into_chunks(chapter_text: str, max_tokens: int = CHUNK_TOKENS,
+                              overlap_tokens: int = OVERLAP_TOKENS,
+                              count_tokens: Optional[Callable[[str], int]] = None,
+                              chunk_size: Optional[int] = None) -> List[str]:
+    """
+    Чанки главы по бюджету токенов модели с перекрытием (см. src/chunker.py).
+    chunk_size (слов в чанке) устарел: пересчитывается в бюджет токенов, но не
+    больше окна модели; перекрытие ужимается, чтобы остаться меньше половины бюджета.
+    """
+    if chunk_size is not None:
+        warnings.warn("chunk_size устарел, используйте max_tokens", DeprecationWarning, stacklevel=2)
+        max_tokens = max(2, min(CHUNK_TOKENS, chunk_size * _TOKENS_PER_WORD))
+        overlap_tokens = min(overlap_tokens, max_tokens // 2 - 1)
+    return [chunk for _, chunk in chunk_lines(chapter_text.splitlines(), max_tokens, overlap_tokens, count_tokens)]
 
 def process_pdf_to_chunks(pdf_path: str) -> List[str]:
     chapters = extract_chapters_from_pdf(pdf_path)
@@ -0,0 +1,124 @@
+"""
+LRU-кэш с ограничением по числу записей, памяти и времени жизни.
+Используется для эмбеддингов запросов и результатов поиска в RAGEngine.
+"""
+
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+_MISSING = object()
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT_RE = re.compile(r"^[\s\"'«».,!?;:…-]+|[\s\"'«».,!?;:…-]+$")
+
+
+def normalize_query(query: str) -> str:
+    """«  Как настроить VLAN? » и «как настроить vlan» дают один ключ."""
+    query = query.lower().replace("ё", "е")
+    query = _EDGE_PUNCT_RE.sub("", query)
+    return _WHITESPACE_RE.sub(" ", query)
+
+
+def _sizeof(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 10_000, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[2] is not None and entry[2] < time.monotonic():
+                self._pop(key)
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = _sizeof(value)
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "evictions": self.evictions,
+            }
+
+    def save(self, path: str):
+        """Атомарно сохраняет непросроченные записи на диск."""
+        now = time.monotonic()
+        with self._lock:
+            items = [
+                (key, value, None if expires_at is None else expires_at - now)
+                for key, (value, _, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            items = pickle.load(f)
+        for key, value, remaining in items:
+            self.put(key, value, ttl=remaining)
@@ -1,19 +1,159 @@
 import os
 import json
 import hashlib
+import queue
+import threading
+import time
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from src.index_backends import (
+    add_vectors, apply_search_params, build_index, can_build, create_index, detect_backend,
+    extract_vectors, index_ids, make_index_config, make_search_params, resolve_backend, unwrap_index,
+)
+from src.query_cache import LRUCache, normalize_query
+from src.bm25 import BM25Index, reciprocal_rank_fusion
+from src.chunk_store import ChunkList, ChunkMeta
+from src.dedup import DedupIndex, content_hash, hash_chunks, simhash
+from src.segment_store import SegmentStore, migrate_legacy_index
+from src.embedders import LazyEmbedder
+from src.embedding_cache import EmbeddingCache, text_key
+from src.reranker import DEFAULT_RERANKER_MODEL, Reranker
+from src.serving import ReadWriteLock
+from src.sharding import ShardedIndex, partition_ranges
+from src.snapshot import read_snapshot, snapshot_path, write_snapshot
+from src.translator import TRANSLATION_MODES, Translator
+from src import metrics
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
 
 class RAGEngine:
-    def __init__(self):
-        self.model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        self.dim = self.model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(self.dim)
-        self.chunks = []
+    def __init__(self, index_config: Optional[dict] = None, query_cache_path: Optional[str] = None,
+                 cache_max_entries: int = 10_000, cache_ttl: Optional[float] = None,
+                 cache_max_bytes: Optional[int] = 64 * 1024 * 1024,
+                 compact_after_segments: int = 8, retrieval_mode: str = "hybrid",
+                 near_duplicates: Optional[str] = None, near_duplicate_threshold: float = 0.97,
+                 embedding_backend: str = "torch", embedding_threads: Optional[int] = None,
+                 embedding_batch_size: int = 32, chunk_cache_path: Optional[str] = None,
+                 chunk_cache_max_entries: Optional[int] = 1_000_000,
+                 bad_feedback_exclude_after: int = 3, bad_feedback_penalty: float = 0.15,
+                 warm_snapshot: bool = True, reranker_model: Optional[str] = None,
+                 rerank_candidates: int = 20, rerank_budget_ms: Optional[float] = 300.0,
+                 translation: Optional[str] = None, translation_cache_path: Optional[str] = None):
+        # embedding_backend: "torch", "onnx" или "onnx_int8" (см. src/embedders.py).
+        # Модель (общая на процесс) грузится при первом кодировании, пустой индекс —
+        # при первом обращении: загрузка сохранённого индекса и ответы на пустом
+        # индексе модель не трогают
+        self.model = LazyEmbedder(embedding_backend, num_threads=embedding_threads,
+                                  batch_size=embedding_batch_size)
+        self._dim = None
+        self._index = None
+        self.index_config = make_index_config(index_config)
+        self.index_backend = self._initial_backend()
+        # Тёплый снимок (src/snapshot.py): load_index читает его через mmap, если он свежий
+        self.warm_snapshot = warm_snapshot
+        self.load_stats = {}
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {retrieval_mode}")
+        self.retrieval_mode = retrieval_mode
+        self.chunks = ChunkList()
+        self.bm25 = BM25Index()
+        # Метаданные чанков по id (документ, страница, глава) и реестр документов.
+        # Id чанка — его позиция в self.chunks, она не меняется и не переиспользуется:
+        # удалённый документ сначала только исключается из поиска, физически его
+        # векторы и тексты вычищает компакция хранилища
+        self.chunk_meta = ChunkMeta()
+        self.documents = {}
+        self._doc_chunks = {}
+        self.removed_documents = set()
+        self._removed_ids = np.zeros(0, dtype="int64")
+        self._next_doc_id = 1
+        # Дедупликация: одинаковый текст не кодируется повторно, источники дублей
+        # привязываются к каноническому чанку. near_duplicates: None, "simhash" или "cosine"
+        if near_duplicates not in (None, "simhash", "cosine"):
+            raise ValueError(f"Неизвестный режим поиска почти-дублей: {near_duplicates}")
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.dedup = DedupIndex()
+        self.duplicate_sources = {}
+        self.ingest_stats = {"added": 0, "exact_duplicates": 0, "near_duplicates": 0}
         self.document_hashes = set()
         self.loaded_documents = []
         self._load_document_metadata()
+        # Эмбеддинги запросов зависят только от модели, результаты — от состояния индекса.
+        # cache_max_bytes ограничивает память каждого из двух кэшей (None — без ограничения)
+        self.query_cache_path = query_cache_path
+        self.embedding_cache = LRUCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes, ttl=cache_ttl)
+        self.result_cache = LRUCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes, ttl=cache_ttl)
+        # Поколение состояния индекса входит в ключ результата: ответ, посчитанный
+        # на старом снимке во время записи, уже не будет найден в кэше
+        self._generation = 0
+        if query_cache_path:
+            self.embedding_cache.load(query_cache_path)
+        # Постоянный кэш векторов чанков: повторная индексация того же текста не вызывает модель
+        self.chunk_cache = (EmbeddingCache(chunk_cache_path, max_entries=chunk_cache_max_entries)
+                            if chunk_cache_path else None)
+        # Что уже лежит в сегментном хранилище; всё, что добавлено позже, уйдёт новым сегментом
+        self.compact_after_segments = compact_after_segments
+        self._persisted_folder = None
+        self._persisted_count = 0
+        self._pending_vectors = []
+        self._pending_documents = []
+        self._pending_duplicates = {}
+        self._pending_removals = []
+        self._pending_owners = {}
+        self._needs_full_save = False
+        # Путь к базовому IVF-индексу, открытому через mmap только на чтение
+        self._readonly_index_path = None
+        # Отрицательные отзывы: id чанка → число отметок «неверно». Каждая отметка
+        # сдвигает score вниз в (1 - penalty) раз, после exclude_after отметок чанк
+        # исключается из поиска внутри FAISS через IDSelector
+        self.bad_feedback_exclude_after = bad_feedback_exclude_after
+        self.bad_feedback_penalty = bad_feedback_penalty
+        self.negative_feedback = {}
+        # Изменённые с прошлой записи счётчики по хешу чанка (0 — запись удаляется):
+        # отметка «неверно» дописывает в хранилище только их
+        self._feedback_changes = {}
+        self._feedback_lock = threading.Lock()
+        # Поиск берёт разделяемую блокировку, применение изменений — исключительную и
+        # короткую: кодирование и обучение индексов идут вне её. Писатели (индексация,
+        # сохранение) дополнительно выстраиваются в очередь через _ingest_lock
+        self._rw = ReadWriteLock()
+        self._ingest_lock = threading.RLock()
+        # Шардированный индекс (use_shards): плотный и BM25-поиск идут в процессы шардов
+        self.shards = None
+        # Второй этап (src/reranker.py): cross-encoder переупорядочивает rerank_candidates
+        # кандидатов первого этапа; reranker_model="default" — модель по умолчанию
+        self.rerank_candidates = rerank_candidates
+        self.reranker = None
+        if reranker_model:
+            self.reranker = Reranker(DEFAULT_RERANKER_MODEL if reranker_model == "default" else reranker_model,
+                                     budget_ms=rerank_budget_ms)
+        # Перевод иностранных чанков на русский (src/translator.py): "ingest" — при
+        # индексации, в ответе перевод берётся из кэша; "query" — при первом показе чанка
+        if translation not in (None, *TRANSLATION_MODES):
+            raise ValueError(f"Неизвестный режим перевода: {translation}")
+        self.translation = translation
+        self.translator = Translator(translation_cache_path) if translation else None
+        self._refresh_search_filters()
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = self.model.get_sentence_embedding_dimension()
+        return self._dim
+
+    @property
+    def index(self) -> faiss.Index:
+        if self._index is None:
+            index = create_index(self.index_backend, self.dim, self.index_config)
+            apply_search_params(index, self.index_config)
+            self._index = index
+        return self._index
+
+    @index.setter
+    def index(self, index: faiss.Index):
+        self._index = index
 
     def _compute_pdf_hash(self, pdf_path: str) -> str:
         hasher = hashlib.md5()
@@ -37,68 +177,946 @@ class RAGEngine:
             self.document_hashes = set()
             self.loaded_documents = []
 
-    def _save_document_metadata(self):
-        os.makedirs("models", exist_ok=True)
-        with open("models/document_metadata.json", "w", encoding="utf-8") as f:
-            json.dump({
-                "hashes": list(self.document_hashes),
-                "filenames": self.loaded_documents
-            }, f, ensure_ascii=False, indent=2)
-
-    def add_chunks(self, chunks: List[str]):
-        clean_chunks = [c.strip() for c in chunks if len(c.strip()) > 30]
-        if not clean_chunks:
-            return
-        self.chunks.extend(clean_chunks)
-        embeddings = self.model.encode(clean_chunks, normalize_embeddings=True)
-        self.index.add(embeddings)
+    def _document_entries(self) -> List[dict]:
+        entries = list(self.documents.values())
+        # Документы, загруженные до появления реестра, известны только по имени и хешу
+        names = [e["filename"] for e in entries]
+        hashes = {e["hash"] for e in entries}
+        legacy_names = list(self.loaded_documents)
+        for name in names:
+            if name in legacy_names:
+                legacy_names.remove(name)
+        return (entries + [{"filename": name} for name in legacy_names]
+                + [{"hash": pdf_hash} for pdf_hash in self.document_hashes - hashes])
+
+    def _restore_documents(self, entries: List[dict]):
+        self.documents = {e["doc_id"]: e for e in entries if "doc_id" in e}
+        self.loaded_documents = [e["filename"] for e in entries if "filename" in e]
+        self.document_hashes = {e["hash"] for e in entries if "hash" in e}
+
+    def add_chunks(self, chunks: List[str], sources: Optional[List[Optional[str]]] = None,
+                   meta: Optional[List[Optional[Tuple[int, int, int]]]] = None) -> dict:
+        """
+        Индексирует чанки, пропуская точные дубли (и почти-дубли, если включено)
+        до вызова model.encode. Возвращает отчёт о добавленных и пропущенных чанках.
+        meta — (id документа, страница, номер главы) для каждого чанка.
+        """
+        with self._ingest_lock:
+            return self._add_chunks(chunks, sources, meta)
+
+    def _add_chunks(self, chunks: List[str], sources: Optional[List[Optional[str]]],
+                    meta: Optional[List[Optional[Tuple[int, int, int]]]] = None) -> dict:
+        with metrics.span("ingest_batch"):
+            report = self._add_chunk_batch(chunks, sources, meta)
+        if self.translation == "ingest" and report["added"]:
+            # Новые чанки уже в индексе; перевод только заполняет кэш для ответов и
+            # не должен проваливать индексацию — без пакета Argos переведём при показе
+            end = self._next_chunk_id()
+            self._translate_texts(list(self._chunk_texts(list(range(end - report["added"], end))).values()))
+        metrics.increment("chunks_added", report["added"])
+        metrics.increment("duplicates_skipped", report["exact_duplicates"] + report["near_duplicates"])
+        return report
+
+    def _add_chunk_batch(self, chunks: List[str], sources: Optional[List[Optional[str]]],
+                         meta: Optional[List[Optional[Tuple[int, int, int]]]]) -> dict:
+        report = {"added": 0, "exact_duplicates": 0, "near_duplicates": 0}
+        sources = sources or [None] * len(chunks)
+        meta = meta or [None] * len(chunks)
+        batch = DedupIndex()
+        candidates = []
+        duplicate_refs = []  # (id в индексе или None, позиция кандидата или None, источник)
+        for chunk, source, row in zip(chunks, sources, meta):
+            text = chunk.strip()
+            if len(text) <= 30:
+                continue
+            digest, fingerprint = content_hash(text), simhash(text)
+            existing, pos = self.dedup.find_exact(digest), batch.find_exact(digest)
+            kind = "exact_duplicates"
+            if existing is None and pos is None and self.near_duplicates == "simhash":
+                existing = self.dedup.find_near(fingerprint)
+                pos = batch.find_near(fingerprint) if existing is None else None
+                kind = "near_duplicates"
+            if existing is not None or pos is not None:
+                report[kind] += 1
+                duplicate_refs.append((existing, pos, source))
+                continue
+            batch.register(len(candidates), digest, fingerprint)
+            candidates.append((text, digest, fingerprint, source, row or (0, 0, 0)))
+
+        if candidates:
+            embeddings = self._encode_chunks([c[0] for c in candidates])
+            keep = np.ones(len(candidates), dtype=bool)
+            redirect = {}
+            if self.near_duplicates == "cosine" and self.ntotal:
+                with self._rw.read():
+                    scores, ids = self._dense_search(embeddings, 1)
+                for pos in np.flatnonzero((scores[:, 0] >= self.near_duplicate_threshold) & (ids[:, 0] >= 0)):
+                    keep[pos] = False
+                    redirect[int(pos)] = int(ids[pos, 0])
+                    report["near_duplicates"] += 1
+                    duplicate_refs.append((redirect[int(pos)], None, candidates[pos][3]))
+            first_id = self._next_chunk_id()
+            new_ids = {}
+            for pos in np.flatnonzero(keep):
+                new_ids[int(pos)] = first_id + len(new_ids)
+            kept = [candidates[pos] for pos in new_ids]
+            if kept and self.shards is not None:
+                self._add_shard_batch(embeddings[keep], kept, first_id)
+            elif kept:
+                self._ensure_writable_index()
+                with self._rw.write():
+                    start = len(self.chunks)
+                    self.chunks.extend(c[0] for c in kept)
+                    self.bm25.add(c[0] for c in kept)
+                    add_vectors(self.index, embeddings[keep], start)
+                    for c in kept:
+                        self.chunk_meta.append(*c[4])
+                self._pending_vectors.append(embeddings[keep])
+            for pos, doc_id in new_ids.items():
+                self.dedup.register(doc_id, candidates[pos][1], candidates[pos][2])
+                if candidates[pos][4][0]:
+                    self._doc_chunks.setdefault(candidates[pos][4][0], []).append(doc_id)
+            duplicate_refs = [
+                (existing if existing is not None else new_ids.get(pos, redirect.get(pos)), None, source)
+                for existing, pos, source in duplicate_refs
+            ]
+            report["added"] = len(kept)
+
+        for doc_id, _, source in duplicate_refs:
+            self.duplicate_sources.setdefault(doc_id, []).append(source or "")
+            self._pending_duplicates.setdefault(doc_id, []).append(source or "")
+        for key, value in report.items():
+            self.ingest_stats[key] += value
+        if report["added"]:
+            self._invalidate_results()
+            if self.shards is None:
+                self._maybe_promote_index()
+        return report
+
+    def _next_chunk_id(self) -> int:
+        if self.shards is None:
+            return len(self.chunks)
+        return max(len(self.chunk_meta), self.shards.next_id)
+
+    def _add_shard_batch(self, embeddings: np.ndarray, kept: List[tuple], first_id: int):
+        """
+        Пока поиск идёт по шардам, новые чанки ложатся новым шардом: локальный
+        индекс уже не ищется. Сохранять их в сегментное хранилище не нужно —
+        шард и есть их копия на диске.
+        """
+        ids = np.arange(first_id, first_id + len(kept), dtype="int64")
+        documents = {c[4][0]: c[3] for c in kept if c[4][0]}
+        self.shards.add_shard(embeddings, [c[0] for c in kept], ids, backend=self._shard_backend(len(kept)),
+                              index_config=self.index_config,
+                              documents=[{"doc_id": doc, "filename": name} for doc, name in documents.items()])
+        with self._rw.write():
+            # Метаданные остаются по id: у чанков шардов, пришедших не через этот движок, — нули
+            while len(self.chunk_meta) < first_id:
+                self.chunk_meta.append(0)
+            for c in kept:
+                self.chunk_meta.append(*c[4])
+
+    def _encode_chunks(self, texts: List[str]) -> np.ndarray:
+        if self.chunk_cache is None:
+            with metrics.span("encode_chunks"):
+                embeddings = self.model.encode(texts, normalize_embeddings=True)
+            metrics.increment("chunks_encoded", len(texts))
+            return embeddings
+        model_name = getattr(self.model, "name", "default")
+        keys = [text_key(text) for text in texts]
+        cached = self.chunk_cache.get_many(model_name, keys)
+        embeddings = np.empty((len(texts), self.dim), dtype="float32")
+        missing = []
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = cached[key]
+            else:
+                missing.append(i)
+        if missing:
+            with metrics.span("encode_chunks"):
+                encoded = self.model.encode([texts[i] for i in missing], normalize_embeddings=True)
+            self.chunk_cache.put_many(model_name, [keys[i] for i in missing], encoded)
+            embeddings[missing] = encoded
+        metrics.increment("chunks_encoded", len(missing))
+        metrics.increment("chunk_cache_hits", len(texts) - len(missing))
+        return embeddings
+
+    def prune_chunk_cache(self) -> int:
+        """Удаляет из постоянного кэша векторы чанков, которых больше нет в индексе."""
+        if self.chunk_cache is None:
+            return 0
+        # Чанки удалённых документов ещё лежат в self.chunks до компакции, но живыми не считаются
+        alive = np.ones(len(self.chunks), dtype=bool)
+        alive[self._removed_ids[self._removed_ids < len(alive)]] = False
+        return self.chunk_cache.prune(getattr(self.model, "name", "default"),
+                                      (self.chunks[int(i)] for i in np.flatnonzero(alive)))
+
+    def add_chunk_stream(self, chunks: Iterable, batch_size: int = 256, max_queued_batches: int = 4,
+                         progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Индексирует поток чанков пачками. Чтение потока (извлечение PDF) идёт в отдельном
+        потоке и упирается в ограниченную очередь, пока модель кодирует предыдущие пачки.
+        Элементы потока — строки, пары (источник, чанк), как у iter_pdf_chunks, или
+        тройки (источник, чанк, (id документа, страница, глава)).
+        progress вызывается с отчётом каждой пачки.
+        """
+        batches = queue.Queue(maxsize=max_queued_batches)
+        done = object()
+        errors = []
+
+        def produce():
+            try:
+                batch = []
+                for item in chunks:
+                    if not isinstance(item, tuple):
+                        item = (None, item, None)
+                    batch.append(item if len(item) == 3 else (*item, None))
+                    if len(batch) >= batch_size:
+                        batches.put(batch)
+                        batch = []
+                if batch:
+                    batches.put(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                batches.put(done)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        total = {"added": 0, "exact_duplicates": 0, "near_duplicates": 0}
+        while True:
+            batch = batches.get()
+            if batch is done:
+                break
+            report = self.add_chunks([item[1] for item in batch], [item[0] for item in batch],
+                                     [item[2] for item in batch])
+            for key, value in report.items():
+                total[key] += value
+            if progress is not None:
+                progress(report)
+        producer.join()
+        if errors:
+            raise errors[0]
+        return total
+
+    def _ensure_writable_index(self):
+        if self._readonly_index_path:
+            index = faiss.read_index(self._readonly_index_path)
+            apply_search_params(index, self.index_config)
+            with self._rw.write():
+                self.index = index
+            self._readonly_index_path = None
+
+    def _initial_backend(self) -> str:
+        backend = resolve_backend(self.index_config, 0)
+        # IVF нельзя создать пустым — до набора обучающей выборки работаем на flat
+        return backend if can_build(backend, self.index_config, 0) else "flat"
+
+    def _maybe_promote_index(self):
+        target = resolve_backend(self.index_config, self.index.ntotal)
+        if target != self.index_backend and can_build(target, self.index_config, self.index.ntotal):
+            self.rebuild_index(target)
+
+    def rebuild_index(self, backend: Optional[str] = None):
+        """Переобучает и перестраивает индекс на уже добавленных векторах."""
+        with self._ingest_lock:
+            backend = backend or resolve_backend(self.index_config, self.index.ntotal)
+            if not can_build(backend, self.index_config, self.index.ntotal):
+                raise ValueError(f"Недостаточно векторов для обучения индекса {backend}")
+            self._ensure_writable_index()
+            # Новый индекс обучается рядом со старым, поиск переключается на него одной заменой.
+            # Векторы удалённых документов при этом выпадают, id остальных сохраняются
+            vectors, ids = extract_vectors(self.index), index_ids(self.index)
+            alive = ~np.isin(ids, self._removed_ids)
+            if alive.all() and unwrap_index(self.index) is self.index:
+                index = build_index(backend, vectors, self.dim, self.index_config)
+            else:
+                index = build_index(backend, vectors[alive], self.dim, self.index_config, ids=ids[alive])
+            with self._rw.write():
+                self.index = index
+                self.index_backend = backend
+            self._needs_full_save = True
+            self._invalidate_results()
+
+    def _invalidate_results(self):
+        self._generation += 1
+        self.result_cache.clear()
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        if nprobe is not None:
+            self.index_config["nprobe"] = nprobe
+        if ef_search is not None:
+            self.index_config["ef_search"] = ef_search
+        apply_search_params(self.index, self.index_config)
+        self._search_params = None
+        self._invalidate_results()
+
+    def mark_fragment_as_bad(self, fragment: str) -> List[int]:
+        """
+        Отмечает чанки, содержащие фрагмент, как неверные и возвращает их id.
+        Чанк целиком находится по хешу содержимого, часть текста — среди
+        кандидатов плотного и BM25-поиска проверкой вхождения подстроки.
+        """
+        text = fragment.strip()
+        if not text or not self.ntotal:
+            return []
+        ids = self._resolve_fragment(text)
+        metrics.increment("bad_fragment_marks")
+        with self._feedback_lock:
+            for doc_id in ids:
+                count = self.negative_feedback[doc_id] = self.negative_feedback.get(doc_id, 0) + 1
+                if doc_id in self.dedup.digests:
+                    self._feedback_changes[format(self.dedup.digests[doc_id], "016x")] = count
+        if ids:
+            with self._rw.write():
+                self._refresh_search_filters()
+            self._invalidate_results()
+            if self._persisted_folder:
+                self._save_negative_feedback(self._persisted_folder)
+        return ids
+
+    def _resolve_fragment(self, text: str, candidates: int = 20) -> List[int]:
+        exact = self.dedup.find_exact(content_hash(text))
+        if exact is not None:
+            return [exact]
+        needle = " ".join(text.split()).lower()
+        embedding = np.asarray(self.model.encode([text], normalize_embeddings=True), dtype="float32")
+        with self._rw.read():
+            _, dense_ids = self._dense_search(embedding, candidates)
+            _, lexical_ids = self._lexical_search([text], candidates)
+        found = list(dict.fromkeys(int(i) for i in np.concatenate([dense_ids[0], lexical_ids[0]]) if i >= 0))
+        texts = self._chunk_texts(found)
+        return [i for i in found if i in texts and needle in " ".join(texts[i].split()).lower()]
+
+    def _refresh_search_filters(self):
+        """
+        Пересобирает исключаемые id (отвергнутые отзывами и удалённые документы)
+        и веса штрафов; вызывается только при их изменении.
+        """
+        limit = self.bad_feedback_exclude_after
+        excluded = sorted(i for i, count in self.negative_feedback.items() if count >= limit)
+        penalized = sorted(i for i, count in self.negative_feedback.items() if count < limit)
+        excluded = np.union1d(np.array(excluded, dtype="int64"), self._removed_ids)
+        self._excluded_ids = excluded
+        self._penalized_ids = np.array(penalized, dtype="int64")
+        self._penalty_weights = np.array(
+            [(1.0 - self.bad_feedback_penalty) ** self.negative_feedback[i] for i in penalized],
+            dtype="float32",
+        )
+        self._selector = None
+        self._search_params = None
+        if len(excluded):
+            self._selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(self._excluded_ids))
+        if self.shards is not None:
+            self.shards.set_excluded(self._excluded_ids)
+
+    def _dense_search(self, embeddings: np.ndarray, k: int):
+        with metrics.span("dense_search"):
+            return self._dense_search_unmetered(embeddings, k)
+
+    def _dense_search_unmetered(self, embeddings: np.ndarray, k: int):
+        if self.shards is not None:
+            return self.shards.search(embeddings, k)
+        if self._selector is None:
+            return self.index.search(embeddings, k)
+        # Параметры привязаны к конкретному объекту индекса и пересоздаются после его замены
+        if self._search_params is None or self._search_params_index is not self.index:
+            self._search_params = make_search_params(self.index, self.index_config, self._selector)
+            self._search_params_index = self.index
+        return self.index.search(embeddings, k, params=self._search_params)
+
+    def _apply_penalties(self, scores: np.ndarray, ids: np.ndarray):
+        if not len(self._penalized_ids):
+            return scores, ids
+        pos = np.minimum(np.searchsorted(self._penalized_ids, ids), len(self._penalized_ids) - 1)
+        hit = self._penalized_ids[pos] == ids
+        if not hit.any():
+            return scores, ids
+        # Логиты cross-encoder и косинус бывают отрицательными: умножение на вес < 1
+        # подняло бы такой чанк, поэтому отрицательный score на вес делится
+        weights = np.where(hit, self._penalty_weights[pos], 1.0).astype(scores.dtype)
+        scores = np.where(scores >= 0, scores * weights, scores / weights)
+        order = np.argsort(-scores, kind="stable")
+        # Пустые места (id=-1) остаются в конце выдачи
+        order = np.concatenate([order[ids[order] >= 0], order[ids[order] < 0]])
+        return scores[order], ids[order]
+
+    def _save_negative_feedback(self, folder: str, full: bool = False):
+        """full=True переписывает все счётчики (полный снимок), иначе только изменённые."""
+        with self._feedback_lock:
+            if full:
+                counts = {
+                    format(self.dedup.digests[doc_id], "016x"): count
+                    for doc_id, count in self.negative_feedback.items() if doc_id in self.dedup.digests
+                }
+            else:
+                counts = self._feedback_changes
+            if counts or full:
+                SegmentStore(folder).save_negative_feedback(counts, replace=full)
+            self._feedback_changes = {}
+
+    def _load_negative_feedback(self, store: SegmentStore):
+        self.negative_feedback = {}
+        self._feedback_changes = {}
+        for digest, count in store.load_negative_feedback().items():
+            doc_id = self.dedup.find_exact(int(digest, 16))
+            if doc_id is not None:
+                self.negative_feedback[doc_id] = count
+        self._refresh_search_filters()
 
     def save_index(self, folder: str = "models"):
-        os.makedirs(folder, exist_ok=True)
-        faiss.write_index(self.index, os.path.join(folder, "faiss_index.bin"))
-        with open(os.path.join(folder, "chunks.json"), "w", encoding="utf-8") as f:
-            json.dump(self.chunks, f, ensure_ascii=False, indent=2)
+        """
+        Дописывает в хранилище только то, что добавлено после прошлого сохранения.
+        Полный снимок пишется при первом сохранении в папку и после перестроения индекса.
+        """
+        with self._ingest_lock, metrics.span("save_index"):
+            self._save_index(folder)
+
+    def _save_index(self, folder: str):
+        store = SegmentStore(folder)
+        manifest = store.read_manifest()
+        meta = {"backend": self.index_backend, "config": self.index_config, "dim": self.dim}
+        incremental = (
+            manifest is not None
+            and not self._needs_full_save
+            and self._persisted_folder == os.path.abspath(folder)
+            and store.total_count(manifest) == self._persisted_count
+        )
+        if not incremental:
+            extras = {
+                "bm25": self.bm25,
+                "hashes": self.dedup.export(range(len(self.chunks))),
+                "duplicates": self.duplicate_sources,
+                "meta": self.chunk_meta.to_array(),
+            }
+            base = store.write_base(self.index, self.chunks, meta, self._document_entries(), extras,
+                                    removed_documents=self.removed_documents)
+            with self._rw.write():
+                self.chunks = ChunkList([base])
+        elif self._pending_removals or self._pending_owners:
+            store.remove_documents(self._pending_removals, self._pending_owners)
+        if incremental and len(self.chunks) > self._persisted_count:
+            new_chunks = self.chunks[self._persisted_count:]
+            # Постинги сегмента с локальными id: при загрузке они сдвигаются на начало сегмента
+            segment_bm25 = BM25Index()
+            segment_bm25.add(new_chunks)
+            extras = {
+                "bm25": segment_bm25,
+                "hashes": self.dedup.export(range(self._persisted_count, len(self.chunks))),
+                "duplicates": self._pending_duplicates,
+                "meta": self.chunk_meta.to_array(self._persisted_count, len(self.chunks)),
+            }
+            segment = store.append_segment(
+                np.vstack(self._pending_vectors), new_chunks, meta, self._pending_documents, extras,
+            )
+            with self._rw.write():
+                self.chunks.persist_tail(segment)
+            if len(store.read_manifest()["segments"]) >= self.compact_after_segments:
+                store.compact_in_background(self.dim, self.index_config)
+        self._mark_persisted(folder)
+        self._save_negative_feedback(folder, full=not incremental)
+        if self.query_cache_path:
+            self.embedding_cache.save(self.query_cache_path)
+
+    def _mark_persisted(self, folder: Optional[str]):
+        self._persisted_folder = os.path.abspath(folder) if folder else None
+        self._persisted_count = len(self.chunks)
+        self._pending_vectors = []
+        self._pending_documents = []
+        self._pending_duplicates = {}
+        self._pending_removals = []
+        self._pending_owners = {}
+        self._needs_full_save = False
+
+    def compact_index(self, folder: str = "models", background: bool = False):
+        """Сливает накопленные сегменты в один базовый индекс."""
+        store = SegmentStore(folder)
+        if background:
+            return store.compact_in_background(self.dim, self.index_config)
+        return store.compact(self.dim, self.index_config)
 
     def load_index(self, folder: str = "models"):
-        index_path = os.path.join(folder, "faiss_index.bin")
-        chunks_path = os.path.join(folder, "chunks.json")
-        if os.path.exists(index_path) and os.path.exists(chunks_path):
-            self.index = faiss.read_index(index_path)
-            with open(chunks_path, "r", encoding="utf-8") as f:
-                self.chunks = json.load(f)
-        else:
+        with self._ingest_lock:
+            self._load_index(folder)
+
+    def _load_index(self, folder: str):
+        started = time.perf_counter()
+        store = SegmentStore(folder)
+        migrate_legacy_index(folder)
+        manifest = store.read_manifest()
+        if manifest is None:
             raise FileNotFoundError("Индекс не найден")
+        snapshot = read_snapshot(snapshot_path(folder), manifest) if self.warm_snapshot else None
+        if snapshot is not None:
+            index, chunks = snapshot["index"], ChunkList([snapshot["chunks"]])
+            bm25, hashes, duplicates = snapshot["bm25"], snapshot["hashes"], snapshot["duplicates"]
+            chunk_meta = snapshot["meta"]
+        else:
+            index, vectors, chunks = store.load(manifest)
+            if vectors:
+                add_vectors(index, np.vstack(vectors), manifest["base"]["count"])
+            extras = store.load_extras(manifest)
+            bm25 = extras["bm25"]
+            if bm25 is None:
+                bm25 = BM25Index()
+                bm25.add(chunks)
+            hashes = extras["hashes"] if extras["hashes"] is not None else hash_chunks(chunks)
+            chunk_meta, duplicates = extras["meta"], extras["duplicates"]
+        apply_search_params(index, self.index_config)
+        removed_documents = set(manifest.get("removed_documents", []))
+        dead = np.isin(chunk_meta["doc"], np.array(sorted(removed_documents), dtype=np.uint32))
+        # Строки, вычищенные компакцией, остаются пустыми местами без хеша: их id не регистрируются
+        live = np.flatnonzero(~dead & hashes.any(axis=1))
+        dedup = DedupIndex()
+        dedup.register_many(live, hashes[live, 0], hashes[live, 1])
+        # Загруженное состояние подменяет текущее целиком, поиск не видит его наполовину
+        with self._rw.write():
+            self.index = index
+            self.chunks = chunks
+            self.bm25 = bm25
+            self.dedup = dedup
+            self.chunk_meta = ChunkMeta(chunk_meta)
+            self.removed_documents = removed_documents
+            self._removed_ids = np.flatnonzero(dead).astype("int64")
+            self.index_backend = manifest["meta"]["backend"]
+            self._dim = manifest["meta"].get("dim", index.d)
+            self._load_negative_feedback(store)
+        self.duplicate_sources = {i: sources for i, sources in duplicates.items() if not dead[i]}
+        self._doc_chunks = _group_by_document(chunk_meta["doc"], live)
+        # Списки IVF, открытые через mmap (снимок или база без сегментов), только для чтения:
+        # перед изменением индекс перечитывается в память из того же файла
+        readonly = (faiss.try_extract_index_ivf(index) is not None
+                    and (snapshot is not None or not manifest["segments"]))
+        if readonly:
+            self._readonly_index_path = snapshot["index_path"] if snapshot else store.base_index_path(manifest)
+        else:
+            self._readonly_index_path = None
+        self._restore_documents(store.documents(manifest))
+        self._next_doc_id = max(manifest.get("next_document", 1), 1 + max(
+            [0, *removed_documents, *self.documents, int(chunk_meta["doc"].max(initial=0))]))
+        self._mark_persisted(folder)
+        self._invalidate_results()
+        self.load_stats = {"source": "snapshot" if snapshot is not None else "segments",
+                           "seconds": time.perf_counter() - started, "chunks": len(chunks)}
+        if snapshot is None and self.warm_snapshot:
+            # Следующий старт прочитает всё через mmap; снимок не обязателен для работы.
+            # Переписываются только секции, изменившиеся с прошлого снимка
+            try:
+                # Списки IVF из mmap (OnDiskInvertedLists) сериализуются ссылкой на файл,
+                # поэтому в снимок идёт копия индекса, прочитанная в память, — и только если
+                # индекс в снимке устарел
+                readonly_path = self._readonly_index_path
+                snapshot_index = (lambda: faiss.read_index(readonly_path)) if readonly else index
+                write_snapshot(snapshot_path(folder), manifest, snapshot_index, chunks, hashes, chunk_meta,
+                               bm25, duplicates)
+            except OSError as e:
+                self.load_stats["snapshot_error"] = str(e)
 
-    def add_document(self, pdf_path: str) -> bool:
+    def add_document(self, pdf_path: str, folder: Optional[str] = "models",
+                     progress: Optional[Callable[[dict], None]] = None) -> bool:
+        """Индексирует PDF с метаданными чанков; folder=None — не сохранять индекс."""
         pdf_hash = self._compute_pdf_hash(pdf_path)
         if pdf_hash in self.document_hashes:
             return False
-        from src.pdf_loader import process_pdf_to_chunks
-        chunks = process_pdf_to_chunks(pdf_path)
-        if not chunks:
-            return False
-        self.add_chunks(chunks)
+        from src.pdf_loader import iter_pdf_chunk_records
         filename = os.path.basename(pdf_path)
-        self.loaded_documents.append(filename)
-        self.document_hashes.add(pdf_hash)
-        self._save_document_metadata()
-        self.save_index()
+        with self._ingest_lock:
+            # Id занимается до чтения PDF и не переиспользуется, даже если документ не добавится
+            doc_id = self._next_doc_id
+            self._next_doc_id += 1
+            chapters = {}
+
+            def records():
+                for _, chunk, page, chapter_no, title in iter_pdf_chunk_records([pdf_path]):
+                    chapters.setdefault(chapter_no, title)
+                    yield filename, chunk, (doc_id, page, chapter_no)
+
+            try:
+                report = self.add_chunk_stream(records(), progress=progress)
+            except Exception:
+                # Пачки, успевшие попасть в индекс до сбоя (битая страница), убираются как удалённый документ
+                self._drop_document_chunks(doc_id)
+                raise
+            if not report["added"]:
+                return False
+            entry = {"doc_id": doc_id, "filename": filename, "hash": pdf_hash,
+                     "chapters": [chapters[n] for n in sorted(chapters)]}
+            self.documents[doc_id] = entry
+            self.loaded_documents.append(filename)
+            self.document_hashes.add(pdf_hash)
+            # Документ фиксируется в манифесте вместе со своим сегментом
+            self._pending_documents.append(entry)
+            if folder and self.shards is None:
+                self._save_index(folder)
         return True
 
+    def _find_document(self, document: Union[int, str]) -> Optional[int]:
+        if isinstance(document, (int, np.integer)):
+            return int(document) if int(document) in self.documents else None
+        name = os.path.basename(document)
+        # При повторяющемся имени берётся последний загруженный документ
+        matches = [doc_id for doc_id, entry in self.documents.items() if entry["filename"] == name]
+        return matches[-1] if matches else None
+
+    def remove_document(self, document: Union[int, str], folder: Optional[str] = "models") -> int:
+        """
+        Удаляет документ по id или имени файла за время, пропорциональное числу
+        его чанков: чанки исключаются из поиска сразу, из файлов — при компакции.
+        Чанк, текст которого при индексации встретился и в другом документе,
+        переходит к тому документу. Возвращает число удалённых чанков.
+        """
+        with self._ingest_lock:
+            doc_id = self._find_document(document)
+            if doc_id is None:
+                return 0
+            entry = self.documents.pop(doc_id)
+            removed = self._drop_document_chunks(doc_id)
+            if entry["filename"] in self.loaded_documents:
+                self.loaded_documents.remove(entry["filename"])
+            self.document_hashes.discard(entry["hash"])
+            if folder:
+                self._save_index(folder)
+        return removed
+
+    def _drop_document_chunks(self, doc_id: int) -> int:
+        """Исключает чанки документа из поиска (общие с другими документами передаются им)."""
+        owners = {e["filename"]: other for other, e in self.documents.items()}
+        removed = []
+        for chunk_id in self._doc_chunks.pop(doc_id, []):
+            owner = next((owners[s] for s in self.duplicate_sources.get(chunk_id, []) if s in owners), None)
+            if owner is None:
+                removed.append(chunk_id)
+                continue
+            self.chunk_meta[chunk_id] = (owner, 0, 0)
+            self._doc_chunks.setdefault(owner, []).append(chunk_id)
+            self._pending_owners[chunk_id] = owner
+        with self._feedback_lock:
+            for chunk_id in removed:
+                if self.negative_feedback.pop(chunk_id, None) is not None and chunk_id in self.dedup.digests:
+                    self._feedback_changes[format(self.dedup.digests[chunk_id], "016x")] = 0
+        for chunk_id in removed:
+            self.dedup.unregister(chunk_id)
+            self.duplicate_sources.pop(chunk_id, None)
+        with self._rw.write():
+            self._removed_ids = np.union1d(self._removed_ids, np.array(removed, dtype="int64"))
+            self._refresh_search_filters()
+        self.removed_documents.add(doc_id)
+        self._pending_removals.append(doc_id)
+        self._invalidate_results()
+        return len(removed)
+
+    def replace_document(self, pdf_path: str, document: Optional[Union[int, str]] = None,
+                         folder: Optional[str] = "models") -> bool:
+        """
+        Заменяет документ новой версией PDF (по умолчанию — документ с тем же
+        именем файла). Неизменившиеся чанки берутся из кэша эмбеддингов.
+        """
+        with self._ingest_lock:
+            self.remove_document(document if document is not None else pdf_path, folder=None)
+            return self.add_document(pdf_path, folder=folder)
+
+    def source_of(self, chunk_id: int) -> dict:
+        """Откуда чанк: имя файла, страница и глава (None, если неизвестно)."""
+        doc_id, page, chapter = self.chunk_meta[chunk_id] if 0 <= chunk_id < len(self.chunk_meta) else (0, 0, 0)
+        entry = self.documents.get(doc_id, {})
+        chapters = entry.get("chapters", [])
+        return {
+            "document": entry.get("filename"),
+            "page": page or None,
+            "chapter": chapters[chapter - 1] if 0 < chapter <= len(chapters) else None,
+        }
+
+    def retrieve(self, queries: List[str], k: int = 5, mode: Optional[str] = None,
+                 rerank: Optional[bool] = None) -> List[List[dict]]:
+        """
+        Top-k чанков на каждый запрос с текстом, score и источником. С реранкером
+        (rerank=None — если он настроен) score — оценка cross-encoder, retrieval_score —
+        оценка первого этапа, reranked=False у чанков, до которых второй этап не дошёл.
+        """
+        if rerank is None:
+            rerank = self.reranker is not None
+        elif rerank and self.reranker is None:
+            raise ValueError("Реранкер не настроен: передайте reranker_model в RAGEngine")
+        if not queries or self.ntotal == 0:
+            return [[] for _ in queries]
+        candidates = max(k, self.rerank_candidates) if rerank else k
+        scores, indices = self.search_many(queries, k=candidates, mode=mode)
+        texts = self._chunk_texts(sorted({int(i) for i in indices.ravel() if i >= 0}))
+        rows = self._rerank(queries, scores, indices, texts) if rerank else [
+            [(int(i), float(score), float(score), False) for score, i in zip(row_scores, row_ids) if int(i) in texts]
+            for row_scores, row_ids in zip(scores, indices)
+        ]
+        hits = [
+            [{"id": i, "score": score, "text": texts[i], **self.source_of(i),
+              "retrieval_score": first, "reranked": reranked}
+             for i, score, first, reranked in row[:k]]
+            for row in rows
+        ]
+        if self.translator is not None:
+            # Все показываемые чанки пачки переводятся одним вызовом; без пакета Argos
+            # translation совпадает с оригиналом
+            flat = [hit for row in hits for hit in row]
+            for hit, text in zip(flat, self._translate_texts([hit["text"] for hit in flat])):
+                hit["translation"] = text
+        return hits
+
+    def _rerank(self, queries: List[str], scores: np.ndarray, indices: np.ndarray,
+                texts: dict) -> List[List[Tuple[int, float, float, bool]]]:
+        """
+        Переупорядочивает выдачу первого этапа одной пачкой cross-encoder.
+        Строки — (id, score, score первого этапа, переранжирован ли); чанки, до
+        которых реранкер не дошёл (бюджет) или весь этап пропущен, идут следом
+        в исходном порядке.
+        """
+        candidates = [
+            [(int(i), float(score)) for score, i in zip(row_scores, row_ids) if int(i) in texts]
+            for row_scores, row_ids in zip(scores, indices)
+        ]
+        reranked = self.reranker.rerank(queries, [[texts[i] for i, _ in row] for row in candidates])
+        rows = []
+        for q, row in enumerate(candidates):
+            depth = len(reranked[q]) if reranked is not None else 0
+            first = dict(row)
+            head = []
+            if depth:
+                ids = np.array([i for i, _ in row[:depth]], dtype="int64")
+                order = np.argsort(-reranked[q], kind="stable")
+                # Отметки «неверно» снижают и оценку второго этапа
+                head_scores, head_ids = self._apply_penalties(reranked[q][order], ids[order])
+                head = [(int(i), float(score), first[int(i)], True) for score, i in zip(head_scores, head_ids)]
+            rows.append(head + [(i, score, score, False) for i, score in row[depth:]])
+        return rows
+
     def get_loaded_documents(self) -> List[str]:
         return self.loaded_documents.copy()
 
-    def ask(self, query: str) -> Tuple[str, str]:
-        if self.index.ntotal == 0:
-            return "Сначала загрузите инструкции.", ""
-        query_emb = self.model.encode([query], normalize_embeddings=True)
-        k = min(20, self.index.ntotal)
-        scores, indices = self.index.search(query_emb, k)
-        for i in range(len(indices[0])):
-            idx = indices[0][i]
-            if idx >= len(self.chunks):
+    def search_many(self, queries: List[str], k: int = 20, mode: Optional[str] = None):
+        """
+        Один батчевый encode и один матричный index.search на все запросы,
+        которых ещё нет в кэше результатов. В режиме hybrid плотный и BM25-поиск
+        объединяются через reciprocal rank fusion.
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {mode}")
+        k = min(k, self.ntotal)
+        keys = [normalize_query(q) for q in queries]
+        generation = self._generation
+        results = [self.result_cache.get((key, k, mode, generation)) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        metrics.increment("result_cache_hits", len(queries) - len(missing))
+        if missing:
+            if mode != "lexical":
+                query_embs = self._encode_queries([queries[i] for i in missing], [keys[i] for i in missing])
+            computed = {}
+            with self._rw.read():
+                generation = self._generation
+                if mode != "lexical":
+                    dense_scores, dense_indices = self._dense_search(query_embs, k)
+                if mode != "dense":
+                    lexical_scores, lexical_ids = self._lexical_search([queries[i] for i in missing], k)
+                for row, i in enumerate(missing):
+                    if mode == "dense":
+                        result = (dense_scores[row], dense_indices[row])
+                    elif mode == "lexical":
+                        result = (lexical_scores[row], lexical_ids[row])
+                    else:
+                        result = self._fuse([dense_indices[row], lexical_ids[row]], k)
+                    computed[i] = self._apply_penalties(*result)
+            for i, result in computed.items():
+                results[i] = result
+                self.result_cache.put((keys[i], k, mode, generation), result)
+        return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+    def _lexical_search(self, queries: List[str], k: int):
+        with metrics.span("bm25_search"):
+            if self.shards is not None:
+                return self.shards.search_lexical(queries, k)
+            rows = [self.bm25.search(query, k, exclude=self._excluded_ids) for query in queries]
+            return np.vstack([r[0] for r in rows]), np.vstack([r[1] for r in rows])
+
+    @property
+    def ntotal(self) -> int:
+        if self.shards is not None:
+            return self.shards.ntotal
+        return self._index.ntotal if self._index is not None else 0
+
+    def export_shards(self, folder: str, n_shards: int, processes: bool = True,
+                      index_folder: Optional[str] = None) -> ShardedIndex:
+        """
+        Раскладывает сохранённый индекс на n_shards шардов в folder (id чанков
+        сохраняются) и возвращает клиента шардов для use_shards. Чанки одного
+        документа всегда попадают в один шард. Шарды собираются по одному из
+        сегментного хранилища index_folder (по умолчанию — папки последнего
+        сохранения): в памяти только векторы и тексты текущего шарда, так что
+        корпус не обязан помещаться в память процесса. Несохранённые изменения
+        движка сначала дописываются в хранилище.
+        """
+        with self._ingest_lock:
+            index_folder = index_folder or self._persisted_folder
+            if index_folder is None:
+                raise ValueError("Шарды собираются из сохранённого индекса: сначала вызовите save_index")
+            if len(self.chunks) and self._has_unsaved_changes(index_folder):
+                self._save_index(index_folder)
+            store = SegmentStore(index_folder)
+            # Блокировка хранилища не даёт компакции удалить файлы частей, пока их читают
+            with store.lock:
+                return self._export_store(store, folder, n_shards, processes)
+
+    def _export_store(self, store: SegmentStore, folder: str, n_shards: int, processes: bool) -> ShardedIndex:
+        manifest = store.read_manifest()
+        if manifest is None:
+            raise FileNotFoundError("Индекс не найден")
+        docs = store.load_meta(manifest)["doc"]
+        ids = store.vector_ids(manifest)
+        removed = np.array(manifest.get("removed_documents", []), dtype=np.uint32)
+        ids = ids[~np.isin(docs[ids], removed)]
+        # Документы раскладываются подряд (внутри — по id), чтобы границы шардов шли между ними
+        docs = docs[ids]
+        order = np.lexsort((ids, docs))
+        ids, docs = ids[order], docs[order]
+        chunks = store.open_chunks(manifest)
+        names = {entry["doc_id"]: entry.get("filename") for entry in store.documents(manifest) if "doc_id" in entry}
+        sharded = ShardedIndex(folder, processes=processes)
+        for start, end in partition_ranges(len(ids), n_shards, docs):
+            shard_ids = ids[start:end]
+            documents = [{"doc_id": int(doc), "filename": names.get(int(doc))}
+                         for doc in np.unique(docs[start:end]) if doc]
+            sharded.add_shard(store.read_vectors(manifest, shard_ids), [chunks[int(i)] for i in shard_ids],
+                              shard_ids, backend=self._shard_backend(end - start),
+                              index_config=self.index_config, documents=documents)
+        return sharded
+
+    def _has_unsaved_changes(self, folder: str) -> bool:
+        return (self._persisted_folder != os.path.abspath(folder) or self._needs_full_save
+                or len(self.chunks) > self._persisted_count or bool(self._pending_removals or self._pending_owners))
+
+    def _shard_backend(self, count: int) -> str:
+        backend = resolve_backend(self.index_config, count)
+        return backend if can_build(backend, self.index_config, count) else "flat"
+
+    def use_shards(self, shards: Optional[ShardedIndex]):
+        """
+        Переключает поиск на шарды; None возвращает локальный индекс. Пока
+        шарды подключены, add_chunks и add_document пишут новые шарды.
+        """
+        with self._rw.write():
+            self.shards = shards
+            if shards is not None:
+                shards.set_excluded(self._excluded_ids)
+                # Id документов шардов не переиспользуются новыми документами
+                self._next_doc_id = max([self._next_doc_id, *(doc["doc_id"] + 1 for doc in shards.documents)])
+        self._invalidate_results()
+
+    def _chunk_texts(self, ids: List[int]) -> dict:
+        with metrics.span("fetch_chunks"):
+            if self.shards is not None:
+                return self.shards.get_chunks(ids)
+            return {i: self.chunks[i] for i in ids if 0 <= i < len(self.chunks)}
+
+    @staticmethod
+    def _fuse(rankings, k: int):
+        scores = np.zeros(k, dtype="float32")
+        ids = np.full(k, -1, dtype="int64")
+        for pos, (doc_id, score) in enumerate(reciprocal_rank_fusion(rankings, limit=k)):
+            ids[pos] = doc_id
+            scores[pos] = score
+        return scores, ids
+
+    def _encode_queries(self, queries: List[str], keys: List[str]) -> np.ndarray:
+        embs = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, emb in enumerate(embs) if emb is None]
+        if missing:
+            # Повторы внутри одной пачки кодируем один раз
+            unique = {keys[i]: queries[i] for i in missing}
+            with metrics.span("encode_query"):
+                encoded = self.model.encode(list(unique.values()), normalize_embeddings=True)
+            by_key = dict(zip(unique, encoded))
+            for key, emb in by_key.items():
+                self.embedding_cache.put(key, emb)
+            for i in missing:
+                embs[i] = by_key[keys[i]]
+        return np.vstack(embs).astype("float32")
+
+    def cache_stats(self) -> dict:
+        stats = {"embeddings": self.embedding_cache.stats(), "results": self.result_cache.stats()}
+        if self.chunk_cache is not None:
+            stats["chunks"] = self.chunk_cache.stats()
+        if self.reranker is not None:
+            stats["rerank"] = {**self.reranker.cache.stats(), **self.reranker.stats}
+        if self.translator is not None:
+            stats["translation"] = self.translator.stats()
+        return stats
+
+    def _answer_from_hits(self, indices, texts: Optional[dict] = None,
+                          translations: Optional[dict] = None) -> Tuple[str, str]:
+        if texts is None:
+            texts = self._chunk_texts([int(i) for i in indices if i >= 0])
+        with metrics.span("format_answer"):
+            return self._format_answer(indices, texts, translations or {})
+
+    def _format_answer(self, indices, texts: dict, translations: dict) -> Tuple[str, str]:
+        # Ответ показывается по-русски, контекст — оригинал чанка: по нему работает обратная связь
+        for idx in indices:
+            chunk = texts.get(int(idx))
+            if chunk is None:
                 continue
-            chunk = self.chunks[idx]
-            formatted = chunk.replace(". ", ".\n\n").strip()
+            formatted = translations.get(int(idx), chunk).replace(". ", ".\n\n").strip()
+            source = self._format_source(self.source_of(int(idx)))
+            if source:
+                formatted += "\n\n" + source
             return formatted, chunk
-        return "Подходящий фрагмент не найден.", ""
\ No newline at end of file
+        return "Подходящий фрагмент не найден.", ""
+
+    @staticmethod
+    def _format_source(source: dict) -> str:
+        if not source["document"]:
+            return ""
+        parts = [source["document"]]
+        if source["page"]:
+            parts.append(f"стр. {source['page']}")
+        if source["chapter"]:
+            parts.append(f"раздел «{source['chapter']}»")
+        return "Источник: " + ", ".join(parts)
+
+    def ask_many(self, queries: List[str], mode: Optional[str] = None) -> List[Tuple[str, str]]:
+        if self.ntotal == 0:
+            return [("Сначала загрузите инструкции.", "") for _ in queries]
+        if not queries:
+            return []
+        metrics.increment("queries", len(queries))
+        with metrics.request("ask_many", queries=len(queries)):
+            k = self.rerank_candidates if self.reranker is not None else 20
+            scores, indices = self.search_many(queries, k=k, mode=mode)
+            # Тексты всех пачек запросов — одним обращением (для шардов это один круг по процессам)
+            texts = self._chunk_texts(sorted({int(i) for i in indices.ravel() if i >= 0}))
+            if self.reranker is not None:
+                rows = [[i for i, *_ in row] for row in self._rerank(queries, scores, indices, texts)]
+            else:
+                rows = [[int(i) for i in row if int(i) in texts] for row in indices]
+            translations = self._translate_answers(rows, texts) if self.translator is not None else None
+            return [self._answer_from_hits(row, texts, translations) for row in rows]
+
+    def _translate_answers(self, rows: List[List[int]], texts: dict) -> dict:
+        """Переводит только чанки, которые станут ответами, — одной пачкой на все запросы."""
+        ids = list(dict.fromkeys(row[0] for row in rows if row))
+        return dict(zip(ids, self._translate_texts([texts[i] for i in ids])))
+
+    def _translate_texts(self, texts: List[str]) -> List[str]:
+        """Перевод с откатом к оригиналу: без пакета Argos ответ и индексация не падают."""
+        try:
+            return self.translator.translate(texts)
+        except (ImportError, RuntimeError):
+            metrics.increment("translation_errors")
+            return list(texts)
+
+    def ask(self, query: str, mode: Optional[str] = None) -> Tuple[str, str]:
+        return self.ask_many([query], mode=mode)[0]
+
+
+def _group_by_document(docs: np.ndarray, ids: np.ndarray) -> Dict[int, List[int]]:
+    """id чанков каждого документа (документ 0 — чанки без документа — пропускается)."""
+    ids = ids[docs[ids] > 0]
+    order = ids[np.argsort(docs[ids], kind="stable")]
+    keys, starts = np.unique(docs[order], return_index=True)
+    return {int(doc): part.tolist() for doc, part in zip(keys, np.split(order, starts[1:]))}
@@ -0,0 +1,141 @@
+"""
+Второй этап поиска: локальный cross-encoder переупорядочивает кандидатов
+первого этапа (FAISS/BM25). Пары (запрос, чанк) всех запросов пачки
+оцениваются одним вызовом predict, оценки кэшируются по паре, так что
+повторный вопрос переранжируется без модели.
+
+Под нагрузкой второй этап ужимается или пропускается: если модель уже занята
+другой пачкой или оценка времени (скользящее среднее цены одной пары ×
+число неоценённых пар) не укладывается в budget_ms, переранжируется только
+начало выдачи, а если и оно не влезает — выдача первого этапа остаётся как есть.
+"""
+
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from src import metrics
+from src.embedding_cache import text_key
+from src.query_cache import LRUCache, normalize_query
+
+# Многоязычная модель, обученная на mMARCO (в том числе русском); ~118M параметров
+DEFAULT_RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+# Вес нового замера в скользящем среднем цены пары
+_COST_SMOOTHING = 0.3
+# Пропуск по бюджету понемногу снижает оценку, чтобы после всплеска нагрузки
+# реранкер снова попробовал отработать и обновил замер
+_COST_DECAY_ON_SKIP = 0.95
+
+
+class Reranker:
+    def __init__(self, model_name: str = DEFAULT_RERANKER_MODEL, budget_ms: Optional[float] = 300.0,
+                 min_depth: int = 3, max_concurrent: int = 1, batch_size: int = 32, max_length: int = 256,
+                 cache_max_entries: int = 100_000, model=None):
+        # budget_ms=None — без ограничения по времени; min_depth — меньше этого
+        # числа кандидатов на запрос переранжировать нет смысла, этап пропускается
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.min_depth = min_depth
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache = LRUCache(max_entries=cache_max_entries)
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._pair_seconds = None
+        self.stats = {"batches": 0, "pairs_scored": 0, "skipped_busy": 0, "skipped_budget": 0, "truncated": 0}
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # sentence_transformers тянет torch — импортируется только здесь
+                    from sentence_transformers import CrossEncoder
+
+                    with metrics.span("load_reranker"):
+                        self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def estimate_seconds(self, pairs: int) -> Optional[float]:
+        """Ожидаемое время оценки pairs новых пар; None — замеров ещё не было."""
+        return None if self._pair_seconds is None else self._pair_seconds * pairs
+
+    def rerank(self, queries: Sequence[str], candidates: Sequence[Sequence[str]]) -> Optional[List[np.ndarray]]:
+        """
+        Оценки релевантности начала списка кандидатов каждого запроса (чем выше,
+        тем лучше; одинаковая глубина для всей пачки). None — этап пропущен.
+        """
+        keys = [normalize_query(q) for q in queries]
+        chunk_keys = [[text_key(text) for text in row] for row in candidates]
+        scores = [[self.cache.get((key, chunk)) for chunk in row] for key, row in zip(keys, chunk_keys)]
+        hits = sum(score is not None for row in scores for score in row)
+        metrics.increment("rerank_cache_hits", hits)
+        depth = self._affordable_depth(scores)
+        if depth is None:
+            return None
+        missing = {}
+        for i, row in enumerate(scores):
+            for j in range(min(depth, len(row))):
+                if row[j] is None:
+                    # Одинаковые пары внутри пачки оцениваются один раз
+                    missing.setdefault((keys[i], chunk_keys[i][j]), (queries[i], candidates[i][j]))
+        by_pair = {}
+        if missing:
+            if not self._slots.acquire(blocking=False):
+                self.stats["skipped_busy"] += 1
+                metrics.increment("rerank_skipped_busy")
+                return None
+            try:
+                predicted = self._predict(list(missing.values()))
+            finally:
+                self._slots.release()
+            by_pair = dict(zip(missing, map(float, predicted)))
+            for pair, score in by_pair.items():
+                self.cache.put(pair, score)
+        return [
+            np.array([row[j] if row[j] is not None else by_pair[keys[i], chunk_keys[i][j]]
+                      for j in range(min(depth, len(row)))], dtype="float32")
+            for i, row in enumerate(scores)
+        ]
+
+    def _affordable_depth(self, scores: List[list]) -> Optional[int]:
+        """Наибольшая глубина, неоценённые пары которой укладываются в бюджет."""
+        full = max((len(row) for row in scores), default=0)
+        if self.budget_ms is None or self._pair_seconds is None:
+            return full
+        budget = self.budget_ms / 1000.0
+        for depth in range(full, 0, -1):
+            pairs = sum(score is None for row in scores for score in row[:depth])
+            if self._pair_seconds * pairs <= budget:
+                break
+        else:
+            depth = 0
+        if depth < full:
+            self._pair_seconds *= _COST_DECAY_ON_SKIP
+            if depth < min(self.min_depth, full):
+                self.stats["skipped_budget"] += 1
+                metrics.increment("rerank_skipped_budget")
+                return None
+            self.stats["truncated"] += 1
+            metrics.increment("rerank_truncated")
+        return depth
+
+    def _predict(self, pairs: List[tuple]) -> np.ndarray:
+        model = self.model
+        start = time.perf_counter()
+        with metrics.span("rerank"):
+            scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        cost = (time.perf_counter() - start) / len(pairs)
+        self._pair_seconds = cost if self._pair_seconds is None else (
+            _COST_SMOOTHING * cost + (1 - _COST_SMOOTHING) * self._pair_seconds)
+        self.stats["batches"] += 1
+        self.stats["pairs_scored"] += len(pairs)
+        metrics.increment("rerank_pairs", len(pairs))
+        return np.asarray(scores, dtype="float32").reshape(-1)
@@ -0,0 +1,546 @@
+"""
+Сегментное хранилище индекса: каждое сохранение дописывает новый сегмент
+(векторы + чанки в формате chunk_store), а manifest.json перечисляет живые сегменты.
+
+Файлы сегмента пишутся под временными именами и переименовываются только
+после fsync, manifest подменяется атомарно через os.replace — сбой посреди
+сохранения оставляет на диске прежнее согласованное состояние.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import faiss
+import numpy as np
+
+from src.bm25 import BM25Index
+from src.chunk_store import (CHUNK_META_DTYPE, ChunkList, ChunkStore, chunk_store_exists, concat_chunk_stores,
+                             write_chunk_store)
+from src.dedup import hash_chunks
+from src.index_backends import (TRAINABLE_BACKENDS, add_vectors, build_index, can_build, detect_backend,
+                                extract_vectors, index_ids, make_index_config, reconstruct_ids)
+
+MANIFEST_NAME = "manifest.json"
+NEGATIVE_FEEDBACK_DB = "negative_feedback.sqlite"
+# Счётчики прежних версий: при первой записи переносятся в базу
+LEGACY_NEGATIVE_FEEDBACK_NAME = "negative_feedback.json"
+MANIFEST_VERSION = 1
+_STORE_FILE_RE = re.compile(r"^(seg|base)_\d{6}\.")
+
+# Одно состояние на папку в процессе: блокировка записи и имена, которые
+# сейчас пишет компакция (их нельзя удалять как «осиротевшие»)
+_folder_states = {}
+_folder_states_guard = threading.Lock()
+
+
+def _folder_state(folder: str) -> dict:
+    with _folder_states_guard:
+        return _folder_states.setdefault(
+            os.path.abspath(folder), {"lock": threading.Lock(), "reserved": set()}
+        )
+
+
+def _fsync_dir(folder: str):
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: str, write_fn):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_index(path: str, index: faiss.Index):
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_jsonl_chunks(path: str) -> List[str]:
+    # Сегменты первых версий хранили чанки в JSON Lines
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class SegmentStore:
+    def __init__(self, folder: str):
+        self.folder = folder
+        state = _folder_state(folder)
+        self.lock = state["lock"]
+        self._reserved = state["reserved"]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def _chunks_prefix(self, name: str) -> str:
+        return self._path(name + ".chunks")
+
+    def _open_chunks(self, name: str):
+        prefix = self._chunks_prefix(name)
+        if chunk_store_exists(prefix):
+            return ChunkStore(prefix)
+        return _read_jsonl_chunks(prefix + ".jsonl")
+
+    def read_manifest(self) -> Optional[dict]:
+        path = self._path(MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: dict):
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+        _write_atomic(self._path(MANIFEST_NAME), lambda f: f.write(data))
+        _fsync_dir(self.folder)
+
+    def _open_negative_feedback(self) -> sqlite3.Connection:
+        os.makedirs(self.folder, exist_ok=True)
+        conn = sqlite3.connect(self._path(NEGATIVE_FEEDBACK_DB), isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS negative_feedback ("
+            " digest TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        legacy = self._path(LEGACY_NEGATIVE_FEEDBACK_NAME)
+        if os.path.exists(legacy):
+            with open(legacy, "r", encoding="utf-8") as f:
+                counts = json.load(f)["chunks"]
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR IGNORE INTO negative_feedback (digest, count) VALUES (?, ?)",
+                             list(counts.items()))
+            conn.execute("COMMIT")
+            os.remove(legacy)
+        return conn
+
+    def save_negative_feedback(self, counts: Dict[str, int], replace: bool = False):
+        """
+        Счётчики отрицательных отзывов по хешу содержимого чанка: переживают смену id.
+        Пишутся только переданные хеши (0 удаляет запись), replace=True заменяет все.
+        """
+        conn = self._open_negative_feedback()
+        try:
+            conn.execute("BEGIN")
+            if replace:
+                conn.execute("DELETE FROM negative_feedback")
+            conn.executemany("DELETE FROM negative_feedback WHERE digest = ?",
+                             [(digest,) for digest, count in counts.items() if count <= 0])
+            conn.executemany("INSERT OR REPLACE INTO negative_feedback (digest, count) VALUES (?, ?)",
+                             [(digest, count) for digest, count in counts.items() if count > 0])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def load_negative_feedback(self) -> Dict[str, int]:
+        if os.path.exists(self._path(NEGATIVE_FEEDBACK_DB)):
+            conn = sqlite3.connect(self._path(NEGATIVE_FEEDBACK_DB))
+            try:
+                return dict(conn.execute("SELECT digest, count FROM negative_feedback"))
+            finally:
+                conn.close()
+        legacy = self._path(LEGACY_NEGATIVE_FEEDBACK_NAME)
+        if not os.path.exists(legacy):
+            return {}
+        with open(legacy, "r", encoding="utf-8") as f:
+            return json.load(f)["chunks"]
+
+    @staticmethod
+    def total_count(manifest: dict) -> int:
+        base = manifest["base"]["count"] if manifest.get("base") else 0
+        return base + sum(seg["count"] for seg in manifest["segments"])
+
+    @staticmethod
+    def documents(manifest: dict) -> List[dict]:
+        """Живые документы: удалённые через remove_documents не возвращаются."""
+        removed = set(manifest.get("removed_documents", []))
+        docs = list(manifest["base"].get("documents", [])) if manifest.get("base") else []
+        for seg in manifest["segments"]:
+            docs.extend(seg.get("documents", []))
+        return [doc for doc in docs if doc.get("doc_id") not in removed]
+
+    def remove_documents(self, doc_ids: Iterable[int], owners: Optional[Dict[int, int]] = None):
+        """
+        Помечает документы удалёнными одной подменой манифеста. Их чанки
+        остаются в файлах до компакции, которая вычищает их физически.
+        owners — {id чанка: новый документ} для чанков, общих с другими документами.
+        """
+        with self.lock:
+            manifest = self.read_manifest()
+            if manifest is None:
+                raise FileNotFoundError("Манифест индекса не найден")
+            removed = set(manifest.get("removed_documents", [])) | {int(doc_id) for doc_id in doc_ids}
+            manifest["removed_documents"] = sorted(removed)
+            if owners:
+                chunk_owners = manifest.setdefault("chunk_owners", {})
+                chunk_owners.update({str(chunk_id): int(doc_id) for chunk_id, doc_id in owners.items()})
+            self._write_manifest(manifest)
+
+    @staticmethod
+    def _part_names(manifest: dict) -> List[str]:
+        names = [manifest["base"]["name"]] if manifest.get("base") else []
+        return names + [seg["name"] for seg in manifest["segments"]]
+
+    def _write_extras(self, name: str, extras: Optional[dict]):
+        """
+        Дополнительные данные части: bm25 (BM25Index), hashes (массив (n, 2) uint64
+        хешей чанков), duplicates ({id канонического чанка: [источники дублей]})
+        и meta (массив CHUNK_META_DTYPE: документ, страница, глава каждого чанка).
+        """
+        extras = extras or {}
+        if extras.get("bm25") is not None:
+            _write_atomic(self._path(name + ".bm25.npz"), extras["bm25"].save_to)
+        if extras.get("hashes") is not None:
+            hashes = np.ascontiguousarray(extras["hashes"], dtype=np.uint64)
+            _write_atomic(self._path(name + ".hashes.npy"), lambda f: np.save(f, hashes))
+        if extras.get("duplicates"):
+            data = json.dumps(extras["duplicates"], ensure_ascii=False).encode("utf-8")
+            _write_atomic(self._path(name + ".dups.json"), lambda f: f.write(data))
+        if extras.get("meta") is not None:
+            meta = np.ascontiguousarray(extras["meta"], dtype=CHUNK_META_DTYPE)
+            _write_atomic(self._path(name + ".meta.npy"), lambda f: np.save(f, meta))
+
+    def load_extras(self, manifest: dict) -> dict:
+        """
+        Собирает дополнительные данные всех частей; bm25/hashes = None, если у
+        части их нет. У частей без метаданных чанки считаются без документа (нули).
+        """
+        names = self._part_names(manifest)
+        bm25_paths = [self._path(name + ".bm25.npz") for name in names]
+        bm25 = None
+        if all(os.path.exists(path) for path in bm25_paths):
+            bm25 = BM25Index()
+            for path in bm25_paths:
+                bm25.merge(BM25Index.load(path))
+
+        hash_paths = [self._path(name + ".hashes.npy") for name in names]
+        hashes = None
+        if all(os.path.exists(path) for path in hash_paths):
+            hashes = np.concatenate([np.load(path) for path in hash_paths] or [np.zeros((0, 2), np.uint64)])
+
+        duplicates = {}
+        for name in names:
+            path = self._path(name + ".dups.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    for doc_id, sources in json.load(f).items():
+                        duplicates.setdefault(int(doc_id), []).extend(sources)
+
+        return {"bm25": bm25, "hashes": hashes, "duplicates": duplicates, "meta": self.load_meta(manifest)}
+
+    def load_meta(self, manifest: dict) -> np.ndarray:
+        """Метаданные чанков всех частей (со сменой владельцев), без векторов и текстов."""
+        names = self._part_names(manifest)
+        counts = ([manifest["base"]["count"]] if manifest.get("base") else []) + [
+            seg["count"] for seg in manifest["segments"]]
+        meta_parts = []
+        for name, count in zip(names, counts):
+            path = self._path(name + ".meta.npy")
+            meta_parts.append(np.load(path) if os.path.exists(path) else np.zeros(count, dtype=CHUNK_META_DTYPE))
+        meta = np.concatenate(meta_parts) if meta_parts else np.zeros(0, dtype=CHUNK_META_DTYPE)
+        for chunk_id, doc_id in manifest.get("chunk_owners", {}).items():
+            meta[int(chunk_id)] = (doc_id, 0, 0)
+        return meta
+
+    def write_base(self, index: faiss.Index, chunks: Iterable[str], meta: dict,
+                   documents: List[dict], extras: Optional[dict] = None,
+                   removed_documents: Iterable[int] = ()) -> ChunkStore:
+        """Полный снимок: один базовый индекс вместо всех сегментов."""
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            manifest = self.read_manifest() or {}
+            seq = manifest.get("next_segment", 1)
+            name = f"base_{seq:06d}"
+            _write_index(self._path(name + ".faiss"), index)
+            count = write_chunk_store(self._chunks_prefix(name), chunks)
+            self._write_extras(name, extras)
+            self._write_manifest({
+                "version": MANIFEST_VERSION,
+                "next_segment": seq + 1,
+                "meta": meta,
+                "base": {"name": name, "count": count, "documents": documents},
+                "segments": [],
+                "removed_documents": sorted(int(doc_id) for doc_id in removed_documents),
+            })
+            self._remove_unreferenced()
+            return ChunkStore(self._chunks_prefix(name))
+
+    def append_segment(self, vectors: np.ndarray, chunks: List[str], meta: dict,
+                       documents: List[dict], extras: Optional[dict] = None) -> ChunkStore:
+        """Дописывает сегмент и возвращает его чанки, открытые через mmap."""
+        if len(vectors) != len(chunks):
+            raise ValueError("Число векторов не совпадает с числом чанков")
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            manifest = self.read_manifest()
+            if manifest is None:
+                raise FileNotFoundError("Манифест индекса не найден")
+            seq = manifest["next_segment"]
+            name = f"seg_{seq:06d}"
+            vectors = np.ascontiguousarray(vectors, dtype="float32")
+            _write_atomic(self._path(name + ".npy"), lambda f: np.save(f, vectors))
+            write_chunk_store(self._chunks_prefix(name), chunks)
+            self._write_extras(name, extras)
+            manifest["next_segment"] = seq + 1
+            manifest["meta"] = meta
+            manifest["segments"].append({"name": name, "count": len(chunks), "documents": documents})
+            self._write_manifest(manifest)
+            return ChunkStore(self._chunks_prefix(name))
+
+    def load(self, manifest: dict, mmap: bool = True):
+        """
+        Возвращает (базовый индекс или None, векторы сегментов, ChunkList).
+        Базовый индекс открывается через IO_FLAG_MMAP, кроме IVF с сегментами:
+        mmap-списки IVF доступны только на чтение, а векторы сегментов надо добавить.
+        Id вектора — позиция чанка в ChunkList; после компакции с удалением
+        база — IndexIDMap2, и векторы сегментов добавляются через add_vectors.
+        """
+        index = None
+        parts = []
+        if manifest.get("base"):
+            name = manifest["base"]["name"]
+            backend = manifest["meta"]["backend"]
+            use_mmap = mmap and (backend not in TRAINABLE_BACKENDS or not manifest["segments"])
+            index = faiss.read_index(self._path(name + ".faiss"), faiss.IO_FLAG_MMAP if use_mmap else 0)
+            parts.append(self._open_chunks(name))
+        vectors = []
+        for seg in manifest["segments"]:
+            vectors.append(np.load(self._path(seg["name"] + ".npy")))
+            parts.append(self._open_chunks(seg["name"]))
+        return index, vectors, ChunkList(parts)
+
+    def open_chunks(self, manifest: dict) -> ChunkList:
+        """Чанки всех частей через mmap, без чтения векторов."""
+        return ChunkList([self._open_chunks(name) for name in self._part_names(manifest)])
+
+    def vector_ids(self, manifest: dict) -> np.ndarray:
+        """Id чанков, у которых есть вектор (компакция с удалением оставляет в базе не все позиции)."""
+        parts, start = [], 0
+        if manifest.get("base"):
+            index = faiss.read_index(self.base_index_path(manifest), faiss.IO_FLAG_MMAP)
+            parts.append(index_ids(index))
+            start = manifest["base"]["count"]
+        for seg in manifest["segments"]:
+            parts.append(np.arange(start, start + seg["count"], dtype="int64"))
+            start += seg["count"]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype="int64")
+
+    def read_vectors(self, manifest: dict, ids: np.ndarray) -> np.ndarray:
+        """
+        Векторы по id часть за частью: база открывается через mmap, сегменты —
+        np.load(mmap_mode="r"), в память попадают только запрошенные строки
+        (у IVF-PQ векторы приближённые).
+        """
+        ids = np.asarray(ids, dtype="int64")
+        vectors = np.empty((len(ids), manifest["meta"]["dim"]), dtype="float32")
+        start = 0
+        if manifest.get("base"):
+            start = manifest["base"]["count"]
+            mask = ids < start
+            if mask.any():
+                index = faiss.read_index(self.base_index_path(manifest), faiss.IO_FLAG_MMAP)
+                vectors[mask] = reconstruct_ids(index, ids[mask])
+        for seg in manifest["segments"]:
+            mask = (ids >= start) & (ids < start + seg["count"])
+            if mask.any():
+                part = np.load(self._path(seg["name"] + ".npy"), mmap_mode="r")
+                vectors[mask] = part[ids[mask] - start]
+            start += seg["count"]
+        return vectors
+
+    def base_index_path(self, manifest: dict) -> Optional[str]:
+        if not manifest.get("base"):
+            return None
+        return self._path(manifest["base"]["name"] + ".faiss")
+
+    def compact(self, dim: int, index_config: dict) -> bool:
+        """
+        Сливает базу и сегменты в новую базу. Тяжёлая часть идёт без блокировки;
+        сегменты, дописанные за это время, остаются в манифесте после новой базы.
+        """
+        with self.lock:
+            snapshot = self.read_manifest()
+            if snapshot is None or not snapshot["segments"]:
+                return False
+            # Резервируем номер новой базы, чтобы писать её файлы без блокировки
+            seq = snapshot["next_segment"]
+            snapshot["next_segment"] = seq + 1
+            self._write_manifest(snapshot)
+            name = f"base_{seq:06d}"
+            self._reserved.add(name)
+        try:
+            return self._compact_into(name, snapshot, dim, index_config)
+        finally:
+            with self.lock:
+                self._reserved.discard(name)
+
+    def _compact_into(self, name: str, snapshot: dict, dim: int, index_config: dict) -> bool:
+        index, vectors, chunks = self.load(snapshot, mmap=False)
+        vectors = np.vstack(vectors)
+        extras = self.load_extras(snapshot)
+        base_count = snapshot["base"]["count"] if snapshot.get("base") else 0
+        removed = np.array(snapshot.get("removed_documents", []), dtype=np.uint32)
+        dead = np.isin(extras["meta"]["doc"], removed) if len(removed) else np.zeros(len(chunks), dtype=bool)
+
+        if index is None:
+            backend = snapshot["meta"]["backend"]
+            ids = np.arange(len(vectors), dtype="int64")
+        else:
+            backend = detect_backend(index)
+            ids = np.concatenate([index_ids(index), np.arange(base_count, base_count + len(vectors), dtype="int64")])
+        if dead[ids].any():
+            # Удалённые документы вычищаются физически: индекс собирается заново
+            # из живых векторов с их прежними id, позиции чанков не сдвигаются
+            if index is not None:
+                vectors = np.vstack([extract_vectors(index), vectors])
+            alive = ~dead[ids]
+            vectors, ids = vectors[alive], ids[alive]
+            if not can_build(backend, index_config, len(vectors)):
+                backend = "flat"
+            index = build_index(backend, vectors, dim, index_config, ids=ids)
+        elif index is None:
+            if not can_build(backend, index_config, len(vectors)):
+                backend = "flat"
+            index = build_index(backend, vectors, dim, index_config)
+        else:
+            add_vectors(index, vectors, base_count)
+        _write_index(self._path(name + ".faiss"), index)
+
+        if dead.any():
+            chunks = ["" if dead[i] else chunk for i, chunk in enumerate(chunks)]
+            count = write_chunk_store(self._chunks_prefix(name), chunks)
+            extras["bm25"] = None
+            extras["hashes"] = hash_chunks(chunks)
+            # Вычищенная строка — пустой текст без документа и хеша: надгробие по ней больше не нужно
+            extras["hashes"][dead] = 0
+            extras["meta"][dead] = (0, 0, 0)
+            extras["duplicates"] = {doc_id: sources for doc_id, sources in extras["duplicates"].items()
+                                    if not dead[doc_id]}
+        elif all(isinstance(part, ChunkStore) for part in chunks.parts):
+            count = concat_chunk_stores(self._chunks_prefix(name), chunks.parts)
+        else:
+            count = write_chunk_store(self._chunks_prefix(name), chunks)
+        if extras["bm25"] is None:
+            extras["bm25"] = BM25Index()
+            extras["bm25"].add(chunks)
+        if extras["hashes"] is None:
+            extras["hashes"] = hash_chunks(chunks)
+        self._write_extras(name, extras)
+        merged = len(snapshot["segments"])
+
+        with self.lock:
+            current = self.read_manifest()
+            if current.get("base") != snapshot.get("base"):
+                self._reserved.discard(name)
+                self._remove_unreferenced()
+                return False
+            current["base"] = {"name": name, "count": count, "documents": self.documents(snapshot)}
+            current["segments"] = current["segments"][merged:]
+            # Документы, вычищенные из новой базы, снимаются с учёта удалённых, чтобы список
+            # (и фильтр поиска по нему) не рос вечно. Документ, у которого есть строки или
+            # запись в сегментах после снимка, остаётся удалённым до следующей компакции
+            later = self._segment_documents(current["segments"])
+            compacted = set(snapshot.get("removed_documents", [])) - later
+            if compacted:
+                current["removed_documents"] = sorted(set(current.get("removed_documents", [])) - compacted)
+                current["next_document"] = max(current.get("next_document", 1), max(compacted) + 1)
+            # Смена владельцев из снимка уже записана в метаданные новой базы
+            baked = snapshot.get("chunk_owners", {})
+            owners = {chunk_id: doc_id for chunk_id, doc_id in current.get("chunk_owners", {}).items()
+                      if baked.get(chunk_id) != doc_id}
+            if owners:
+                current["chunk_owners"] = owners
+            else:
+                current.pop("chunk_owners", None)
+            self._write_manifest(current)
+            self._remove_unreferenced()
+        return True
+
+    def _segment_documents(self, segments: List[dict]) -> set:
+        """Id документов, которые упоминаются в сегментах: в записях документов или в метаданных чанков."""
+        docs = {doc["doc_id"] for seg in segments for doc in seg.get("documents", []) if "doc_id" in doc}
+        for seg in segments:
+            path = self._path(seg["name"] + ".meta.npy")
+            if os.path.exists(path):
+                docs.update(int(doc) for doc in np.unique(np.load(path)["doc"]))
+        return docs
+
+    def compact_in_background(self, dim: int, index_config: dict) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.compact, args=(dim, index_config), name="segment-compaction", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _remove_unreferenced(self):
+        """Удаляет файлы старых сегментов и недописанные файлы после сбоев."""
+        manifest = self.read_manifest()
+        live = {seg["name"] for seg in manifest["segments"]} | self._reserved
+        if manifest.get("base"):
+            live.add(manifest["base"]["name"])
+        for filename in os.listdir(self.folder):
+            if _STORE_FILE_RE.match(filename) and filename.split(".", 1)[0] not in live:
+                try:
+                    os.remove(self._path(filename))
+                except OSError:
+                    # Файл ещё открыт через mmap (Windows) — удалим при следующей уборке
+                    pass
+
+
+def migrate_legacy_index(folder: str) -> bool:
+    """
+    Одноразовая миграция: faiss_index.bin + chunks.json (и сегменты с чанками
+    в JSON Lines) переводятся в сегментное хранилище с бинарными чанками.
+    """
+    store = SegmentStore(folder)
+    manifest = store.read_manifest()
+    if manifest is None:
+        index_path = os.path.join(folder, "faiss_index.bin")
+        chunks_path = os.path.join(folder, "chunks.json")
+        if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+            return False
+        index = faiss.read_index(index_path)
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        documents = []
+        meta_path = os.path.join(folder, "document_metadata.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            documents = ([{"filename": name} for name in data.get("filenames", [])]
+                         + [{"hash": pdf_hash} for pdf_hash in data.get("hashes", [])])
+        meta = {"backend": detect_backend(index), "config": make_index_config(), "dim": index.d}
+        bm25 = BM25Index()
+        bm25.add(chunks)
+        store.write_base(index, chunks, meta, documents, {"bm25": bm25, "hashes": hash_chunks(chunks)})
+        return True
+
+    migrated = False
+    with store.lock:
+        names = [seg["name"] for seg in manifest["segments"]]
+        if manifest.get("base"):
+            names.append(manifest["base"]["name"])
+        for name in names:
+            prefix = store._chunks_prefix(name)
+            if not chunk_store_exists(prefix) and os.path.exists(prefix + ".jsonl"):
+                write_chunk_store(prefix, _read_jsonl_chunks(prefix + ".jsonl"))
+                os.remove(prefix + ".jsonl")
+                migrated = True
+    return migrated
@@ -0,0 +1,237 @@
+"""
+Неблокирующее обслуживание: индексация PDF идёт фоновыми заданиями с
+прогрессом, вопросы — через пул потоков с явным лимитом параллелизма и
+очереди. Чтения видят согласованный индекс благодаря ReadWriteLock движка:
+запись держит исключительную блокировку только на время применения пачки.
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from src import metrics
+
+
+class Overloaded(RuntimeError):
+    """Очередь запросов заполнена."""
+
+
+class ReadWriteLock:
+    """
+    Много читателей или один писатель. Ожидающий писатель блокирует новых
+    читателей, поэтому поток вопросов не может бесконечно откладывать запись.
+    Блокировка не реентерабельна.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class IngestJob:
+    def __init__(self, job_id: int, paths: List[str]):
+        self.id = job_id
+        self.paths = list(paths)
+        self.status = "queued"  # queued → running → done | failed
+        self.files_done = 0
+        self.report = {"added": 0, "exact_duplicates": 0, "near_duplicates": 0}
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "files_done": self.files_done,
+            "files_total": len(self.paths),
+            "current": self.paths[self.files_done] if self.files_done < len(self.paths) else None,
+            "error": self.error,
+            **self.report,
+        }
+
+
+class IngestQueue:
+    """
+    Задания индексации выполняются по одному в фоновом потоке: единственный
+    писатель не конкурирует сам с собой, а вопросы продолжают обслуживаться.
+    После каждого задания индекс сохраняется в save_folder.
+    """
+
+    def __init__(self, engine, save_folder: Optional[str] = "models", max_pending: int = 16,
+                 keep_finished: int = 100, chunk_source: Optional[Callable] = None):
+        self.engine = engine
+        self.save_folder = save_folder
+        self.keep_finished = keep_finished
+        # Источник пар (путь, чанк); по умолчанию — engine.add_document для каждого PDF
+        self.chunk_source = chunk_source
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs: Dict[int, IngestJob] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, paths: List[str]) -> IngestJob:
+        job = IngestJob(next(self._ids), paths)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            metrics.increment("ingest_rejected")
+            raise Overloaded("Слишком много заданий на индексацию в очереди")
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        return job
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def jobs(self) -> List[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def wait(self, job_id: int, timeout: Optional[float] = None) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.done.wait(timeout)
+        return job.to_dict()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            try:
+                with metrics.request("ingest_job", files=len(job.paths)):
+                    self._ingest(job)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            job.finished_at = time.time()
+            job.done.set()
+
+    def _chunks(self, job: IngestJob):
+        current = None
+        for path, chunk in self.chunk_source(job.paths):
+            if path != current:
+                if current is not None:
+                    job.files_done += 1
+                current = path
+            yield os.path.basename(path), chunk
+
+    def _ingest(self, job: IngestJob):
+        def progress(report: dict):
+            for key, value in report.items():
+                job.report[key] += value
+
+        if self.chunk_source is not None:
+            self.engine.add_chunk_stream(self._chunks(job), progress=progress)
+        else:
+            # PDF индексируются по одному: каждый получает id документа и метаданные чанков
+            for path in job.paths:
+                self.engine.add_document(path, folder=None, progress=progress)
+                job.files_done += 1
+        job.files_done = len(job.paths)
+        if self.save_folder:
+            self.engine.save_index(self.save_folder)
+
+
+class QueryPool:
+    """
+    Пул потоков для вопросов: не больше max_workers выполняются одновременно,
+    ещё max_queued ждут. Сверх этого submit сразу отвечает Overloaded,
+    вместо того чтобы копить бесконечную очередь.
+    """
+
+    def __init__(self, fn: Callable, max_workers: int = 8, max_queued: int = 64):
+        self.fn = fn
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            metrics.increment("queries_rejected")
+            raise Overloaded("Сервер перегружен, повторите вопрос позже")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(self.fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, *args, timeout: Optional[float] = None, **kwargs):
+        return self.submit(*args, **kwargs).result(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "running": min(in_flight, self.max_workers),
+            "queued": max(0, in_flight - self.max_workers),
+            "capacity": self.max_workers + self.max_queued,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
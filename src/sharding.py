@@ -0,0 +1,410 @@
+"""
+Шардированный индекс: корпус разбит на N неизменяемых шардов, каждый шард —
+папка с IndexIDMap2 (глобальные id чанков), хранилищем чанков и BM25.
+Каждый шард обслуживает свой рабочий процесс; запрос рассылается всем
+шардам одновременно, top-k собирается слиянием ответов (scatter-gather).
+Запросы помечаются номером, и ответ забирает именно тот поток, что его ждёт:
+запросы разных потоков идут в шарды, не дожидаясь друг друга.
+
+Исключённые id (удалённые документы, отвергнутые отзывами) шард держит у
+себя: set_excluded рассылается при их изменении, а не с каждым запросом.
+
+Шард добавляется и удаляется правкой shards.json без перестроения остальных:
+новые документы — новый шард, устаревший шард — remove_shard.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import itertools
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from src.bm25 import BM25Index
+from src.chunk_store import ChunkStore, write_chunk_store
+from src.index_backends import apply_search_params, build_index, make_index_config, make_search_params
+from src.serving import ReadWriteLock
+
+SHARDS_MANIFEST = "shards.json"
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_shard(path: str, vectors: np.ndarray, chunks: Sequence[str], ids: np.ndarray,
+                backend: str = "flat", index_config: Optional[dict] = None) -> int:
+    """Пишет папку шарда; чанки лежат в том же порядке, что и векторы в индексе."""
+    config = make_index_config(index_config)
+    os.makedirs(path, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = build_index(backend, vectors, vectors.shape[1], config, ids=ids)
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    write_chunk_store(os.path.join(path, "chunks"), chunks)
+    bm25 = BM25Index()
+    bm25.add(chunks)
+    bm25.save(os.path.join(path, "bm25.npz"))
+    with open(os.path.join(path, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return len(chunks)
+
+
+class Shard:
+    """Один шард в памяти процесса: поиск возвращает глобальные id."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        flags = faiss.IO_FLAG_MMAP if mmap else 0
+        self.index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+        with open(os.path.join(path, "config.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        apply_search_params(self.index, self.config)
+        self.chunks = ChunkStore(os.path.join(path, "chunks"))
+        self.bm25 = BM25Index.load(os.path.join(path, "bm25.npz"))
+        # Позиция в шарде → глобальный id, и отсортированная копия для обратного поиска
+        self.ids = faiss.vector_to_array(self.index.id_map).astype("int64")
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+        self._selector = None
+        self._params = None
+        self._local_excluded = None
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        """Позиции глобальных id в шарде; -1 для чужих id."""
+        ids = np.asarray(ids, dtype="int64")
+        if not len(self._sorted_ids):
+            return np.full(len(ids), -1, dtype="int64")
+        pos = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[pos] == ids, self._order[pos], -1)
+
+    def set_excluded(self, ids: np.ndarray) -> int:
+        """Запоминает исключаемые id; из присланных шард оставляет только свои."""
+        ids = np.asarray(ids, dtype="int64")
+        local = self._positions(ids)
+        own = np.ascontiguousarray(ids[local >= 0])
+        self._local_excluded = np.unique(local[local >= 0]) if len(own) else None
+        self._selector = self._params = None
+        if len(own):
+            self._selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(own))
+            self._params = make_search_params(self.index, self.config, self._selector)
+        return len(own)
+
+    def search(self, queries: np.ndarray, k: int):
+        if self._params is not None:
+            return self.index.search(queries, k, params=self._params)
+        return self.index.search(queries, k)
+
+    def search_lexical(self, texts: List[str], k: int):
+        scores = np.zeros((len(texts), k), dtype="float32")
+        ids = np.full((len(texts), k), -1, dtype="int64")
+        for row, text in enumerate(texts):
+            s, local_ids = self.bm25.search(text, k, exclude=self._local_excluded)
+            scores[row] = s
+            ids[row] = np.where(local_ids >= 0, self.ids[np.maximum(local_ids, 0)], -1)
+        return scores, ids
+
+    def get_chunks(self, ids: Iterable[int]) -> Dict[int, str]:
+        ids = np.asarray(list(ids), dtype="int64")
+        return {int(doc_id): self.chunks[int(pos)] for doc_id, pos in zip(ids, self._positions(ids)) if pos >= 0}
+
+    def handle(self, command: str, args: tuple):
+        if command == "search":
+            return self.search(*args)
+        if command == "lexical":
+            return self.search_lexical(*args)
+        if command == "chunks":
+            return self.get_chunks(*args)
+        if command == "exclude":
+            return self.set_excluded(*args)
+        if command == "count":
+            return self.index.ntotal
+        raise ValueError(f"Неизвестная команда шарда: {command}")
+
+
+def _shard_worker(conn, path: str, threads: int):
+    faiss.omp_set_num_threads(threads)
+    try:
+        shard = Shard(path)
+    except Exception as e:
+        conn.send((0, "error", repr(e)))
+        return
+    conn.send((0, "ok", shard.index.ntotal))
+    while True:
+        try:
+            request_id, command, args = conn.recv()
+        except EOFError:
+            return
+        if command == "stop":
+            return
+        try:
+            conn.send((request_id, "ok", shard.handle(command, args)))
+        except Exception as e:
+            conn.send((request_id, "error", repr(e)))
+
+
+class _ProcessShard:
+    """
+    Клиент шарда в отдельном процессе. send возвращает номер запроса,
+    receive(номер) ждёт ответ на него: ответ читает из трубы один поток за раз
+    и раскладывает по номерам, чужие ответы достаются своим ждущим.
+    """
+
+    def __init__(self, context, path: str, threads: int):
+        self.path = path
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_shard_worker, args=(child, path, threads), daemon=True)
+        self._process.start()
+        child.close()
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._replies = {}
+        self._reading = False
+        self._cond = threading.Condition()
+        self.ntotal = self._unpack(self._conn.recv()[1:])
+
+    def send(self, command: str, *args) -> int:
+        with self._send_lock:
+            request_id = next(self._ids)
+            self._conn.send((request_id, command, args))
+        return request_id
+
+    def _unpack(self, reply: tuple):
+        status, payload = reply
+        if status != "ok":
+            raise RuntimeError(f"Шард {self.path}: {payload}")
+        return payload
+
+    def receive(self, request_id: int):
+        with self._cond:
+            while request_id not in self._replies:
+                if self._reading:
+                    self._cond.wait()
+                    continue
+                self._reading = True
+                self._cond.release()
+                try:
+                    reply_id, status, payload = self._conn.recv()
+                finally:
+                    self._cond.acquire()
+                    self._reading = False
+                    self._cond.notify_all()
+                self._replies[reply_id] = (status, payload)
+            reply = self._replies.pop(request_id)
+        return self._unpack(reply)
+
+    def close(self):
+        try:
+            self._conn.send((0, "stop", ()))
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+
+
+class _LocalShard:
+    """Шард в текущем процессе с тем же интерфейсом — для отладки и маленьких корпусов."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._shard = Shard(path)
+        self.ntotal = self._shard.index.ntotal
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._replies = {}
+
+    def send(self, command: str, *args) -> int:
+        try:
+            reply = ("ok", self._shard.handle(command, args))
+        except Exception as e:
+            reply = ("error", repr(e))
+        with self._lock:
+            request_id = next(self._ids)
+            self._replies[request_id] = reply
+        return request_id
+
+    def receive(self, request_id: int):
+        with self._lock:
+            status, payload = self._replies.pop(request_id)
+        if status != "ok":
+            raise RuntimeError(f"Шард {self.path}: {payload}")
+        return payload
+
+    def close(self):
+        pass
+
+
+class ShardedIndex:
+    """
+    processes=True — по рабочему процессу на шард (spawn), иначе шарды
+    ищутся в текущем процессе. threads_per_shard — потоки OpenMP в процессе шарда.
+    """
+
+    def __init__(self, folder: str, processes: bool = True, threads_per_shard: int = 1):
+        self.folder = folder
+        self.processes = processes
+        self.threads_per_shard = threads_per_shard
+        self._context = multiprocessing.get_context("spawn") if processes else None
+        # Поиск берёт разделяемую блокировку, подключение и удаление шардов — исключительную
+        self._rw = ReadWriteLock()
+        self._shards: Dict[str, object] = {}
+        self._excluded = np.zeros(0, dtype="int64")
+        os.makedirs(folder, exist_ok=True)
+        for entry in self._read_manifest()["shards"]:
+            self._shards[entry["name"]] = self._open(entry["name"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def shard_names(self) -> List[str]:
+        return list(self._shards)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self._shards.values())
+
+    @property
+    def next_id(self) -> int:
+        """Id, с которого нумеруются чанки нового шарда (больше всех id в шардах)."""
+        return self._read_manifest().get("next_id", 0)
+
+    @property
+    def documents(self) -> List[dict]:
+        return [doc for entry in self._read_manifest()["shards"] for doc in entry["documents"]]
+
+    def _read_manifest(self) -> dict:
+        path = os.path.join(self.folder, SHARDS_MANIFEST)
+        if not os.path.exists(path):
+            return {"version": 1, "next_shard": 0, "shards": []}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _open(self, name: str):
+        path = os.path.join(self.folder, name)
+        if self.processes:
+            return _ProcessShard(self._context, path, self.threads_per_shard)
+        return _LocalShard(path)
+
+    def add_shard(self, vectors: np.ndarray, chunks: Sequence[str], ids: np.ndarray,
+                  backend: str = "flat", index_config: Optional[dict] = None,
+                  documents: Optional[List[dict]] = None) -> str:
+        """Пишет новый шард и подключает его; остальные шарды не трогаются."""
+        with self._rw.write():
+            manifest = self._read_manifest()
+            name = f"shard_{manifest['next_shard']:06d}"
+            count = write_shard(os.path.join(self.folder, name), vectors, chunks, ids, backend, index_config)
+            shard = self._open(name)
+            if len(self._excluded):
+                shard.receive(shard.send("exclude", self._excluded))
+            manifest["next_shard"] += 1
+            if len(ids):
+                manifest["next_id"] = max(manifest.get("next_id", 0), int(np.max(ids)) + 1)
+            manifest["shards"].append({"name": name, "count": count, "documents": documents or []})
+            _write_json_atomic(os.path.join(self.folder, SHARDS_MANIFEST), manifest)
+            self._shards[name] = shard
+        return name
+
+    def remove_shard(self, name: str):
+        with self._rw.write():
+            manifest = self._read_manifest()
+            manifest["shards"] = [entry for entry in manifest["shards"] if entry["name"] != name]
+            _write_json_atomic(os.path.join(self.folder, SHARDS_MANIFEST), manifest)
+            shard = self._shards.pop(name, None)
+            if shard is not None:
+                shard.close()
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+
+    def _scatter(self, command: str, *args) -> list:
+        # Все шарды получают запрос до чтения первого ответа и работают параллельно;
+        # запросы других потоков встают в очередь шарда, не дожидаясь этого ответа
+        with self._rw.read():
+            requests = [(shard, shard.send(command, *args)) for shard in self._shards.values()]
+            # Ответы забираются у всех шардов, даже если один упал: иначе ответ
+            # остался бы лежать в трубе
+            results, errors = [], []
+            for shard, request_id in requests:
+                try:
+                    results.append(shard.receive(request_id))
+                except RuntimeError as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return results
+
+    @staticmethod
+    def _merge(parts: List[Tuple[np.ndarray, np.ndarray]], nq: int, k: int):
+        if not parts:
+            return np.zeros((nq, k), dtype="float32"), np.full((nq, k), -1, dtype="int64")
+        scores = np.hstack([p[0] for p in parts])
+        ids = np.hstack([p[1] for p in parts])
+        scores = np.where(ids >= 0, scores, -np.inf)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        merged_scores = np.take_along_axis(scores, order, axis=1)
+        merged_ids = np.take_along_axis(ids, order, axis=1)
+        merged_ids[~np.isfinite(merged_scores)] = -1
+        merged_scores[~np.isfinite(merged_scores)] = 0.0
+        return merged_scores.astype("float32"), merged_ids
+
+    def set_excluded(self, ids: np.ndarray):
+        """
+        Задаёт id, которых нет в выдаче: каждый шард хранит свою часть и
+        применяет её ко всем запросам. Вызывается при изменении набора.
+        """
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        with self._rw.write():
+            self._excluded = ids
+        self._scatter("exclude", ids)
+
+    def search(self, queries: np.ndarray, k: int):
+        """Плотный поиск по всем шардам; результат как у faiss: (scores, ids) формы (nq, k)."""
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        return self._merge(self._scatter("search", queries, k), len(queries), k)
+
+    def search_lexical(self, texts: List[str], k: int):
+        """BM25 по шардам: idf считается внутри шарда, как в распределённых поисковиках."""
+        return self._merge(self._scatter("lexical", list(texts), k), len(texts), k)
+
+    def get_chunks(self, ids: Iterable[int]) -> Dict[int, str]:
+        ids = [int(i) for i in ids if i >= 0]
+        found = {}
+        for part in self._scatter("chunks", ids):
+            found.update(part)
+        return found
+
+    def close(self):
+        with self._rw.write():
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+
+
+def partition_ranges(count: int, n_shards: int, docs: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+    """
+    Непрерывные диапазоны примерно равного размера. docs — id документа каждой
+    позиции (чанки документа идут подряд): граница сдвигается к ближайшей смене
+    документа, так что документ целиком попадает в один шард; чанки без
+    документа (0) режутся где угодно. Шардов может выйти меньше n_shards,
+    если документов меньше.
+    """
+    bounds = np.linspace(0, count, n_shards + 1).astype(int)
+    if docs is not None and count:
+        docs = np.asarray(docs)
+        cuts = (docs[1:] != docs[:-1]) | (docs[1:] == 0)
+        starts = np.concatenate([[0], np.flatnonzero(cuts) + 1, [count]])
+        nearest = np.abs(starts[None, :] - bounds[1:-1, None]).argmin(axis=1)
+        bounds = np.concatenate([[0], starts[nearest], [count]])
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
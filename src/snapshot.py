@@ -0,0 +1,249 @@
+"""
+Тёплый снимок индекса: заголовок warm.snapshot и файлы секций рядом с ним.
+
+Заголовок — магическая строка и JSON (манифест хранилища, дубли, таблица
+секций). Каждая секция лежит в своём файле warm.snapshot.<секция>.<метка>:
+индекс FAISS открывается через faiss.read_index(..., IO_FLAG_MMAP), тексты
+чанков, смещения, хеши и метаданные читаются из mmap без копирования.
+
+Метка секции — хеш той части манифеста, от которой секция зависит, поэтому
+устаревший снимок обновляется по секциям: после удаления документа
+переписываются только метаданные, после нового сегмента тексты чанков
+дописываются в конец, а не переписываются целиком.
+
+Снимок — только ускоритель старта: источником истины остаётся сегментное
+хранилище. Снимок годен, пока манифест хранилища совпадает с записанным в нём.
+"""
+
+import glob
+import hashlib
+import io
+import json
+import mmap
+import os
+from typing import Callable, Optional, Union
+
+import faiss
+import numpy as np
+
+from src.bm25 import BM25Index
+from src.chunk_store import CHUNK_META_DTYPE, ChunkStore
+
+SNAPSHOT_NAME = "warm.snapshot"
+SNAPSHOT_VERSION = 2
+_MAGIC = b"RAGSNAP2"
+
+
+def snapshot_path(folder: str) -> str:
+    return os.path.join(folder, SNAPSHOT_NAME)
+
+
+def _part_names(manifest: dict) -> list:
+    names = [manifest["base"]["name"]] if manifest.get("base") else []
+    return names + [seg["name"] for seg in manifest["segments"]]
+
+
+def _section_keys(manifest: dict) -> dict:
+    """От чего зависит каждая секция; тексты зависят только от базы и дописываются сегментами."""
+    parts = _part_names(manifest)
+    return {
+        "index": {"parts": parts, "meta": manifest.get("meta")},
+        "texts": {"base": parts[:1]},
+        "hashes": {"parts": parts},
+        "meta": {"parts": parts, "owners": manifest.get("chunk_owners", {})},
+        "bm25": {"parts": parts},
+    }
+
+
+def _tag(key) -> str:
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _write_file(path: str, write_fn) -> int:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def _append_file(path: str, length: int, data: bytes) -> int:
+    # Хвост после записанной в заголовке длины — остаток прерванной записи
+    with open(path, "r+b") as f:
+        f.truncate(length)
+        f.seek(length)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+
+def _read_header(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_MAGIC):
+        return None
+    try:
+        header = json.loads(data[len(_MAGIC):].decode("utf-8"))
+    except ValueError:
+        return None
+    return header if header.get("version") == SNAPSHOT_VERSION else None
+
+
+def _encode_texts(chunks, start: int, end: int):
+    """Тексты чанков начиная со start и их конечные смещения, отсчитанные от end."""
+    blob, offsets = [], []
+    for chunk in (chunks[start:] if start else chunks):
+        data = chunk.encode("utf-8")
+        blob.append(data)
+        end += len(data)
+        offsets.append(end)
+    return b"".join(blob), np.asarray(offsets, dtype="uint64")
+
+
+def _last_offset(path: str, rows: int) -> int:
+    with open(path, "rb") as f:
+        f.seek(8 * rows)
+        return int(np.frombuffer(f.read(8), dtype="uint64")[0])
+
+
+def write_snapshot(path: str, manifest: dict, index: Union[faiss.Index, Callable[[], faiss.Index]], chunks,
+                   hashes: np.ndarray, chunk_meta: np.ndarray, bm25: BM25Index, duplicates: dict) -> int:
+    """
+    Обновляет снимок под манифест и возвращает число записанных байт. Секции,
+    чья метка не изменилась, остаются как есть; index может быть функцией —
+    она вызывается, только если индекс действительно надо переписать.
+    Заголовок подменяется атомарно после fsync всех секций.
+    """
+    previous = _read_header(path)
+    old = previous["sections"] if previous else {}
+    keys = _section_keys(manifest)
+    parts = _part_names(manifest)
+    sections, written = {}, 0
+
+    def reusable(name: str) -> Optional[dict]:
+        info = old.get(name)
+        files = [info[field] for field in ("file", "offsets") if field in info] if info else []
+        if info and info["tag"] == _tag(keys[name]) and all(os.path.exists(path + f) for f in files):
+            return info
+        return None
+
+    def section(name: str, suffix: str, write_fn, **extra):
+        nonlocal written
+        info = reusable(name)
+        if info is None:
+            file = f".{name}.{_tag(keys[name])}{suffix}"
+            info = dict(extra, tag=_tag(keys[name]), file=file, length=_write_file(path + file, write_fn))
+            written += info["length"]
+        sections[name] = info
+
+    def write_index(f):
+        faiss.write_index(index() if callable(index) else index, faiss.PyCallbackIOWriter(f.write))
+
+    section("index", ".faiss", write_index)
+
+    # Тексты и смещения: новые сегменты дописываются к файлам прежнего снимка той же базы
+    texts, count = reusable("texts"), len(chunks)
+    if texts and texts["parts"] == parts[:len(texts["parts"])] and texts["rows"] <= count:
+        end = _last_offset(path + texts["offsets"], texts["rows"])
+        blob, offsets = _encode_texts(chunks, texts["rows"], end)
+        written += _append_file(path + texts["file"], texts["length"], blob)
+        written += _append_file(path + texts["offsets"], 8 * (texts["rows"] + 1), offsets.tobytes())
+        texts = dict(texts, length=texts["length"] + len(blob))
+    else:
+        tag = _tag(keys["texts"])
+        texts = {"tag": tag, "file": f".texts.{tag}.blob", "offsets": f".texts.{tag}.offsets"}
+        blob, offsets = _encode_texts(chunks, 0, 0)
+        offsets = np.concatenate([np.zeros(1, dtype="uint64"), offsets])
+        texts["length"] = _write_file(path + texts["file"], lambda f: f.write(blob))
+        written += texts["length"] + _write_file(path + texts["offsets"], lambda f: f.write(offsets.tobytes()))
+    sections["texts"] = dict(texts, parts=parts, rows=count)
+
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    section("hashes", ".bin", lambda f: f.write(hashes.tobytes()), shape=list(hashes.shape))
+    chunk_meta = np.ascontiguousarray(chunk_meta, dtype=CHUNK_META_DTYPE)
+    section("meta", ".bin", lambda f: f.write(chunk_meta.tobytes()), shape=list(chunk_meta.shape))
+    section("bm25", ".npz", bm25.save_to)
+
+    header = _MAGIC + json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "manifest": manifest,
+        "duplicates": {str(doc_id): sources for doc_id, sources in duplicates.items()},
+        "sections": sections,
+    }, ensure_ascii=False).encode("utf-8")
+    written += _write_file(path, lambda f: f.write(header))
+    _remove_stale_sections(path, sections)
+    return written
+
+
+def _remove_stale_sections(path: str, sections: dict):
+    keep = {path + info[field] for info in sections.values() for field in ("file", "offsets") if field in info}
+    for stale in glob.glob(glob.escape(path) + ".*"):
+        if stale not in keep:
+            try:
+                os.remove(stale)
+            except OSError:
+                # Файл ещё открыт через mmap (Windows) — удалится при следующем обновлении
+                pass
+
+
+def _map(path: str, length: int):
+    if length == 0:
+        return memoryview(b"")
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < length:
+            raise ValueError(f"Секция снимка обрезана: {path}")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[:length]
+
+
+def read_snapshot(path: str, manifest: Optional[dict] = None) -> Optional[dict]:
+    """
+    Открывает снимок; None — файла нет, он повреждён или устарел (manifest
+    не совпадает с записанным). Возвращает index, index_path, chunks
+    (ChunkStore поверх mmap), hashes, meta, bm25, duplicates и manifest снимка.
+    """
+    header = _read_header(path)
+    if header is None:
+        return None
+    if manifest is not None and header["manifest"] != manifest:
+        return None
+    sections = header["sections"]
+    try:
+        texts = sections["texts"]
+        offsets = np.frombuffer(_map(path + texts["offsets"], 8 * (texts["rows"] + 1)), dtype=np.uint64)
+        blob = _map(path + texts["file"], texts["length"])
+        arrays = {}
+        for name, dtype in (("hashes", np.dtype(np.uint64)), ("meta", CHUNK_META_DTYPE)):
+            info = sections[name]
+            arrays[name] = np.frombuffer(_map(path + info["file"], info["length"]),
+                                         dtype=dtype).reshape(info["shape"])
+        bm25 = BM25Index.load(io.BytesIO(_map(path + sections["bm25"]["file"], sections["bm25"]["length"])))
+        index_path = path + sections["index"]["file"]
+        # Списки IVF остаются на диске (mmap, только чтение), плоский индекс FAISS читает в память
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+    except (OSError, ValueError, RuntimeError):
+        return None
+    return {
+        "manifest": header["manifest"],
+        "index": index,
+        "index_path": index_path,
+        "chunks": ChunkStore.from_buffers(offsets, blob),
+        "hashes": arrays["hashes"],
+        "meta": arrays["meta"],
+        "bm25": bm25,
+        "duplicates": {int(doc_id): sources for doc_id, sources in header["duplicates"].items()},
+    }
+
+
+def remove_snapshot(folder: str):
+    path = snapshot_path(folder)
+    for file in [path, *glob.glob(glob.escape(path) + ".*")]:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
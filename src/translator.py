@@ -0,0 +1,298 @@
+"""
+Перевод найденных фрагментов на русский офлайн через Argos Translate.
+
+Переводятся только чанки, где кириллицы почти нет, а внутри них — только
+предложения на латинице (строки таблиц с кодами и числами остаются как есть).
+Язык оригинала определяется по служебным словам (en, de, fr, es, it), и чанк
+идёт в пакет Argos своей языковой пары; чанк на нераспознанном языке или на
+языке без установленного пакета остаётся оригиналом. Предложения всех чанков
+одного языка переводятся одним вызовом translate_batch модели CTranslate2 из
+пакета Argos. Перевод каждого чанка один раз пишется в постоянный кэш
+SQLite (ключ — языковая пара и хеш текста), поэтому при translation="ingest"
+перевод делается при индексации, а при ответе только читается из кэша.
+
+Пакеты моделей ставятся один раз; для языков без прямой пары с русским
+Argos переводит через английский:
+
+    argospm update && argospm install translate-en_ru translate-de_en translate-fr_en
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from src import metrics
+from src.embedding_cache import text_key
+
+TRANSLATION_MODES = ("ingest", "query")
+SOURCE_LANGUAGES = ("en", "de", "fr", "es", "it")
+# Чанк с меньшей долей кириллицы среди букв считается иностранным
+MIN_CYRILLIC_RATIO = 0.3
+
+_SQL_BATCH = 500
+_LETTER_RE = re.compile(r"[^\W\d_]")
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"«(\[]?[A-ZА-ЯЁ0-9])")
+# Предложение переводится, если в нём хотя бы два латинских слова (коды вроде 1000BASE-T не в счёт)
+_WORDS_RE = re.compile(r"\b[A-Za-z]{2,}\b")
+_LATIN_WORD_RE = re.compile(r"[a-zà-öø-ÿ]+")
+# Частые служебные слова языка: по ним язык чанка узнаётся без отдельной модели
+_STOPWORDS = {
+    "en": frozenset("the and of to is are for with on that this be by from or not it your you can".split()),
+    "de": frozenset("der die das und ist nicht mit den von zu auf für ein eine dem des sie wird werden".split()),
+    "fr": frozenset("le les et est pour dans une des du que sur pas avec sont au vous ce il".split()),
+    "es": frozenset("el los las del que es para con por una se al su como está son y lo".split()),
+    "it": frozenset("il gli della che è per con una del nel sono non di alla questo si".split()),
+}
+
+
+def cyrillic_ratio(text: str) -> float:
+    """Доля кириллицы среди букв текста (1.0 — букв нет вовсе)."""
+    letters = len(_LETTER_RE.findall(text))
+    return len(_CYRILLIC_RE.findall(text)) / letters if letters else 1.0
+
+
+def needs_translation(text: str, min_ratio: float = MIN_CYRILLIC_RATIO) -> bool:
+    return len(_WORDS_RE.findall(text)) >= 2 and cyrillic_ratio(text) < min_ratio
+
+
+def detect_language(text: str) -> Optional[str]:
+    """
+    Язык латинского текста по служебным словам; None, если их меньше двух
+    или два языка набрали поровну.
+    """
+    words = _LATIN_WORD_RE.findall(text.lower())
+    scores = sorted(((sum(word in stopwords for word in words), code) for code, stopwords in _STOPWORDS.items()),
+                    reverse=True)
+    (best, code), (second, _) = scores[0], scores[1]
+    return code if best >= 2 and best > second else None
+
+
+def split_sentences(text: str) -> List[List[str]]:
+    """Строки чанка, каждая разбита на предложения; переносы строк сохраняются при сборке."""
+    return [_SENTENCE_RE.split(line) if line.strip() else [line] for line in text.split("\n")]
+
+
+class ArgosBackend:
+    """
+    Модель пакета Argos. Если в прямом пакете пары лежат модель CTranslate2 и
+    sentencepiece, предложения идут в translate_batch напрямую одной пачкой;
+    иначе — по одному через публичный API argostranslate (в том числе через
+    промежуточный язык).
+    """
+
+    def __init__(self, from_code: str = "en", to_code: str = "ru", beam_size: int = 2,
+                 batch_size: int = 32, num_threads: int = 0):
+        self.from_code = from_code
+        self.to_code = to_code
+        self.beam_size = beam_size
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self._translator = None
+        self._tokenizer = None
+        self._translation = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._translator is not None or self._translation is not None
+
+    def _load(self):
+        try:
+            import argostranslate.package
+            import argostranslate.translate
+        except ImportError as e:
+            raise ImportError("Для перевода нужен argostranslate: pip install argostranslate") from e
+        packages = [p for p in argostranslate.package.get_installed_packages()
+                    if p.from_code == self.from_code and p.to_code == self.to_code]
+        if packages:
+            path = str(packages[0].package_path)
+            model_dir, sp_model = os.path.join(path, "model"), os.path.join(path, "sentencepiece.model")
+            if os.path.isdir(model_dir) and os.path.exists(sp_model):
+                import ctranslate2
+                import sentencepiece
+
+                self._translator = ctranslate2.Translator(model_dir, device="cpu", intra_threads=self.num_threads)
+                self._tokenizer = sentencepiece.SentencePieceProcessor(model_file=sp_model)
+                return
+        # Без прямого пакета Argos переводит через промежуточный язык (de→en→ru), если пакеты есть
+        languages = {language.code: language for language in argostranslate.translate.get_installed_languages()}
+        source, target = languages.get(self.from_code), languages.get(self.to_code)
+        self._translation = source.get_translation(target) if source and target else None
+        if self._translation is None:
+            raise RuntimeError(f"Пакет Argos {self.from_code}→{self.to_code} не установлен: "
+                               f"argospm install translate-{self.from_code}_{self.to_code}")
+
+    def translate_batch(self, sentences: List[str]) -> List[str]:
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    with metrics.span("load_translator"):
+                        self._load()
+        if self._translator is None:
+            return [self._translation.translate(sentence) for sentence in sentences]
+        tokens = self._tokenizer.encode(sentences, out_type=str)
+        results = self._translator.translate_batch(
+            tokens, max_batch_size=self.batch_size, beam_size=self.beam_size, replace_unknowns=True,
+        )
+        return [self._tokenizer.decode(result.hypotheses[0]) for result in results]
+
+
+class TranslationCache:
+    """Переводы чанков в SQLite (WAL); path=":memory:" — кэш только на время процесса."""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                " pair TEXT NOT NULL, key BLOB NOT NULL, text TEXT NOT NULL,"
+                " PRIMARY KEY (pair, key)) WITHOUT ROWID"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, pair: str, keys: Sequence[bytes]) -> Dict[bytes, str]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, text FROM translations WHERE pair = ? AND key IN ({','.join('?' * len(batch))})",
+                    [pair, *batch],
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, pair: str, items: Dict[bytes, str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO translations (pair, key, text) VALUES (?, ?, ?)",
+                    [(pair, key, text) for key, text in items.items()],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class Translator:
+    """
+    Перевод пачки чанков с кэшем. translate возвращает тексты в том же
+    порядке; русские чанки и чанки на языках без модели возвращаются без
+    изменений. backends — модели по коду языка оригинала (недостающие
+    создаются как ArgosBackend); язык, для которого пакета нет, запоминается
+    в unavailable и дальше не пробуется.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, to_code: str = "ru",
+                 languages: Sequence[str] = SOURCE_LANGUAGES, min_cyrillic_ratio: float = MIN_CYRILLIC_RATIO,
+                 backends: Optional[Dict[str, object]] = None):
+        self.to_code = to_code
+        self.languages = tuple(languages)
+        self.min_cyrillic_ratio = min_cyrillic_ratio
+        self.backends = backends if backends is not None else {}
+        self.unavailable = {}
+        self.cache = TranslationCache(cache_path or ":memory:")
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "chunks": 0, "translated": 0, "cache_hits": 0, "sentences": 0,
+                       "skipped": 0, "seconds": 0.0}
+
+    def _backend(self, code: str):
+        if code not in self.backends:
+            self.backends[code] = ArgosBackend(code, self.to_code)
+        return self.backends[code]
+
+    def _language(self, text: str) -> Optional[str]:
+        if not needs_translation(text, self.min_cyrillic_ratio):
+            return None
+        code = detect_language(text)
+        return code if code in self.languages and code not in self.unavailable else ""
+
+    def translate(self, texts: Sequence[str]) -> List[str]:
+        # Язык: None — переводить не нужно, "" — язык не распознан или для него нет модели
+        languages = [self._language(text) for text in texts]
+        groups = {}
+        for text, code in zip(texts, languages):
+            if code:
+                groups.setdefault(code, {})[text_key(text)] = text
+        found = {}
+        started = time.perf_counter()
+        sentences = translated = hits = 0
+        for code, foreign in groups.items():
+            pair = f"{code}-{self.to_code}"
+            cached = self.cache.get_many(pair, list(foreign))
+            missing = {key: text for key, text in foreign.items() if key not in cached}
+            hits += len(cached)
+            found.update(((code, key), text) for key, text in cached.items())
+            if not missing:
+                continue
+            try:
+                with metrics.span("translate"):
+                    results, count = self._translate_chunks(self._backend(code), list(missing.values()))
+            except (ImportError, RuntimeError) as e:
+                # Нет argostranslate или пакета этой пары — чанки остаются оригиналом
+                self.unavailable[code] = str(e)
+                metrics.increment("translation_errors")
+                continue
+            results = dict(zip(missing, results))
+            self.cache.put_many(pair, results)
+            found.update(((code, key), text) for key, text in results.items())
+            sentences += count
+            translated += len(results)
+        elapsed = time.perf_counter() - started
+        out = [found.get((code, text_key(text)), text) if code else text for text, code in zip(texts, languages)]
+        skipped = sum(code == "" for code in languages)
+        with self._stats_lock:
+            self._stats["calls"] += 1
+            self._stats["chunks"] += len(texts)
+            self._stats["translated"] += translated
+            self._stats["cache_hits"] += hits
+            self._stats["sentences"] += sentences
+            self._stats["skipped"] += skipped
+            self._stats["seconds"] += elapsed
+        metrics.increment("chunks_translated", translated)
+        metrics.increment("translation_cache_hits", hits)
+        metrics.increment("translation_skipped", skipped)
+        return out
+
+    def _translate_chunks(self, backend, texts: List[str]):
+        """Все иностранные предложения чанков — одним вызовом модели, повторы — один раз."""
+        layouts = [split_sentences(text) for text in texts]
+        unique = list(dict.fromkeys(
+            sentence.strip() for lines in layouts for line in lines for sentence in line
+            if needs_translation(sentence, self.min_cyrillic_ratio)
+        ))
+        by_sentence = dict(zip(unique, backend.translate_batch(unique))) if unique else {}
+        translated = [
+            "\n".join(" ".join(by_sentence.get(sentence.strip(), sentence) for sentence in line) for line in lines)
+            for lines in layouts
+        ]
+        return translated, len(unique)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["sentences_per_sec"] = stats["sentences"] / stats["seconds"] if stats["seconds"] else 0.0
+        stats["mean_ms"] = 1000 * stats["seconds"] / stats["calls"] if stats["calls"] else 0.0
+        stats["entries"] = len(self.cache)
+        stats["unavailable"] = sorted(self.unavailable)
+        return stats
@@ -0,0 +1,43 @@
+import unittest
+from src.benchmark import compare_results, iter_synthetic_chunks, run_benchmark, synthetic_queries
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_synthetic_corpus_is_deterministic(self):
+        first = list(iter_synthetic_chunks(1500, seed=3))
+        self.assertEqual(len(first), 1500)
+        self.assertEqual(first, list(iter_synthetic_chunks(1500, seed=3)))
+        self.assertNotEqual(first[:10], list(iter_synthetic_chunks(10, seed=4)))
+        self.assertTrue(any("питание" in c or "разъём" in c for c in first))
+        self.assertTrue(any("power" in c or "cable" in c for c in first))
+        queries = synthetic_queries(1500, 20, seed=3)
+        self.assertEqual(queries, synthetic_queries(1500, 20, seed=3))
+        # Слова запроса берутся из чанков корпуса
+        vocabulary = {word for chunk in first for word in chunk.rstrip(".").split()}
+        self.assertTrue(all(set(q.split()) <= vocabulary for q in queries))
+
+    def test_run_reports_latency_and_exact_recall(self):
+        run = run_benchmark(300, n_queries=20, engine_kwargs={"index_config": {"backend": "flat"}})
+        self.assertEqual(run["ingest"]["added"] + run["ingest"]["exact_duplicates"], 300)
+        self.assertLessEqual(run["query"]["cold"]["p50_ms"], run["query"]["cold"]["p99_ms"])
+        self.assertGreater(run["query"]["batch"]["queries_per_sec"], 0)
+        self.assertEqual(run["chunking"]["over_window"], 0.0)
+        # Flat-индекс совпадает с точным поиском
+        self.assertEqual(run["recall"]["recall@10"], 1.0)
+
+    def test_compare_detects_regressions(self):
+        baseline = {"runs": [{"size": 1000, "ingest": {"chunks_per_sec": 100.0},
+                              "query": {"cold": {"p99_ms": 10.0}}, "recall": {"recall@10": 0.95}}]}
+        same = {"runs": [{"size": 1000, "ingest": {"chunks_per_sec": 95.0},
+                          "query": {"cold": {"p99_ms": 11.0}}, "recall": {"recall@10": 0.945}}]}
+        self.assertEqual(compare_results(same, baseline), [])
+        worse = {"runs": [{"size": 1000, "ingest": {"chunks_per_sec": 50.0},
+                           "query": {"cold": {"p99_ms": 20.0}}, "recall": {"recall@10": 0.9}},
+                          {"size": 5000, "ingest": {"chunks_per_sec": 1.0}}]}
+        self.assertEqual({r["metric"] for r in compare_results(worse, baseline)},
+                         {"ingest.chunks_per_sec", "query.cold.p99_ms", "recall.recall@10"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from src.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+DOCS = [
+    "Коммутатор C1212-1002 поддерживает IEEE802.3ab и разъём RJ45.",
+    "Для настройки VLAN используйте команду switch#vlan database.",
+    "Подключите блок питания к разъёму DC-IN.",
+    "Разъём RJ45 используется для подключения Ethernet-кабеля.",
+]
+
+
+class TestBM25(unittest.TestCase):
+
+    def test_tokenize_keeps_technical_tokens(self):
+        tokens = tokenize("Модель C1212-1002, стандарт IEEE802.3ab")
+        self.assertIn("c1212-1002", tokens)
+        self.assertIn("ieee802.3ab", tokens)
+        self.assertIn("ieee802", tokens)
+
+    def test_exact_token_ranks_first(self):
+        index = BM25Index()
+        index.add(DOCS)
+        scores, ids = index.search("c1212-1002", k=3)
+        self.assertEqual(ids[0], 0)
+        self.assertEqual(list(ids[1:]), [-1, -1])
+        _, ids = index.search("RJ45", k=4)
+        self.assertEqual(set(ids[:2]), {0, 3})
+
+    def test_excluded_ids(self):
+        index = BM25Index()
+        index.add(DOCS)
+        _, ids = index.search("RJ45", k=4, exclude=np.array([0]))
+        self.assertEqual(list(ids), [3, -1, -1, -1])
+        _, ids = index.search("c1212-1002", k=2, exclude=np.array([0]))
+        self.assertTrue(np.all(ids == -1))
+
+    def test_unknown_terms(self):
+        index = BM25Index()
+        index.add(DOCS)
+        scores, ids = index.search("несуществующий", k=2)
+        self.assertTrue(np.all(ids == -1))
+
+    def test_incremental_add_equals_merge(self):
+        """Постинги дописываются без перестроения, merge сдвигает id."""
+        whole = BM25Index()
+        whole.add(DOCS)
+        first, second = BM25Index(), BM25Index()
+        first.add(DOCS[:2])
+        second.add(DOCS[2:])
+        first.merge(second)
+        for query in ("RJ45", "vlan database", "DC-IN"):
+            with self.subTest(query=query):
+                np.testing.assert_array_equal(first.search(query, 4)[1], whole.search(query, 4)[1])
+
+    def test_scoring_runs_outside_lock(self):
+        """Пока один запрос считает оценки, другой поиск и добавление не ждут его."""
+        index = BM25Index()
+        index.add(DOCS)
+        expected = index.search("RJ45 разъём", 4)
+        inside = threading.Event()
+        release = threading.Event()
+        score = index._score
+
+        def slow_score(*args, **kwargs):
+            inside.set()
+            release.wait(5)
+            return score(*args, **kwargs)
+
+        index._score = slow_score
+        results = []
+        worker = threading.Thread(target=lambda: results.append(index.search("RJ45 разъём", 4)))
+        worker.start()
+        self.assertTrue(inside.wait(5))
+        # Блокировка свободна: добавление проходит, пока первый запрос ещё считается
+        self.assertTrue(index._lock.acquire(timeout=1))
+        index._lock.release()
+        index.add(["Ещё один разъём RJ45."])
+        release.set()
+        worker.join(5)
+        # Запрос видит снимок постингов на момент своего начала
+        np.testing.assert_array_equal(results[0][1], expected[1])
+        np.testing.assert_allclose(results[0][0], expected[0])
+
+    def test_save_and_load(self):
+        index = BM25Index()
+        index.add(DOCS)
+        path = os.path.join(tempfile.mkdtemp(), "bm25.npz")
+        index.save(path)
+        restored = BM25Index.load(path)
+        self.assertEqual(len(restored), len(DOCS))
+        np.testing.assert_allclose(restored.search("RJ45 разъём", 4)[0], index.search("RJ45 разъём", 4)[0])
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, -1]], k=60, limit=2)
+        self.assertEqual([doc_id for doc_id, _ in fused], [1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.chunk_store import ChunkList, ChunkStore, concat_chunk_stores, write_chunk_store
+
+
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_write_and_read(self):
+        """Чанки читаются по id без загрузки всего файла."""
+        chunks = ["Настройка VLAN: vlan database.", "", "Разъём RJ45 — IEEE802.3ab ✓"]
+        prefix = os.path.join(self.folder, "part")
+        self.assertEqual(write_chunk_store(prefix, iter(chunks)), 3)
+        store = ChunkStore(prefix)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store[2], chunks[2])
+        self.assertEqual(store[-1], chunks[2])
+        self.assertEqual(list(store), chunks)
+        with self.assertRaises(IndexError):
+            store[3]
+
+    def test_empty_store(self):
+        prefix = os.path.join(self.folder, "empty")
+        write_chunk_store(prefix, [])
+        self.assertEqual(len(ChunkStore(prefix)), 0)
+
+    def test_from_buffers(self):
+        blob = "одиндва".encode("utf-8")
+        offsets = np.array([0, len("один".encode("utf-8")), len(blob)], dtype="uint64")
+        store = ChunkStore.from_buffers(offsets, memoryview(blob))
+        self.assertEqual(list(store), ["один", "два"])
+        self.assertEqual(store.raw_bytes(), blob)
+
+    def test_concat(self):
+        first, second = os.path.join(self.folder, "a"), os.path.join(self.folder, "b")
+        write_chunk_store(first, ["один", "два"])
+        write_chunk_store(second, ["три"])
+        merged = os.path.join(self.folder, "merged")
+        concat_chunk_stores(merged, [ChunkStore(first), ChunkStore(second)])
+        self.assertEqual(list(ChunkStore(merged)), ["один", "два", "три"])
+
+    def test_chunk_list_parts_and_tail(self):
+        prefix = os.path.join(self.folder, "base")
+        write_chunk_store(prefix, ["ноль", "один"])
+        chunks = ChunkList([ChunkStore(prefix)])
+        chunks.extend(["два", "три"])
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[2], "два")
+        self.assertEqual(chunks[1:3], ["один", "два"])
+        self.assertEqual(chunks, ["ноль", "один", "два", "три"])
+
+        tail_prefix = os.path.join(self.folder, "tail")
+        write_chunk_store(tail_prefix, chunks[2:])
+        chunks.persist_tail(ChunkStore(tail_prefix))
+        self.assertEqual(len(chunks.parts), 2)
+        self.assertEqual(chunks[3], "три")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from unittest import mock
+import numpy as np
+from src import chunker
+from src.benchmark import iter_synthetic_chunks, synthetic_pages
+from src.chunker import (
+    CHUNK_TOKENS, MODEL_MAX_TOKENS, chunk_lines, count_chunk_tokens, default_counter, estimate_tokens, split_text,
+    tokenizer_counter,
+)
+
+SENTENCES = [f"Шаг {i}: подключите кабель питания к разъёму DC-IN и дождитесь индикатора {i}." for i in range(40)]
+
+
+class TestChunker(unittest.TestCase):
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens("в"), 1)
+        self.assertEqual(estimate_tokens("DC-IN"), 3)
+        self.assertGreater(estimate_tokens("192.168.1.1"), estimate_tokens("адрес"))
+
+    def test_chunks_fit_budget_and_overlap(self):
+        """Чанки помещаются в окно модели, режутся по предложениям и перекрываются."""
+        chunks = split_text("\n".join(SENTENCES))
+        self.assertGreater(len(chunks), 3)
+        for chunk in chunks:
+            self.assertLessEqual(count_chunk_tokens(chunk), CHUNK_TOKENS)
+            self.assertTrue(chunk.endswith("."))
+        for previous, current in zip(chunks, chunks[1:]):
+            last_sentence = previous[previous.rindex("Шаг"):]
+            self.assertTrue(current.startswith(last_sentence))
+        first, second = split_text("\n".join(SENTENCES), overlap_tokens=0)[:2]
+        self.assertFalse({s for s in SENTENCES if s in first} & {s for s in SENTENCES if s in second})
+
+    def test_long_sentence_is_split_by_words(self):
+        text = " ".join(f"слово{i}" for i in range(500))
+        chunks = split_text(text, max_tokens=60, overlap_tokens=10)
+        self.assertTrue(all(count_chunk_tokens(chunk) <= 60 for chunk in chunks))
+        self.assertTrue(chunks[-1].endswith("слово499"))
+
+    def test_table_rows_stay_whole_and_keep_caption(self):
+        rows = [f"{i} Параметр{i} {i * 5} В {i * 100} мА" for i in range(1, 41)]
+        lines = ["7.10 Питание", "Параметры питания приведены в таблице ниже для всех моделей устройства.",
+                 "Таблица 7.10 Параметры питания", *rows,
+                 "После проверки параметров закройте крышку и включите устройство кнопкой."]
+        chunks = chunk_lines(lines)
+        table_chunks = [text for _, text in chunks if any(row in text.split("\n") for row in rows)]
+        self.assertGreater(len(table_chunks), 1)
+        for text in table_chunks:
+            self.assertIn("Таблица 7.10 Параметры питания", text)
+        found = [row for row in rows for _, text in chunks if row in text.split("\n")]
+        self.assertEqual(found, rows)
+        # Номер строки главы, с которой начинается чанк
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][0], 2)
+
+    def test_invalid_overlap(self):
+        with self.assertRaises(ValueError):
+            chunk_lines(["текст"], max_tokens=20, overlap_tokens=10)
+
+    def test_default_counter_falls_back_to_estimate(self):
+        default_counter.cache_clear()
+        try:
+            with mock.patch.object(chunker, "tokenizer_counter", side_effect=OSError("нет в кэше")):
+                self.assertIs(default_counter(), estimate_tokens)
+            default_counter.cache_clear()
+            with mock.patch.object(chunker, "tokenizer_counter", return_value=len):
+                self.assertIs(default_counter(), len)
+                self.assertEqual(count_chunk_tokens("раз два"), 6)
+        finally:
+            default_counter.cache_clear()
+
+
+class TestEstimateCalibration(unittest.TestCase):
+    """
+    Оценка estimate_tokens — запасной счётчик без токенизатора: нарезанные по
+    ней чанки не должны выходить за окно модели по настоящим токенам.
+    Проверяется там, где токенизатор модели есть в локальном кэше HuggingFace.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.count = staticmethod(tokenizer_counter(local_files_only=True))
+        except (ImportError, OSError, ValueError):
+            raise unittest.SkipTest("токенизатора модели нет в локальном кэше")
+
+    def corpus_chunks(self):
+        pages = synthetic_pages(list(iter_synthetic_chunks(600, seed=3)))
+        lines = [line for page in pages for line in page.splitlines()] + SENTENCES
+        return [chunk for _, chunk in chunk_lines(lines, count_tokens=estimate_tokens)]
+
+    def test_estimate_chunks_fit_model_window(self):
+        real = np.array([count_chunk_tokens(chunk, self.count) for chunk in self.corpus_chunks()])
+        # <s> и </s> тоже занимают окно
+        self.assertLessEqual(float(np.mean(real + 2 > MODEL_MAX_TOKENS)), 0.01)
+
+    def test_estimate_is_not_below_real_count(self):
+        chunks = self.corpus_chunks()
+        estimated = np.array([count_chunk_tokens(chunk, estimate_tokens) for chunk in chunks])
+        real = np.array([count_chunk_tokens(chunk, self.count) for chunk in chunks])
+        self.assertGreaterEqual(float(np.mean(estimated >= real)), 0.95)
+
+
+if __name__ == "__main__":
+    unittest.main()
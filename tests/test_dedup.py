@@ -0,0 +1,50 @@
+import unittest
+from src.dedup import DedupIndex, content_hash, hamming, hash_chunks, simhash
+
+BOILERPLATE = ("Перед началом работы внимательно прочитайте руководство по эксплуатации "
+               "и соблюдайте требования техники безопасности при подключении оборудования к сети")
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_content_hash_ignores_case_and_spaces(self):
+        self.assertEqual(content_hash("Настройка  VLAN\nна порту"), content_hash("настройка vlan на порту"))
+        self.assertNotEqual(content_hash("Настройка VLAN"), content_hash("Настройка QoS"))
+
+    def test_simhash_near_duplicates(self):
+        """Смена одного слова в длинном тексте даёт близкий SimHash."""
+        revised = BOILERPLATE.replace("сети", "электросети")
+        other = "Для настройки VLAN используйте команду switch#vlan database на коммутаторе доступа"
+        self.assertLessEqual(hamming(simhash(BOILERPLATE), simhash(revised)), 16)
+        self.assertLess(hamming(simhash(BOILERPLATE), simhash(revised)),
+                        hamming(simhash(BOILERPLATE), simhash(other)))
+
+    def test_dedup_index_lookup(self):
+        index = DedupIndex(max_distance=3)
+        digest, fingerprint = content_hash(BOILERPLATE), simhash(BOILERPLATE)
+        index.register(7, digest, fingerprint)
+        self.assertEqual(index.find_exact(digest), 7)
+        self.assertEqual(index.find_near(fingerprint ^ 0b101), 7)
+        self.assertIsNone(index.find_near(fingerprint ^ 0xFFFF))
+        self.assertEqual(index.export([7]).tolist(), [[digest, fingerprint]])
+
+    def test_register_many_is_lazy(self):
+        """Массовая регистрация раскладывается по словарям только при первом поиске."""
+        index = DedupIndex()
+        hashes = hash_chunks(["первый чанк", "второй чанк", "третий чанк"])
+        index.register_many([0, 1, 2], hashes[:, 0], hashes[:, 1])
+        self.assertEqual(len(index), 3)
+        self.assertFalse(index._digests)
+        self.assertEqual(index.find_exact(int(hashes[1, 0])), 1)
+        index.register(3, 42, 42)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.export([2]).tolist(), hashes[2:].tolist())
+
+    def test_hash_chunks(self):
+        hashes = hash_chunks(["первый чанк", "второй чанк"])
+        self.assertEqual(hashes.shape, (2, 2))
+        self.assertEqual(int(hashes[0, 0]), content_hash("первый чанк"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest import mock
+import numpy as np
+from src import embedders
+from src.embedders import Embedder, LazyEmbedder, load_embedder, parity_report, recall_at_k
+
+
+class RandomProjectionModel:
+    """Детерминированная «модель»: мешок символов, спроецированный в 16 измерений."""
+
+    def __init__(self, noise: float = 0.0):
+        rng = np.random.default_rng(1)
+        self.projection = rng.normal(size=(256, 16)).astype("float32")
+        self.noise = noise
+        self.batch_sizes = []
+
+    def get_sentence_embedding_dimension(self):
+        return 16
+
+    def encode(self, texts, normalize_embeddings=False, batch_size=32, **kwargs):
+        self.batch_sizes.append(batch_size)
+        counts = np.zeros((len(texts), 256), dtype="float32")
+        for i, text in enumerate(texts):
+            for ch in text.encode("utf-8"):
+                counts[i, ch] += 1
+        out = counts @ self.projection
+        if self.noise:
+            out += np.random.default_rng(2).normal(scale=self.noise, size=out.shape).astype("float32")
+        if normalize_embeddings:
+            out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out
+
+
+CHUNKS = [f"Раздел {i}. Настройка порта {i * 7} и VLAN {i % 13} на коммутаторе" for i in range(60)]
+
+
+class TestEmbedders(unittest.TestCase):
+
+    def test_recall_at_k(self):
+        reference = np.array([[1, 2, 3], [4, 5, 6]])
+        candidate = np.array([[3, 2, 9], [4, 5, 6]])
+        self.assertAlmostEqual(recall_at_k(reference, candidate, 3), (2 / 3 + 1) / 2)
+
+    def test_embedder_uses_configured_batch_size(self):
+        model = RandomProjectionModel()
+        embedder = Embedder(model, "torch", batch_size=8)
+        out = embedder.encode(["один", "два"])
+        self.assertEqual(out.shape, (2, 16))
+        self.assertEqual(out.dtype, np.float32)
+        self.assertEqual(model.batch_sizes, [8])
+        self.assertEqual(embedder.get_sentence_embedding_dimension(), 16)
+
+    def test_parity_report_identical_models(self):
+        reference = Embedder(RandomProjectionModel(), "torch")
+        candidate = Embedder(RandomProjectionModel(), "onnx")
+        report = parity_report(reference, candidate, CHUNKS, k=5)
+        self.assertEqual(report["recall@5"], 1.0)
+        self.assertAlmostEqual(report["mean_cosine"], 1.0, places=5)
+        self.assertEqual(report["chunks"], len(CHUNKS))
+
+    def test_parity_report_detects_drift(self):
+        reference = Embedder(RandomProjectionModel(), "torch")
+        candidate = Embedder(RandomProjectionModel(noise=50.0), "onnx_int8")
+        report = parity_report(reference, candidate, CHUNKS, queries=CHUNKS[:10], k=5, max_chunks=40)
+        self.assertLess(report["recall@5"], 1.0)
+        self.assertLess(report["min_cosine"], 0.99)
+        self.assertEqual(report["chunks"], 40)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            load_embedder("tensorrt")
+        with self.assertRaises(ValueError):
+            LazyEmbedder("tensorrt")
+
+    def test_lazy_embedder_shares_model(self):
+        """Модель грузится при первом encode и одна на процесс для одинаковых параметров."""
+        with mock.patch.object(embedders, "_load_model", return_value=RandomProjectionModel()) as load, \
+                mock.patch.dict(embedders._shared_models, clear=True):
+            first, second = LazyEmbedder("onnx", batch_size=8), LazyEmbedder("onnx", batch_size=8)
+            self.assertEqual(first.name, embedders.embedder_name("onnx"))
+            self.assertFalse(first.loaded)
+            load.assert_not_called()
+            self.assertEqual(first.encode(CHUNKS[:3]).shape, (3, 16))
+            self.assertEqual(second.get_sentence_embedding_dimension(), 16)
+            self.assertTrue(first.loaded)
+            self.assertIs(first.model, second.model)
+            load.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.embedding_cache import EmbeddingCache, main, text_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "embeddings.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_put_get_and_reopen(self):
+        cache = EmbeddingCache(self.path)
+        keys = [text_key("первый"), text_key("второй")]
+        vectors = np.arange(8, dtype="float32").reshape(2, 4)
+        cache.put_many("model-a", keys, vectors)
+        cache.close()
+
+        cache = EmbeddingCache(self.path)
+        found = cache.get_many("model-a", keys + [text_key("третий")])
+        self.assertEqual(set(found), set(keys))
+        np.testing.assert_array_equal(found[keys[1]], vectors[1])
+        self.assertEqual(cache.get_many("model-b", keys), {})
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 3)
+        cache.close()
+
+    def test_key_is_case_sensitive(self):
+        self.assertNotEqual(text_key("VLAN"), text_key("vlan"))
+
+    def test_evicts_least_recently_used(self):
+        cache = EmbeddingCache(self.path, max_entries=2)
+        vec = np.ones((1, 4), dtype="float32")
+        cache.put_many("m", [text_key("a")], vec)
+        cache.put_many("m", [text_key("b")], vec)
+        cache.get_many("m", [text_key("a")])
+        cache.put_many("m", [text_key("c")], vec)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(set(cache.get_many("m", [text_key(t) for t in "abc"])),
+                         {text_key("a"), text_key("c")})
+        cache.close()
+
+    def test_entry_count_is_tracked_without_scans(self):
+        """Повторная запись ключа не считается новой записью; после вытеснения счётчик точный."""
+        cache = EmbeddingCache(self.path, max_entries=3)
+        vec = np.ones((2, 4), dtype="float32")
+        cache.put_many("m", [text_key("a"), text_key("b")], vec)
+        cache.put_many("m", [text_key("a"), text_key("b")], vec)
+        self.assertEqual((cache._count, len(cache)), (2, 2))
+        cache.put_many("m", [text_key("c"), text_key("d")], vec)
+        self.assertEqual((cache._count, len(cache)), (3, 3))
+        self.assertEqual(cache.prune("m", ["c", "d"]), 1)
+        self.assertEqual(cache._count, 2)
+        cache.close()
+        self.assertEqual(EmbeddingCache(self.path)._count, 2)
+
+    def test_prune_drops_missing_chunks(self):
+        cache = EmbeddingCache(self.path)
+        texts = ["живой чанк", "удалённый чанк"]
+        cache.put_many("m", [text_key(t) for t in texts], np.ones((2, 4), dtype="float32"))
+        cache.put_many("other", [text_key(texts[1])], np.ones((1, 4), dtype="float32"))
+        self.assertEqual(cache.prune("m", ["живой чанк"]), 1)
+        self.assertEqual(cache.stats()["entries"], {"m": 1, "other": 1})
+        self.assertEqual(cache.prune(None, ["живой чанк"]), 1)
+        cache.close()
+
+    def test_prune_command_without_index(self):
+        with self.assertRaises(SystemExit):
+            main(["prune", "--db", self.path, "--folder", os.path.join(self.temp_dir, "missing")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,64 +1,113 @@
 import os
 import unittest
 import json
-import shutil  # ← добавлен импорт
-from src.feedback_handler import log_feedback, init_feedback_file
+import shutil
+import tempfile
+import threading
+import src.feedback_handler as feedback_handler
+from src.feedback_handler import FeedbackStore, close_feedback_store, log_feedback, init_feedback_file
 
 class TestFeedbackHandler(unittest.TestCase):
 
     def setUp(self):
-        """Очищаем feedback-файл и папку перед каждым тестом."""
-        self.feedback_file = "feedback/feedback.json"
-        if os.path.exists(self.feedback_file):
-            os.remove(self.feedback_file)
-        if os.path.exists("feedback"):
-            shutil.rmtree("feedback")  # ← ИСПРАВЛЕНО: теперь удаляется даже непустая папка
+        """Каждый тест работает со своей временной папкой feedback."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "feedback.sqlite")
 
     def tearDown(self):
-        """Очищаем после теста."""
-        if os.path.exists(self.feedback_file):
-            os.remove(self.feedback_file)
-        if os.path.exists("feedback"):
-            shutil.rmtree("feedback")
+        close_feedback_store()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
 
     def test_init_feedback_file(self):
-        """Проверка создания файла обратной связи."""
-        init_feedback_file()
-        self.assertTrue(os.path.exists(self.feedback_file))
-        with open(self.feedback_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        self.assertEqual(data, [])
+        """Проверка создания базы обратной связи по умолчанию."""
+        old_db, old_json = feedback_handler.FEEDBACK_DB, feedback_handler.LEGACY_FEEDBACK_FILE
+        feedback_handler.FEEDBACK_DB = self.db_path
+        feedback_handler.LEGACY_FEEDBACK_FILE = os.path.join(self.temp_dir, "feedback.json")
+        try:
+            init_feedback_file()
+            self.assertTrue(os.path.exists(self.db_path))
+            log_feedback("Вопрос", "Ответ", ["Чанк"], True)
+            self.assertEqual(len(feedback_handler.get_feedback_store().recent()), 1)
+        finally:
+            feedback_handler.FEEDBACK_DB, feedback_handler.LEGACY_FEEDBACK_FILE = old_db, old_json
 
     def test_log_feedback(self):
         """Проверка сохранения обратной связи."""
-        init_feedback_file()
-        log_feedback(
+        store = FeedbackStore(self.db_path)
+        store.log(
             query="Как подключить питание?",
             answer="Используйте разъём DC-IN.",
             chunks=["Используйте разъём DC-IN."],
             is_correct=True
         )
-        with open(self.feedback_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = store.recent()
         self.assertEqual(len(data), 1)
         entry = data[0]
         self.assertEqual(entry["query"], "Как подключить питание?")
         self.assertEqual(entry["answer"], "Используйте разъём DC-IN.")
+        self.assertEqual(entry["chunks"], ["Используйте разъём DC-IN."])
         self.assertEqual(entry["is_correct"], True)
         self.assertIn("timestamp", entry)
+        store.close()
 
     def test_multiple_feedback_entries(self):
-        """Проверка нескольких записей."""
-        init_feedback_file()
-        log_feedback("Вопрос 1", "Ответ 1", ["Чанк 1"], True)
-        log_feedback("Вопрос 2", "Ответ 2", ["Чанк 2"], False)
-        with open(self.feedback_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        """Проверка нескольких записей и агрегации по вопросу и чанку."""
+        store = FeedbackStore(self.db_path)
+        store.log("Вопрос 1", "Ответ 1", ["Чанк 1"], True)
+        store.log("вопрос 1 ", "Ответ 1", ["Чанк 1"], False)
+        store.log("Вопрос 2", "Ответ 2", ["Чанк 1", "Чанк 2"], False)
 
-        self.assertEqual(len(data), 2)
-        self.assertTrue(data[0]["is_correct"])
-        self.assertFalse(data[1]["is_correct"])
+        data = store.recent()
+        self.assertEqual(len(data), 3)
+        self.assertFalse(data[0]["is_correct"])
+
+        by_query = store.query_stats("Вопрос 1")
+        self.assertEqual(list(by_query.values())[0]["correct"], 1)
+        self.assertEqual(list(by_query.values())[0]["incorrect"], 1)
+        by_chunk = {item["chunk"]: item for item in store.chunk_stats().values()}
+        self.assertEqual(by_chunk["Чанк 1"]["incorrect"], 2)
+        self.assertEqual(by_chunk["Чанк 2"]["incorrect"], 1)
+        store.close()
+
+    def test_background_writer_and_reopen(self):
+        """Записи из нескольких потоков сбрасываются фоновым писателем и переживают закрытие."""
+        store = FeedbackStore(self.db_path, flush_interval=0.01, max_buffer=8)
+        threads = [
+            threading.Thread(target=lambda n=n: [store.log(f"Вопрос {n}", "Ответ", [], n % 2 == 0)
+                                                 for _ in range(25)])
+            for n in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.close()
+
+        store = FeedbackStore(self.db_path)
+        stats = store.query_stats()
+        self.assertEqual(sum(item["correct"] + item["incorrect"] for item in stats.values()), 100)
+        store.close()
+
+    def test_rotation_keeps_aggregates(self):
+        store = FeedbackStore(self.db_path, rotate_max_rows=2)
+        for _ in range(5):
+            store.log("Вопрос", "Ответ", ["Чанк"], False)
+            store.flush()
+        self.assertEqual(len(os.listdir(os.path.join(self.temp_dir, "archive"))), 2)
+        self.assertEqual(list(store.chunk_stats("Чанк").values())[0]["incorrect"], 5)
+        self.assertEqual(list(store.query_stats(include_archived=False).values())[0]["incorrect"], 1)
+        store.close()
+
+    def test_migrates_legacy_json(self):
+        legacy = os.path.join(self.temp_dir, "feedback.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump([{"timestamp": "2024-01-01T00:00:00", "query": "Старый вопрос",
+                        "answer": "Ответ", "chunks": ["Чанк"], "is_correct": False}], f)
+        store = FeedbackStore(self.db_path, legacy_json=legacy)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(store.recent()[0]["query"], "Старый вопрос")
+        store.close()
 
 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import numpy as np
+from src.index_backends import (
+    build_index, can_build, detect_backend, extract_vectors, make_index_config, make_search_params,
+    resolve_backend,
+)
+import faiss
+
+
+def random_vectors(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+class TestIndexBackends(unittest.TestCase):
+
+    def test_auto_backend_by_corpus_size(self):
+        """Автоматическое повышение бэкенда по порогам."""
+        config = make_index_config({"auto_thresholds": {"ivf_flat": 100, "ivf_pq": 1000}})
+        self.assertEqual(resolve_backend(config, 10), "flat")
+        self.assertEqual(resolve_backend(config, 500), "ivf_flat")
+        self.assertEqual(resolve_backend(config, 5000), "ivf_pq")
+
+    def test_explicit_backend_and_validation(self):
+        self.assertEqual(resolve_backend(make_index_config({"backend": "hnsw"}), 0), "hnsw")
+        with self.assertRaises(ValueError):
+            make_index_config({"backend": "lsh"})
+        with self.assertRaises(ValueError):
+            make_index_config({"unknown": 1})
+
+    def test_ivf_needs_training_data(self):
+        config = make_index_config({"min_train_size": 500})
+        self.assertTrue(can_build("hnsw", config, 0))
+        self.assertFalse(can_build("ivf_flat", config, 100))
+        self.assertTrue(can_build("ivf_flat", config, 500))
+
+    def test_build_and_search_all_backends(self):
+        """Каждый бэкенд находит точный вектор запроса."""
+        vectors = random_vectors(2000)
+        config = make_index_config({"min_train_size": 256, "pq_m": 8, "pq_nbits": 6, "nprobe": 64})
+        for backend in ("flat", "ivf_flat", "hnsw", "ivf_pq"):
+            with self.subTest(backend=backend):
+                index = build_index(backend, vectors, vectors.shape[1], config)
+                self.assertEqual(index.ntotal, len(vectors))
+                self.assertEqual(detect_backend(index), backend)
+                _, ids = index.search(vectors[:5], 5)
+                for row, expected in zip(ids, range(5)):
+                    self.assertIn(expected, row)
+
+    def test_search_params_exclude_ids(self):
+        """IDSelector отфильтровывает id внутри поиска каждого бэкенда."""
+        vectors = random_vectors(1000)
+        config = make_index_config({"min_train_size": 256, "nprobe": 64})
+        selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.arange(5, dtype="int64")))
+        for backend in ("flat", "ivf_flat", "hnsw"):
+            with self.subTest(backend=backend):
+                index = build_index(backend, vectors, vectors.shape[1], config)
+                params = make_search_params(index, config, selector)
+                _, ids = index.search(vectors[:5], 5, params=params)
+                self.assertFalse(np.isin(ids, np.arange(5)).any())
+                _, ids = index.search(vectors[5:10], 1, params=params)
+                self.assertEqual(list(ids[:, 0]), [5, 6, 7, 8, 9])
+
+    def test_build_with_ids(self):
+        """С ids индекс оборачивается в IndexIDMap2 и возвращает переданные id."""
+        vectors = random_vectors(500)
+        config = make_index_config({"min_train_size": 256})
+        for backend in ("flat", "ivf_flat", "hnsw"):
+            with self.subTest(backend=backend):
+                index = build_index(backend, vectors, vectors.shape[1], config, ids=np.arange(500) + 1000)
+                self.assertEqual(detect_backend(index), backend)
+                _, ids = index.search(vectors[:3], 1)
+                self.assertEqual(list(ids[:, 0]), [1000, 1001, 1002])
+                np.testing.assert_allclose(extract_vectors(index), vectors, atol=1e-6)
+
+    def test_rebuild_from_extracted_vectors(self):
+        vectors = random_vectors(1500)
+        config = make_index_config({"min_train_size": 256})
+        ivf = build_index("ivf_flat", vectors, vectors.shape[1], config)
+        restored = extract_vectors(ivf)
+        np.testing.assert_allclose(restored, vectors, atol=1e-6)
+        hnsw = build_index("hnsw", restored, vectors.shape[1], config)
+        self.assertEqual(hnsw.ntotal, len(vectors))
+
+
+if __name__ == "__main__":
+    unittest.main()
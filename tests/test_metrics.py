@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.request
+from src import metrics
+from src.rag_engine import RAGEngine
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        metrics.reset()
+        metrics.enable(True)
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.set_tracing(None)
+        metrics.set_profiling(0)
+        metrics.reset()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics.enable(False)
+        self.assertIs(metrics.span("a"), metrics.span("b"))
+        with metrics.span("encode_query"):
+            metrics.increment("queries")
+        self.assertEqual(metrics.snapshot(), {"counters": {}, "stages": {}})
+
+    def test_prometheus_text(self):
+        with metrics.span("dense_search"):
+            pass
+        metrics.increment("queries", 3)
+        metrics.register_gauge("index_vectors", lambda: 42)
+        text = metrics.prometheus_text()
+        self.assertIn('rag_stage_seconds_bucket{stage="dense_search",le="+Inf"} 1', text)
+        self.assertIn('rag_stage_seconds_count{stage="dense_search"} 1', text)
+        self.assertIn("rag_queries_total 3", text)
+        self.assertIn("rag_index_vectors 42", text)
+
+    def test_engine_stages_and_trace_log(self):
+        trace_path = os.path.join(self.temp_dir, "trace.jsonl")
+        metrics.set_tracing(trace_path)
+        engine = RAGEngine()
+        engine.add_chunks(["Инструкция по подключению питания: используйте разъём DC-IN."])
+        engine.ask("Как подключить питание?")
+        stages = metrics.snapshot()["stages"]
+        for stage in ("ingest_batch", "encode_chunks", "encode_query", "dense_search", "bm25_search",
+                      "format_answer", "ask_many"):
+            self.assertIn(stage, stages)
+        self.assertEqual(metrics.snapshot()["counters"]["queries"], 1)
+        with open(trace_path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["request"], "ask_many")
+        self.assertIn("encode_query", [s["name"] for s in record["spans"]])
+
+    def test_sampling_profiler(self):
+        folder = os.path.join(self.temp_dir, "profiles")
+        metrics.set_profiling(1.0, folder)
+        with metrics.request("ask_many"):
+            sum(range(1000))
+        self.assertEqual(len(os.listdir(folder)), 1)
+
+    def test_http_endpoint(self):
+        server = metrics.start_metrics_server(port=0)
+        try:
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            metrics.increment("queries")
+            with urllib.request.urlopen(base + "/metrics") as response:
+                self.assertIn("rag_queries_total 1", response.read().decode("utf-8"))
+            urllib.request.urlopen(base + "/debug/metrics?enabled=0").read()
+            self.assertFalse(metrics.enabled())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import threading
+import unittest
+from src.micro_batcher import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_concurrent_requests_are_batched(self):
+        """Параллельные запросы обслуживаются меньшим числом пачек."""
+        batches = []
+
+        def batch_fn(items):
+            batches.append(list(items))
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=16, max_wait_ms=50)
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def worker(n):
+            barrier.wait()
+            results[n] = batcher.submit(f"q{n}")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, {n: f"Q{n}" for n in range(8)})
+        self.assertLess(len(batches), 8)
+        self.assertEqual(sum(len(b) for b in batches), 8)
+
+    def test_max_batch_size(self):
+        sizes = []
+        batcher = MicroBatcher(lambda items: sizes.append(len(items)) or items, max_batch_size=3, max_wait_ms=20)
+        futures = [batcher.submit_async(n) for n in range(7)]
+        self.assertEqual([f.result() for f in futures], list(range(7)))
+        self.assertTrue(all(size <= 3 for size in sizes))
+
+    def test_exception_propagates(self):
+        def failing(items):
+            raise RuntimeError("encode failed")
+
+        batcher = MicroBatcher(failing, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            batcher.submit("q")
+
+    def test_result_count_mismatch_fails_every_request(self):
+        batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=4, max_wait_ms=50)
+        futures = [batcher.submit_async(n) for n in range(4)]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "результатов на"):
+                future.result(timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
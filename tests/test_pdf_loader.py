@@ -1,6 +1,9 @@
 # tests/test_pdf_loader.py
 import unittest
-from src.pdf_loader import is_chapter_heading, is_junk_line
+import warnings
+from unittest import mock
+from src.pdf_loader import (classify_line, is_chapter_heading, is_junk_line, iter_chapters_from_pages,
+                            iter_pdf_chunk_records, split_chapter_into_chunks)
 
 class TestPDFLoader(unittest.TestCase):
 
@@ -58,6 +61,64 @@ class TestPDFLoader(unittest.TestCase):
             with self.subTest(line=line):
                 self.assertFalse(is_junk_line(line))
 
+    def test_iter_chapters_from_pages(self):
+        """Главы собираются из потока страниц, в том числе через границу страниц."""
+        pages = [
+            "Титульный лист без главы\n1.1 Введение\nПервая строка первой главы.",
+            "",
+            "Продолжение первой главы на второй странице.\n2.1 Установка\nПодключите кабель питания.",
+        ]
+        chapters = list(iter_chapters_from_pages(iter(pages)))
+        self.assertEqual(len(chapters), 2)
+        self.assertTrue(chapters[0].startswith("1.1 Введение"))
+        self.assertIn("Продолжение первой главы", chapters[0])
+        self.assertNotIn("Титульный", chapters[0])
+        self.assertIn("Подключите кабель питания.", chapters[1])
+
+    def test_chunk_records_track_pages(self):
+        """Страница чанка — страница его первой строки, глава нумеруется с 1."""
+        sentences = [f"Предложение {i} описывает подключение кабеля питания к устройству." for i in range(30)]
+        pages = [
+            "1.1 Введение\n" + "\n".join(sentences[:15]),
+            "\n".join(sentences[15:]) + "\n2.1 Установка\nПодключите кабель питания к устройству.",
+        ]
+        with mock.patch("src.pdf_loader.iter_page_batches", return_value=iter([(0, pages)])):
+            records = list(iter_pdf_chunk_records(["manual.pdf"]))
+        self.assertEqual(records[0][2:], (1, 1, "1.1 Введение"))
+        self.assertEqual(records[-1][2:], (2, 2, "2.1 Установка"))
+        for _, chunk, page, chapter, _ in records[:-1]:
+            first = int(chunk.split()[1]) if chunk.startswith("Предложение") else 0
+            self.assertEqual(page, 1 if first < 15 else 2)
+
+    def test_table_rows_are_not_chapters(self):
+        """Строка таблицы «1 Напряжение …» не открывает новую главу, сильный заголовок — открывает."""
+        pages = ["3.1 Питание\nТаблица 3.1 Параметры\n1 Напряжение 12 В\n2 Ток 500 мА\n"
+                 "Значения указаны для температуры окружающей среды двадцать градусов.\n"
+                 "4 Обслуживание\nПротирайте корпус сухой тканью раз в месяц."]
+        chapters = list(iter_chapters_from_pages(pages))
+        self.assertEqual(len(chapters), 2)
+        self.assertIn("2 Ток 500 мА", chapters[0])
+        self.assertTrue(chapters[1].startswith("4 Обслуживание"))
+
+    def test_classify_line(self):
+        self.assertEqual(classify_line("1.2 Установка"), "heading")
+        self.assertEqual(classify_line("4 Обслуживание"), "weak_heading")
+        self.assertEqual(classify_line("Телефон поддержки 8-800-123-45-67"), "junk")
+        self.assertIsNone(classify_line("Подключите кабель питания к устройству."))
+
+    def test_chunk_size_is_deprecated_alias(self):
+        chapter = "\n".join(f"Строка {i}: подключите кабель питания к порту устройства." for i in range(40))
+        words = lambda text: len(text.split())
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            chunks = split_chapter_into_chunks(chapter, chunk_size=20, count_tokens=words)
+            big = split_chapter_into_chunks(chapter, chunk_size=10_000, count_tokens=words)
+        self.assertEqual([w.category for w in caught], [DeprecationWarning] * 2)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(words(chunk) <= 40 for chunk in chunks))
+        # Огромный chunk_size не выводит чанк за окно модели
+        self.assertEqual(big, split_chapter_into_chunks(chapter, count_tokens=words))
+
 # УДАЛИЛИ тесты extract_chapters_from_pdf и process_pdf_to_chunks
 # (они требуют реального PDF или mock-объектов)
 
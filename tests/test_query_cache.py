@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from src.query_cache import LRUCache, normalize_query
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Как   настроить VLAN? "), "как настроить vlan")
+        self.assertEqual(normalize_query("«Ёмкость батареи»"), "емкость батареи")
+
+    def test_lru_eviction_and_counters(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)   # "a" становится самым свежим
+        cache.put("c", 3)                     # вытесняется "b"
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (1, 1, 1))
+        self.assertEqual(len(cache), 2)
+
+    def test_memory_bound(self):
+        cache = LRUCache(max_entries=100, max_bytes=3 * 400)
+        for i in range(5):
+            cache.put(i, np.zeros(100, dtype="float32"))
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.stats()["bytes"], 1200)
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(ttl=0.01)
+        cache.put("q", "ответ")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("q"))
+
+    def test_save_and_load(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.pkl")
+        cache = LRUCache()
+        cache.put("как настроить vlan", np.ones(4, dtype="float32"))
+        cache.save(path)
+        restored = LRUCache()
+        restored.load(path)
+        np.testing.assert_array_equal(restored.get("как настроить vlan"), np.ones(4, dtype="float32"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,21 @@
 import os
 import unittest
 import tempfile
+from unittest import mock
 from src.rag_engine import RAGEngine
+from src.reranker import Reranker
+from src.segment_store import SegmentStore
+
+SHARED_CHUNK = "Перед началом работы отключите устройство от сети питания."
+
+
+def fake_records(documents):
+    """Подменяет извлечение PDF: имя файла → [(чанк, страница, глава, заголовок)]."""
+    def records(paths, *args):
+        for path in paths:
+            for chunk, page, chapter_no, title in documents[os.path.basename(path)]:
+                yield path, chunk, page, chapter_no, title
+    return mock.patch("src.pdf_loader.iter_pdf_chunk_records", records)
 
 
 class TestRAGEngine(unittest.TestCase):
@@ -25,6 +39,29 @@ class TestRAGEngine(unittest.TestCase):
         self.assertEqual(len(self.engine.chunks), 2)
         self.assertGreater(self.engine.index.ntotal, 0)
 
+    def test_add_chunk_stream(self):
+        """Потоковая индексация пачками через ограниченную очередь."""
+        chunks = (f"Потоковый фрагмент номер {i} с достаточной длиной текста." for i in range(25))
+        report = self.engine.add_chunk_stream(chunks, batch_size=4, max_queued_batches=2)
+        self.assertEqual(report["added"], 25)
+        self.assertEqual(self.engine.index.ntotal, 25)
+
+    def test_duplicate_chunks_are_not_reindexed(self):
+        """Повтор текста не кодируется заново, а привязывается к исходному чанку."""
+        text = "Перед началом работы прочитайте руководство по эксплуатации."
+        report = self.engine.add_chunks([text, text.upper()], sources=["a.pdf", "b.pdf"])
+        self.assertEqual(report, {"added": 1, "exact_duplicates": 1, "near_duplicates": 0})
+        report = self.engine.add_chunks([text], sources=["c.pdf"])
+        self.assertEqual(report["added"], 0)
+        self.assertEqual(self.engine.index.ntotal, 1)
+        self.assertEqual(self.engine.duplicate_sources[0], ["b.pdf", "c.pdf"])
+
+        self.engine.save_index(self.temp_dir)
+        new_engine = RAGEngine()
+        new_engine.load_index(self.temp_dir)
+        self.assertEqual(new_engine.duplicate_sources[0], ["b.pdf", "c.pdf"])
+        self.assertEqual(new_engine.add_chunks([text])["exact_duplicates"], 1)
+
     def test_save_and_load_index(self):
         """Проверка сохранения и загрузки индекса."""
         chunks = ["Фрагмент для сохранения с длиной более тридцати символов."]
@@ -36,6 +73,19 @@ class TestRAGEngine(unittest.TestCase):
         self.assertEqual(len(new_engine.chunks), 1)
         self.assertEqual(new_engine.chunks[0], "Фрагмент для сохранения с длиной более тридцати символов.")
 
+    def test_incremental_save(self):
+        """Повторное сохранение дописывает сегмент, а загрузка собирает все сегменты."""
+        self.engine.add_chunks(["Первый фрагмент для сегментного хранилища индекса."])
+        self.engine.save_index(self.temp_dir)
+        self.engine.add_chunks(["Второй фрагмент для сегментного хранилища индекса."])
+        self.engine.save_index(self.temp_dir)
+        self.assertTrue(any(f.startswith("seg_") for f in os.listdir(self.temp_dir)))
+
+        new_engine = RAGEngine()
+        new_engine.load_index(self.temp_dir)
+        self.assertEqual(new_engine.chunks, self.engine.chunks)
+        self.assertEqual(new_engine.index.ntotal, 2)
+
     def test_ask_returns_relevant_chunk(self):
         """Проверка поиска по запросу."""
         chunks = [
@@ -46,6 +96,348 @@ class TestRAGEngine(unittest.TestCase):
         answer, context = self.engine.ask("Как подключить питание?")
         self.assertIn("DC-IN", answer)
 
+    def test_lexical_and_hybrid_modes(self):
+        """Точные токены находятся лексическим и гибридным поиском."""
+        chunks = [
+            "Коммутатор C1212-1002 поддерживает стандарт IEEE802.3ab.",
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database."
+        ]
+        self.engine.add_chunks(chunks)
+        for mode in ("lexical", "hybrid"):
+            with self.subTest(mode=mode):
+                _, context = self.engine.ask("C1212-1002", mode=mode)
+                self.assertIn("C1212-1002", context)
+        with self.assertRaises(ValueError):
+            self.engine.ask("C1212-1002", mode="fuzzy")
+
+    def test_mark_fragment_as_bad(self):
+        """Отмеченный фрагмент штрафуется, после порога исключается из поиска и это сохраняется."""
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Питание подключается через разъём DC-IN, звоните 8-800-000-00-00.",
+            "Настройка VLAN: введите команду vlan database.",
+        ]
+        engine = RAGEngine(bad_feedback_exclude_after=2)
+        engine.add_chunks(chunks)
+        engine.save_index(self.temp_dir)
+        self.assertEqual(engine.mark_fragment_as_bad("звоните 8-800-000-00-00"), [1])
+        self.assertEqual(engine.mark_fragment_as_bad("такого текста нет в инструкциях"), [])
+        _, ids = engine.search_many(["разъём DC-IN"], k=3, mode="lexical")
+        self.assertEqual(ids[0][1], 1)
+
+        self.assertEqual(engine.mark_fragment_as_bad(chunks[1]), [1])
+        for mode in ("dense", "lexical", "hybrid"):
+            with self.subTest(mode=mode):
+                _, ids = engine.search_many(["разъём DC-IN"], k=3, mode=mode)
+                self.assertNotIn(1, ids[0])
+
+        new_engine = RAGEngine(bad_feedback_exclude_after=2)
+        new_engine.load_index(self.temp_dir)
+        self.assertEqual(new_engine.negative_feedback, {1: 2})
+
+        # Следующая отметка дописывает в хранилище только изменённый счётчик
+        written = []
+        save = SegmentStore.save_negative_feedback
+
+        def record(store, counts, replace=False):
+            written.append((dict(counts), replace))
+            save(store, counts, replace)
+
+        with mock.patch.object(SegmentStore, "save_negative_feedback", record):
+            self.assertEqual(new_engine.mark_fragment_as_bad(chunks[2]), [2])
+        self.assertEqual(written, [({format(new_engine.dedup.digests[2], "016x"): 1}, False)])
+        self.assertEqual(sorted(SegmentStore(self.temp_dir).load_negative_feedback().values()), [1, 2])
+        _, ids = new_engine.search_many(["разъём DC-IN"], k=3, mode="dense")
+        self.assertNotIn(1, ids[0])
+
+    def test_ask_many(self):
+        """Пакетный поиск возвращает ответы в порядке запросов."""
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database."
+        ]
+        self.engine.add_chunks(chunks)
+        answers = self.engine.ask_many(["Как подключить питание?", "Как настроить VLAN?"])
+        self.assertEqual(len(answers), 2)
+        self.assertIn("DC-IN", answers[0][0])
+        self.assertIn("vlan database", answers[1][1])
+        self.assertEqual(self.engine.ask_many([]), [])
+
+    def test_rerank_reorders_candidates(self):
+        """Второй этап переупорядочивает кандидатов одной пачкой, повтор вопроса — из кэша."""
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database.",
+            "Сброс настроек: удерживайте кнопку RESET десять секунд.",
+        ]
+        self.engine.add_chunks(chunks)
+        self.assertEqual(self.engine.retrieve(["RESET"], k=1, mode="lexical")[0][0]["reranked"], False)
+        with self.assertRaises(ValueError):
+            self.engine.retrieve(["RESET"], rerank=True)
+
+        calls = []
+
+        def predict(pairs, **kwargs):
+            calls.append(len(pairs))
+            # Выше всех — чанк про VLAN, какой бы ни была выдача первого этапа
+            return [float("VLAN" in text) for _, text in pairs]
+
+        self.engine.reranker = Reranker(model=mock.Mock(predict=predict), budget_ms=None)
+        hits = self.engine.retrieve(["Как подключить питание?"], k=2)[0]
+        self.assertEqual(calls, [3])
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(hits[0]["id"], 1)
+        self.assertTrue(hits[0]["reranked"])
+        self.assertEqual((hits[0]["score"], hits[1]["score"]), (1.0, 0.0))
+        self.assertIn("retrieval_score", hits[1])
+        self.assertIn("vlan database", self.engine.ask("как подключить питание")[1])
+        self.assertEqual(calls, [3])
+        self.assertEqual(self.engine.cache_stats()["rerank"]["pairs_scored"], 3)
+
+    def test_bad_mark_lowers_negative_rerank_score(self):
+        """Отметка «неверно» опускает чанк и тогда, когда логит cross-encoder отрицательный."""
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database.",
+            "Сброс настроек: удерживайте кнопку RESET десять секунд.",
+        ]
+        engine = RAGEngine(reranker_model=None, bad_feedback_exclude_after=5, bad_feedback_penalty=0.5)
+        engine.add_chunks(chunks)
+        logits = {0: -1.0, 1: -1.2, 2: -3.0}
+        predict = lambda pairs, **kwargs: [logits[chunks.index(text)] for _, text in pairs]
+        engine.reranker = Reranker(model=mock.Mock(predict=predict), budget_ms=None)
+        self.assertEqual(engine.retrieve(["питание"], k=3)[0][0]["id"], 0)
+        self.assertEqual(engine.mark_fragment_as_bad(chunks[0]), [0])
+        hits = engine.retrieve(["питание"], k=3)[0]
+        self.assertEqual([hit["id"] for hit in hits], [1, 0, 2])
+        self.assertEqual(hits[1]["score"], -2.0)
+
+    def test_translation_of_foreign_chunks(self):
+        """Иностранный чанк в ответе переводится, контекст остаётся оригиналом."""
+        chunks = [
+            "Connect the power cable to the DC-IN port on the rear panel.",
+            "Настройка VLAN: введите команду vlan database.",
+        ]
+        calls = []
+
+        def translate_batch(sentences):
+            calls.append(len(sentences))
+            return ["Подключите кабель питания к разъёму DC-IN на задней панели."]
+
+        with self.assertRaises(ValueError):
+            RAGEngine(translation="always")
+        for mode in ("query", "ingest"):
+            with self.subTest(mode=mode):
+                calls.clear()
+                engine = RAGEngine(translation=mode)
+                engine.translator.backends["en"] = mock.Mock(translate_batch=translate_batch)
+                engine.add_chunks(chunks)
+                self.assertEqual(calls, [1] if mode == "ingest" else [])
+                answer, context = engine.ask("DC-IN", mode="lexical")
+                self.assertIn("Подключите кабель", answer)
+                self.assertEqual(context, chunks[0])
+                hit = engine.retrieve(["VLAN"], k=1, mode="lexical")[0][0]
+                self.assertEqual(hit["translation"], chunks[1])
+                engine.ask("DC-IN rear panel", mode="lexical")
+                self.assertEqual(calls, [1])
+
+    def test_translation_failure_falls_back_to_original(self):
+        """Без пакета Argos индексация проходит, а ответы и retrieve отдают оригинал."""
+        chunk = "Connect the power cable to the DC-IN port on the rear panel."
+        engine = RAGEngine(translation="ingest")
+        engine.translator.translate = mock.Mock(side_effect=ImportError("argostranslate"))
+        self.assertEqual(engine.add_chunks([chunk])["added"], 1)
+        self.assertEqual(engine.ntotal, 1)
+        hit = engine.retrieve(["DC-IN"], k=1, mode="lexical")[0][0]
+        self.assertEqual(hit["translation"], chunk)
+        self.assertIn("DC-IN port", engine.ask("DC-IN", mode="lexical")[0])
+        self.assertEqual(engine.translator.translate.call_count, 3)
+
+    def test_query_cache_hits_and_invalidation(self):
+        """Повторный вопрос берётся из кэша, добавление чанков сбрасывает результаты."""
+        self.engine.add_chunks(["Инструкция по подключению питания: используйте разъём DC-IN."])
+        self.engine.ask("Как подключить питание?")
+        self.engine.ask("  как подключить питание ")
+        stats = self.engine.cache_stats()
+        self.assertEqual(stats["results"]["hits"], 1)
+        self.assertEqual(stats["embeddings"]["misses"], 1)
+
+        self.engine.add_chunks(["Настройка VLAN: введите команду vlan database."])
+        self.assertEqual(len(self.engine.result_cache), 0)
+        self.engine.ask("Как подключить питание?")
+        self.assertEqual(self.engine.cache_stats()["embeddings"]["hits"], 1)
+
+    def test_query_caches_respect_byte_budget(self):
+        """Кэши запросов держатся в cache_max_bytes, а не только в числе записей."""
+        budget = 100
+        engine = RAGEngine(cache_max_bytes=budget)
+        engine.add_chunks(["Инструкция по подключению питания: используйте разъём DC-IN.",
+                           "Настройка VLAN: введите команду vlan database."])
+        engine.search_many([f"вопрос номер {i}" for i in range(10)], k=2, mode="dense")
+        stats = engine.cache_stats()
+        for name in ("embeddings", "results"):
+            with self.subTest(cache=name):
+                self.assertLessEqual(stats[name]["bytes"], budget)
+                self.assertLess(stats[name]["entries"], 10)
+
+    def test_chunk_cache_skips_model_on_reindex(self):
+        """Повторная индексация тех же чанков берёт векторы из постоянного кэша."""
+        cache_path = os.path.join(self.temp_dir, "embeddings.sqlite")
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database.",
+        ]
+        first = RAGEngine(chunk_cache_path=cache_path)
+        first.add_chunks(chunks)
+
+        second = RAGEngine(chunk_cache_path=cache_path)
+        second.model.encode = lambda *args, **kwargs: self.fail("модель не должна вызываться")
+        second.add_chunks(chunks)
+        self.assertEqual(second.index.ntotal, 2)
+        self.assertEqual(second.cache_stats()["chunks"]["hits"], 2)
+        self.assertTrue((second.index.reconstruct_n(0, 2) == first.index.reconstruct_n(0, 2)).all())
+
+        # Вектор чанка удалённого документа не держится в кэше до компакции
+        del second.model.encode
+        with fake_records({"reset.pdf": [("Сброс настроек: удерживайте кнопку RESET десять секунд.", 1, 1, "1")]}):
+            self.assertTrue(second.add_document(self._write_pdf("reset.pdf", "v1"), folder=None))
+        self.assertEqual(second.remove_document("reset.pdf", folder=None), 1)
+        self.assertEqual(second.prune_chunk_cache(), 1)
+        second.chunks = second.chunks[:1]
+        self.assertEqual(second.prune_chunk_cache(), 1)
+
+    def test_cold_start_uses_warm_snapshot(self):
+        """Загрузка не грузит модель; второй старт читает тёплый снимок, устаревший снимок игнорируется."""
+        chunks = [
+            "Инструкция по подключению питания: используйте разъём DC-IN.",
+            "Настройка VLAN: введите команду vlan database.",
+        ]
+        self.engine.add_chunks(chunks)
+        self.engine.save_index(self.temp_dir)
+
+        first = RAGEngine()
+        first.load_index(self.temp_dir)
+        self.assertEqual(first.load_stats["source"], "segments")
+        self.assertFalse(first.model.loaded)
+        second = RAGEngine()
+        second.load_index(self.temp_dir)
+        self.assertEqual(second.load_stats["source"], "snapshot")
+        self.assertFalse(second.model.loaded)
+        self.assertEqual(list(second.chunks), chunks)
+        self.assertEqual(second.ask("Как настроить VLAN?"), first.ask("Как настроить VLAN?"))
+
+        self.engine.add_chunks(["Сброс к заводским настройкам: удерживайте кнопку Reset 10 секунд."])
+        self.engine.save_index(self.temp_dir)
+        third = RAGEngine()
+        third.load_index(self.temp_dir)
+        self.assertEqual(third.load_stats["source"], "segments")
+        self.assertEqual(third.ntotal, 3)
+
+    def test_warm_snapshot_maps_ivf_index(self):
+        """IVF из снимка открыт через mmap только на чтение и перечитывается перед добавлением."""
+        config = {"auto_thresholds": {"ivf_flat": 40}, "min_train_size": 40, "nlist": 4}
+        engine = RAGEngine(index_config=config)
+        engine.add_chunks([f"Раздел {i}: параметр P{i} задаётся командой set p{i}." for i in range(48)])
+        self.assertEqual(engine.index_backend, "ivf_flat")
+        engine.save_index(self.temp_dir)
+        engine.add_chunks(["Сброс к заводским настройкам: удерживайте кнопку Reset 10 секунд."])
+        engine.save_index(self.temp_dir)
+
+        RAGEngine(index_config=config).load_index(self.temp_dir)
+        warm = RAGEngine(index_config=config)
+        warm.load_index(self.temp_dir)
+        self.assertEqual(warm.load_stats["source"], "snapshot")
+        self.assertTrue(warm._readonly_index_path.startswith(os.path.join(self.temp_dir, "warm.snapshot.index.")))
+        warm.add_chunks(["Настройка VLAN: введите команду vlan database."])
+        self.assertIsNone(warm._readonly_index_path)
+        self.assertEqual(warm.ntotal, 50)
+        self.assertIn("vlan database", warm.ask("Как настроить VLAN?")[1])
+
+    def test_empty_engine_does_not_load_model(self):
+        engine = RAGEngine()
+        self.assertEqual(engine.ntotal, 0)
+        self.assertEqual(engine.ask("Как настроить VLAN?")[0], "Сначала загрузите инструкции.")
+        self.assertFalse(engine.model.loaded)
+
+    def _write_pdf(self, name, version):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{name} {version}")
+        return path
+
+    def test_remove_and_replace_document(self):
+        """Документ удаляется и заменяется без перестроения, источник виден в ответе."""
+        folder = os.path.join(self.temp_dir, "index")
+        documents = {
+            "router.pdf": [("Подключение питания: используйте разъём DC-IN на задней панели.", 3, 1, "1.1 Питание"),
+                           (SHARED_CHUNK, 4, 1, "1.1 Питание")],
+            "switch.pdf": [("Настройка VLAN: введите команду vlan database.", 7, 2, "2.3 Сеть"),
+                           (SHARED_CHUNK, 1, 1, "1 Безопасность")],
+        }
+        with fake_records(documents):
+            self.assertTrue(self.engine.add_document(self._write_pdf("router.pdf", "v1"), folder=folder))
+            self.assertTrue(self.engine.add_document(self._write_pdf("switch.pdf", "v1"), folder=folder))
+        answer, _ = self.engine.ask("Как подключить питание DC-IN?")
+        self.assertIn("Источник: router.pdf, стр. 3, раздел «1.1 Питание»", answer)
+        hit = self.engine.retrieve(["разъём DC-IN"], k=1, mode="lexical")[0][0]
+        self.assertEqual((hit["document"], hit["page"]), ("router.pdf", 3))
+
+        self.assertEqual(self.engine.remove_document("router.pdf", folder=folder), 1)
+        self.assertEqual(self.engine.get_loaded_documents(), ["switch.pdf"])
+        self.assertEqual(self.engine.source_of(1)["document"], "switch.pdf")
+        for mode in ("dense", "lexical", "hybrid"):
+            with self.subTest(mode=mode):
+                _, ids = self.engine.search_many(["разъём DC-IN"], k=3, mode=mode)
+                self.assertNotIn(0, ids[0])
+
+        reloaded = RAGEngine()
+        reloaded.load_index(folder)
+        self.assertEqual(reloaded.get_loaded_documents(), ["switch.pdf"])
+        _, ids = reloaded.search_many(["разъём DC-IN"], k=3, mode="lexical")
+        self.assertNotIn(0, ids[0])
+        self.assertEqual(reloaded.source_of(1)["document"], "switch.pdf")
+
+        documents["switch.pdf"] = [("Настройка VLAN: выполните vlan database и сохраните конфигурацию.", 8, 1, "2 Сеть")]
+        with fake_records(documents):
+            self.assertTrue(reloaded.replace_document(self._write_pdf("switch.pdf", "v2"), folder=folder))
+        hits = reloaded.retrieve(["vlan database"], k=5, mode="lexical")[0]
+        self.assertEqual([(h["document"], h["page"]) for h in hits], [("switch.pdf", 8)])
+
+        # Компакция вычищает удалённые чанки из файлов, id живых не меняются
+        self.assertTrue(reloaded.compact_index(folder))
+        compacted = RAGEngine()
+        compacted.load_index(folder)
+        self.assertEqual(compacted.index.ntotal, 1)
+        self.assertEqual(compacted.chunks[0], "")
+        # Надгробия вычищенных документов больше не входят в фильтр поиска
+        self.assertEqual(len(compacted._removed_ids), 0)
+        self.assertEqual(compacted._next_doc_id, reloaded._next_doc_id)
+        self.assertEqual(compacted.ask("vlan database")[1], reloaded.ask("vlan database")[1])
+
+    def test_failed_document_leaves_no_orphans(self):
+        """Сбой посреди PDF убирает уже проиндексированные пачки, следующий документ их не наследует."""
+        folder = os.path.join(self.temp_dir, "index")
+        broken = [(f"Раздел {i}: порт {i} коммутатора настраивается командой interface {i}.", 1, 1, "1")
+                  for i in range(300)]
+
+        def records(paths, *args):
+            path = paths[0]
+            if os.path.basename(path) == "broken.pdf":
+                for chunk, page, chapter_no, title in broken:
+                    yield path, chunk, page, chapter_no, title
+                raise ValueError("Повреждённая страница 301")
+            yield path, "Сброс настроек: удерживайте кнопку RESET десять секунд.", 1, 1, "1"
+
+        with mock.patch("src.pdf_loader.iter_pdf_chunk_records", records):
+            with self.assertRaises(ValueError):
+                self.engine.add_document(self._write_pdf("broken.pdf", "v1"), folder=folder)
+            self.assertEqual(self.engine.get_loaded_documents(), [])
+            self.assertTrue(self.engine.add_document(self._write_pdf("good.pdf", "v1"), folder=folder))
+        _, ids = self.engine.search_many(["interface 7"], k=3, mode="lexical")
+        self.assertFalse((ids[0] >= 0).any())
+        self.assertEqual(self.engine.remove_document("good.pdf", folder=folder), 1)
+
     def test_compute_pdf_hash(self):
         """Проверка вычисления хеша (без PDF!)."""
         file1 = os.path.join(self.temp_dir, "file1.txt")
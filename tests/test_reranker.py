@@ -0,0 +1,80 @@
+import threading
+import unittest
+import numpy as np
+from src.reranker import Reranker
+
+
+class OverlapModel:
+    """«Cross-encoder»: доля слов запроса, встречающихся в чанке."""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=None):
+        self.calls.append(len(pairs))
+        if self.delay:
+            self.started.set()
+            self.release.wait(self.delay)
+        return np.array([
+            len(set(q.lower().split()) & set(t.lower().split())) / len(q.split()) for q, t in pairs
+        ])
+
+
+CANDIDATES = ["питание от сети 220 В", "настройка vlan на порту", "сброс к заводским настройкам", "vlan"]
+
+
+class TestReranker(unittest.TestCase):
+
+    def test_scores_all_pairs_in_one_batch(self):
+        model = OverlapModel()
+        reranker = Reranker(model=model, budget_ms=None)
+        scores = reranker.rerank(["настройка vlan", "сброс настройкам"], [CANDIDATES, CANDIDATES[:2]])
+        self.assertEqual(model.calls, [6])
+        self.assertEqual(int(np.argmax(scores[0])), 1)
+        self.assertEqual(len(scores[1]), 2)
+
+    def test_repeat_question_is_served_from_cache(self):
+        model = OverlapModel()
+        reranker = Reranker(model=model, budget_ms=None)
+        first = reranker.rerank(["Настройка VLAN?"], [CANDIDATES])
+        second = reranker.rerank(["настройка vlan"], [CANDIDATES])
+        self.assertEqual(model.calls, [4])
+        np.testing.assert_allclose(first[0], second[0])
+        # Новый кандидат — оценивается только он
+        reranker.rerank(["настройка vlan"], [CANDIDATES + ["vlan 10 на порту 3"]])
+        self.assertEqual(model.calls, [4, 1])
+
+    def test_budget_truncates_or_skips(self):
+        model = OverlapModel()
+        reranker = Reranker(model=model, budget_ms=10.0, min_depth=2)
+        reranker._pair_seconds = 0.004
+        # В 10 мс помещаются две новые пары — переранжируется начало выдачи
+        scores = reranker.rerank(["настройка vlan"], [CANDIDATES])
+        self.assertEqual(len(scores[0]), 2)
+        self.assertEqual(reranker.stats["truncated"], 1)
+        # На четыре запроса не хватает и двух пар каждому — этап пропускается
+        reranker._pair_seconds = 0.004
+        queries = ["питание", "порт", "сброс", "заводские"]
+        self.assertIsNone(reranker.rerank(queries, [CANDIDATES] * 4))
+        self.assertEqual(reranker.stats["skipped_budget"], 1)
+        # Оценённые пары бюджета не тратят
+        self.assertEqual(len(reranker.rerank(["настройка vlan"], [CANDIDATES[:2]])[0]), 2)
+
+    def test_skips_when_model_is_busy(self):
+        model = OverlapModel(delay=5.0)
+        reranker = Reranker(model=model, budget_ms=None)
+        worker = threading.Thread(target=reranker.rerank, args=(["vlan"], [CANDIDATES]))
+        worker.start()
+        model.started.wait(5.0)
+        self.assertIsNone(reranker.rerank(["сброс"], [CANDIDATES]))
+        model.release.set()
+        worker.join()
+        self.assertEqual(reranker.stats["skipped_busy"], 1)
+        self.assertIsNotNone(reranker.rerank(["vlan"], [CANDIDATES]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import faiss
+import numpy as np
+from src.chunk_store import CHUNK_META_DTYPE
+from src.index_backends import add_vectors, index_ids, make_index_config
+from src.segment_store import SegmentStore, migrate_legacy_index
+
+DIM = 16
+META = {"backend": "flat", "config": {}, "dim": DIM}
+
+
+def vectors(n, seed):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+
+
+def chunks(prefix, n):
+    return [f"{prefix} фрагмент {i}" for i in range(n)]
+
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = SegmentStore(self.folder)
+        base_index = faiss.IndexFlatIP(DIM)
+        base_index.add(vectors(5, 0))
+        self.store.write_base(base_index, chunks("база", 5), META, [{"filename": "a.pdf"}])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_append_and_load(self):
+        """Сохранение дописывает сегмент, не переписывая базу."""
+        base_mtime = os.path.getmtime(os.path.join(self.folder, "base_000001.faiss"))
+        self.store.append_segment(vectors(3, 1), chunks("сегмент", 3), META, [{"filename": "b.pdf"}])
+        self.assertEqual(os.path.getmtime(os.path.join(self.folder, "base_000001.faiss")), base_mtime)
+
+        manifest = self.store.read_manifest()
+        self.assertEqual(self.store.total_count(manifest), 8)
+        index, segment_vectors, loaded_chunks = self.store.load(manifest)
+        self.assertEqual(index.ntotal, 5)
+        self.assertEqual(sum(len(v) for v in segment_vectors), 3)
+        self.assertEqual(list(loaded_chunks), chunks("база", 5) + chunks("сегмент", 3))
+        self.assertEqual([d["filename"] for d in self.store.documents(manifest)], ["a.pdf", "b.pdf"])
+
+    def test_compaction_merges_segments(self):
+        self.store.append_segment(vectors(3, 1), chunks("с1", 3), META, [])
+        self.store.append_segment(vectors(2, 2), chunks("с2", 2), META, [])
+        self.assertTrue(self.store.compact(DIM, make_index_config()))
+
+        manifest = self.store.read_manifest()
+        self.assertEqual(manifest["segments"], [])
+        index, segment_vectors, loaded_chunks = self.store.load(manifest)
+        self.assertEqual(index.ntotal, 10)
+        self.assertEqual(len(loaded_chunks), 10)
+        leftovers = [f for f in os.listdir(self.folder) if f.startswith("seg_") or f.startswith("base_000001")]
+        self.assertEqual(leftovers, [])
+
+    def test_removed_documents_are_dropped_by_compaction(self):
+        """Удалённый документ скрыт сразу, а компакция убирает его векторы, сохраняя id остальных."""
+        meta = np.zeros(3, dtype=CHUNK_META_DTYPE)
+        meta["doc"] = [7, 8, 7]
+        self.store.append_segment(vectors(3, 1), chunks("с", 3), META,
+                                  [{"doc_id": 7, "filename": "b.pdf"}, {"doc_id": 8, "filename": "c.pdf"}],
+                                  {"meta": meta})
+        self.store.remove_documents([7], owners={7: 8})
+        manifest = self.store.read_manifest()
+        self.assertEqual([d["filename"] for d in self.store.documents(manifest)], ["a.pdf", "c.pdf"])
+        self.assertEqual(list(self.store.load_extras(manifest)["meta"]["doc"]), [0] * 5 + [7, 8, 8])
+
+        self.assertTrue(self.store.compact(DIM, make_index_config()))
+        manifest = self.store.read_manifest()
+        self.assertNotIn("chunk_owners", manifest)
+        # Вычищенный документ снимается с учёта удалённых, его id не переиспользуется
+        self.assertEqual((manifest["removed_documents"], manifest["next_document"]), ([], 8))
+        self.assertEqual(list(self.store.load_meta(manifest)["doc"][5:]), [0, 8, 8])
+        index, _, loaded_chunks = self.store.load(manifest)
+        self.assertEqual(list(index_ids(index)), [0, 1, 2, 3, 4, 6, 7])
+        self.assertEqual(loaded_chunks[5], "")
+        self.assertEqual(loaded_chunks[7], "с фрагмент 2")
+
+        self.store.append_segment(vectors(1, 4), chunks("новый", 1), META, [])
+        index, segment_vectors, loaded_chunks = self.store.load(self.store.read_manifest())
+        add_vectors(index, segment_vectors[0], 8)
+        self.assertEqual(index.search(segment_vectors[0], 1)[1][0][0], 8)
+
+    def test_partial_write_is_ignored(self):
+        """Недописанный сегмент без записи в манифесте не виден и удаляется при компакции."""
+        with open(os.path.join(self.folder, "seg_000009.npy.tmp"), "wb") as f:
+            f.write(b"oops")
+        manifest = self.store.read_manifest()
+        self.assertEqual(self.store.total_count(manifest), 5)
+        self.store.append_segment(vectors(1, 3), chunks("с", 1), META, [])
+        self.store.compact(DIM, make_index_config())
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "seg_000009.npy.tmp")))
+
+    def test_migrate_legacy_index(self):
+        """faiss_index.bin + chunks.json переводятся в сегментное хранилище."""
+        legacy = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, legacy, True)
+        index = faiss.IndexFlatIP(DIM)
+        index.add(vectors(2, 5))
+        faiss.write_index(index, os.path.join(legacy, "faiss_index.bin"))
+        with open(os.path.join(legacy, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(["старый чанк 1", "старый чанк 2"], f, ensure_ascii=False, indent=2)
+
+        self.assertTrue(migrate_legacy_index(legacy))
+        self.assertFalse(migrate_legacy_index(legacy))
+        store = SegmentStore(legacy)
+        manifest = store.read_manifest()
+        self.assertEqual(manifest["meta"]["backend"], "flat")
+        loaded_index, _, loaded_chunks = store.load(manifest)
+        self.assertEqual(loaded_index.ntotal, 2)
+        self.assertEqual(list(loaded_chunks), ["старый чанк 1", "старый чанк 2"])
+
+    def test_negative_feedback_updates_only_given_digests(self):
+        """Отметка пишет только свои хеши, файл прежних версий переносится в базу."""
+        with open(os.path.join(self.folder, "negative_feedback.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "chunks": {"aa": 1, "bb": 2}}, f)
+        self.assertEqual(self.store.load_negative_feedback(), {"aa": 1, "bb": 2})
+
+        self.store.save_negative_feedback({"aa": 2, "cc": 1})
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "negative_feedback.json")))
+        self.assertEqual(self.store.load_negative_feedback(), {"aa": 2, "bb": 2, "cc": 1})
+        self.store.save_negative_feedback({"bb": 0})
+        self.assertEqual(self.store.load_negative_feedback(), {"aa": 2, "cc": 1})
+        self.store.save_negative_feedback({"dd": 3}, replace=True)
+        self.assertEqual(self.store.load_negative_feedback(), {"dd": 3})
+
+    def test_append_requires_matching_sizes(self):
+        with self.assertRaises(ValueError):
+            self.store.append_segment(vectors(2, 1), chunks("с", 3), META, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
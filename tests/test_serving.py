@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+from src.rag_engine import RAGEngine
+from src.serving import IngestQueue, Overloaded, QueryPool, ReadWriteLock
+
+
+def fake_chunks(paths):
+    for path in paths:
+        for i in range(40):
+            yield path, f"Документ {path}, раздел {i}: настройка порта {i} на коммутаторе доступа."
+
+
+class TestServing(unittest.TestCase):
+
+    def test_rw_lock_excludes_writer(self):
+        lock = ReadWriteLock()
+        events = []
+
+        def reader():
+            with lock.read():
+                events.append("read-start")
+                time.sleep(0.05)
+                events.append("read-end")
+
+        def writer():
+            with lock.write():
+                events.append("write")
+
+        readers = [threading.Thread(target=reader) for _ in range(3)]
+        for t in readers:
+            t.start()
+        time.sleep(0.01)
+        w = threading.Thread(target=writer)
+        w.start()
+        for t in readers + [w]:
+            t.join()
+        self.assertEqual(events[-1], "write")
+        self.assertEqual(events.count("read-end"), 3)
+
+    def test_query_pool_rejects_when_full(self):
+        release = threading.Event()
+        pool = QueryPool(lambda x: release.wait() and x, max_workers=1, max_queued=1)
+        first, second = pool.submit(1), pool.submit(2)
+        with self.assertRaises(Overloaded):
+            pool.submit(3)
+        self.assertEqual(pool.stats(), {"running": 1, "queued": 1, "capacity": 2})
+        release.set()
+        self.assertEqual((first.result(1), second.result(1)), (1, 2))
+        self.assertEqual(pool.run(4, timeout=1), 4)
+        pool.close()
+
+    def test_ingest_job_while_answering(self):
+        """Вопросы обслуживаются во время фоновой индексации, прогресс доступен по id задания."""
+        engine = RAGEngine()
+        engine.add_chunks(["Инструкция по подключению питания: используйте разъём DC-IN."])
+        jobs = IngestQueue(engine, save_folder=None, chunk_source=fake_chunks)
+        job = jobs.submit(["a.pdf", "b.pdf"])
+        answers = []
+        while not job.done.is_set():
+            answers.append(engine.ask("Как подключить питание?")[1])
+        status = jobs.wait(job.id, timeout=10)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual((status["files_done"], status["files_total"]), (2, 2))
+        self.assertEqual(status["added"], 80)
+        self.assertEqual(engine.index.ntotal, 81)
+        self.assertTrue(all(answers))
+
+    def test_failed_job_reports_error(self):
+        def broken(paths):
+            yield paths[0], "Чанк перед ошибкой с достаточной длиной текста."
+            raise OSError("файл повреждён")
+
+        jobs = IngestQueue(RAGEngine(), save_folder=None, chunk_source=broken)
+        status = jobs.wait(jobs.submit(["bad.pdf"]).id, timeout=10)
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("повреждён", status["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from src.rag_engine import RAGEngine
+from src.sharding import Shard, ShardedIndex, partition_ranges
+from tests.test_rag_engine import fake_records
+
+
+def random_vectors(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def chunk_texts(start, end):
+    return [f"Раздел {i}: настройка порта {i} коммутатора, код ошибки E{i:04d}." for i in range(start, end)]
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.temp_dir, "index")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_partition_ranges(self):
+        self.assertEqual(partition_ranges(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(partition_ranges(2, 4), [(0, 1), (1, 2)])
+        # Граница сдвигается к ближайшей смене документа; чанки без документа режутся где угодно
+        docs = np.array([1, 1, 1, 1, 2, 2, 2, 3, 3, 3])
+        self.assertEqual(partition_ranges(10, 3, docs), [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(partition_ranges(6, 2, np.array([5] * 6)), [(0, 6)])
+        self.assertEqual(partition_ranges(10, 3, np.zeros(10)), partition_ranges(10, 3))
+
+    def test_scatter_gather_matches_single_index(self):
+        """Слияние top-k из процессов шардов совпадает с поиском по одному flat-индексу."""
+        vectors = random_vectors(600)
+        flat = faiss.IndexFlatIP(vectors.shape[1])
+        flat.add(vectors)
+        expected_scores, expected_ids = flat.search(vectors[:10], 5)
+
+        with ShardedIndex(self.temp_dir, processes=True) as sharded:
+            for start, end in partition_ranges(len(vectors), 3):
+                sharded.add_shard(vectors[start:end], chunk_texts(start, end), np.arange(start, end))
+            self.assertEqual(sharded.ntotal, 600)
+            scores, ids = sharded.search(vectors[:10], 5)
+            np.testing.assert_array_equal(ids, expected_ids)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+            # Исключения хранятся в шардах и действуют на все следующие запросы
+            sharded.set_excluded(np.array([0, 1, 2, 450]))
+            _, ids = sharded.search(vectors[:3], 1)
+            self.assertFalse(np.isin(ids, [0, 1, 2]).any())
+            _, ids = sharded.search_lexical(["E0450"], 3)
+            self.assertNotIn(450, ids[0])
+            sharded.set_excluded(np.zeros(0, dtype="int64"))
+            _, ids = sharded.search_lexical(["E0450"], 3)
+            self.assertEqual(ids[0, 0], 450)
+            self.assertEqual(sharded.get_chunks([5, 599])[599], chunk_texts(599, 600)[0])
+
+    def test_failed_request_does_not_desync_shards(self):
+        """Ошибка в шарде не оставляет непрочитанных ответов: следующий запрос отвечает верно."""
+        vectors = random_vectors(300)
+        with ShardedIndex(self.temp_dir, processes=True) as sharded:
+            for start, end in partition_ranges(len(vectors), 3):
+                sharded.add_shard(vectors[start:end], chunk_texts(start, end), np.arange(start, end))
+            with self.assertRaises(RuntimeError):
+                sharded._scatter("unknown")
+            _, ids = sharded.search(vectors[[0, 150, 299]], 1)
+            np.testing.assert_array_equal(ids[:, 0], [0, 150, 299])
+            self.assertEqual(sharded.get_chunks([299])[299], chunk_texts(299, 300)[0])
+
+    def test_concurrent_queries_share_shard_connections(self):
+        """Ответы находят свой запрос: чужой незабранный ответ не блокирует и не путает поиск."""
+        vectors = random_vectors(300)
+        with ShardedIndex(self.temp_dir, processes=True) as sharded:
+            for start, end in partition_ranges(len(vectors), 2):
+                sharded.add_shard(vectors[start:end], chunk_texts(start, end), np.arange(start, end))
+            shards = list(sharded._shards.values())
+            pending = [(shard, shard.send("search", vectors[[7]], 1)) for shard in shards]
+            _, ids = sharded.search(vectors[[250]], 1)
+            self.assertEqual(ids[0, 0], 250)
+            _, ids = sharded._merge([shard.receive(request_id) for shard, request_id in pending], 1, 1)
+            self.assertEqual(ids[0, 0], 7)
+
+            def query(i):
+                return int(sharded.search(vectors[[i]], 1)[1][0, 0])
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                self.assertEqual(list(pool.map(query, range(0, 300, 5))), list(range(0, 300, 5)))
+
+    def test_export_keeps_documents_in_one_shard(self):
+        engine = RAGEngine()
+        chunks = chunk_texts(0, 40)
+        # Документы чередуются по id, как после replace_document
+        meta = [(1 + (i % 4) if i < 32 else 0, 1, 1) for i in range(40)]
+        engine.add_chunks(chunks, meta=meta)
+        sharded = engine.export_shards(self.temp_dir, 3, processes=False, index_folder=self.index_dir)
+        try:
+            seen = {}
+            for name in sharded.shard_names:
+                shard = Shard(os.path.join(self.temp_dir, name))
+                for doc in {meta[int(i)][0] for i in shard.ids} - {0}:
+                    self.assertNotIn(doc, seen, f"документ {doc} в шардах {seen.get(doc)} и {name}")
+                    seen[doc] = name
+            self.assertEqual(set(seen), {1, 2, 3, 4})
+            with open(os.path.join(self.temp_dir, "shards.json"), encoding="utf-8") as f:
+                listed = {entry["name"]: [d["doc_id"] for d in entry["documents"]] for entry in json.load(f)["shards"]}
+            self.assertEqual({doc: name for name, docs in listed.items() for doc in docs}, seen)
+            self.assertGreater(len(sharded.shard_names), 1)
+            self.assertEqual(sharded.ntotal, 40)
+        finally:
+            sharded.close()
+
+    def test_export_reads_segment_store(self):
+        """Шарды собираются из файлов хранилища: база и сегменты, без удалённых документов."""
+        documents = {"a.pdf": [(text, 1, 1, "1") for text in chunk_texts(0, 10)],
+                     "b.pdf": [(text, 1, 1, "1") for text in chunk_texts(10, 20)]}
+        engine = RAGEngine()
+        with fake_records(documents):
+            for name in documents:
+                path = os.path.join(self.temp_dir, name)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(name)
+                # Каждый документ — свой сегмент хранилища
+                self.assertTrue(engine.add_document(path, folder=self.index_dir))
+        self.assertEqual(engine.remove_document("a.pdf", folder=self.index_dir), 10)
+
+        # Движок без загруженного индекса: всё читается из хранилища
+        sharded = RAGEngine().export_shards(self.temp_dir, 2, processes=False, index_folder=self.index_dir)
+        try:
+            self.assertEqual(sharded.ntotal, 10)
+            self.assertEqual(sharded.documents, [{"doc_id": 2, "filename": "b.pdf"}])
+            self.assertEqual(sharded.get_chunks([3, 15]), {15: chunk_texts(15, 16)[0]})
+            _, ids = sharded.search(engine.model.encode(chunk_texts(12, 13), normalize_embeddings=True), 1)
+            self.assertEqual(ids[0, 0], 12)
+        finally:
+            sharded.close()
+        with self.assertRaises(ValueError):
+            RAGEngine().export_shards(self.temp_dir, 2)
+
+    def test_add_and_remove_shards(self):
+        vectors = random_vectors(200)
+        sharded = ShardedIndex(self.temp_dir, processes=False)
+        first = sharded.add_shard(vectors[:100], chunk_texts(0, 100), np.arange(100))
+        sharded.add_shard(vectors[100:], chunk_texts(100, 200), np.arange(100, 200), backend="hnsw")
+        sharded.close()
+
+        reopened = ShardedIndex(self.temp_dir, processes=False)
+        self.assertEqual(reopened.ntotal, 200)
+        reopened.remove_shard(first)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, first)))
+        _, ids = reopened.search(vectors[:5], 3)
+        self.assertTrue((ids >= 100).all())
+        reopened.close()
+
+    def test_engine_uses_shards(self):
+        engine = RAGEngine()
+        engine.add_chunks(chunk_texts(0, 30) + ["Инструкция по подключению питания: используйте разъём DC-IN."])
+        local = engine.search_many(["разъём DC-IN", "E0007"], k=5, mode="hybrid")
+
+        sharded = engine.export_shards(self.temp_dir, 2, processes=True, index_folder=self.index_dir)
+        try:
+            serving = RAGEngine(bad_feedback_exclude_after=1)
+            serving.use_shards(sharded)
+            self.assertEqual(serving.ntotal, 31)
+            for mode in ("dense", "lexical", "hybrid"):
+                with self.subTest(mode=mode):
+                    _, ids = serving.search_many(["разъём DC-IN", "E0007"], k=5, mode=mode)
+                    self.assertEqual(len(ids[0]), 5)
+            _, ids = serving.search_many(["разъём DC-IN", "E0007"], k=5, mode="hybrid")
+            np.testing.assert_array_equal(ids[:, 0], local[1][:, 0])
+            _, context = serving.ask("Как подключить питание?")
+            self.assertIn("DC-IN", context)
+            self.assertEqual(serving.mark_fragment_as_bad("код ошибки E0007"), [7])
+            _, ids = serving.search_many(["E0007"], k=5, mode="lexical")
+            self.assertNotIn(7, ids[0])
+        finally:
+            sharded.close()
+
+    def test_ingest_while_sharded_goes_to_new_shard(self):
+        """Чанки, добавленные после use_shards, ложатся новым шардом и сразу находятся."""
+        engine = RAGEngine()
+        engine.add_chunks(chunk_texts(0, 20), meta=[(1, 1, 1)] * 20)
+        sharded = engine.export_shards(self.temp_dir, 2, processes=False, index_folder=self.index_dir)
+        try:
+            serving = RAGEngine()
+            serving.use_shards(sharded)
+            # Id документов шардов не достаются новым документам
+            self.assertEqual(serving._next_doc_id, 2)
+            shards_before = len(sharded.shard_names)
+            text = "Сброс настроек: удерживайте кнопку RESET на задней панели десять секунд."
+            report = serving.add_chunks([text, chunk_texts(3, 4)[0]], sources=["reset.pdf"] * 2, meta=[(2, 5, 1)] * 2)
+            self.assertEqual(report["added"], 2)
+            self.assertEqual(len(sharded.shard_names), shards_before + 1)
+            self.assertEqual(serving.ntotal, 22)
+            _, context = serving.ask("кнопку RESET", mode="lexical")
+            self.assertEqual(context, text)
+            _, ids = serving.search_many(["кнопку RESET"], k=1, mode="lexical")
+            self.assertGreaterEqual(ids[0, 0], 20)
+            self.assertEqual(serving.source_of(int(ids[0, 0]))["page"], 5)
+            self.assertEqual(sharded.documents[-1], {"doc_id": 2, "filename": "reset.pdf"})
+        finally:
+            sharded.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+import faiss
+import numpy as np
+from src.bm25 import BM25Index
+from src.chunk_store import CHUNK_META_DTYPE
+from src.dedup import hash_chunks
+from src.snapshot import read_snapshot, write_snapshot
+
+DIM = 16
+CHUNKS = ["Настройка VLAN: vlan database.", "", "Разъём RJ45 — IEEE802.3ab ✓", "Питание DC-IN 12 В"]
+MANIFEST = {"version": 1, "base": {"name": "base_000001", "count": 4}, "segments": [], "removed_documents": []}
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "warm.snapshot")
+        self.index = faiss.IndexFlatIP(DIM)
+        self.index.add(np.random.default_rng(0).standard_normal((len(CHUNKS), DIM)).astype("float32"))
+        self.bm25 = BM25Index()
+        self.bm25.add(CHUNKS)
+        self.meta = np.zeros(len(CHUNKS), dtype=CHUNK_META_DTYPE)
+        self.meta["doc"] = [1, 1, 2, 2]
+        self.meta["page"] = [3, 3, 1, 9]
+        write_snapshot(self.path, MANIFEST, self.index, CHUNKS, hash_chunks(CHUNKS), self.meta,
+                       self.bm25, {0: ["b.pdf"]})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_round_trip(self):
+        """Индекс, тексты, хеши, метаданные и BM25 читаются обратно через mmap."""
+        snapshot = read_snapshot(self.path, MANIFEST)
+        self.assertEqual(list(snapshot["chunks"]), CHUNKS)
+        self.assertEqual(snapshot["index"].ntotal, len(CHUNKS))
+        self.assertTrue((snapshot["index"].reconstruct_n(0, 4) == self.index.reconstruct_n(0, 4)).all())
+        self.assertTrue((snapshot["hashes"] == hash_chunks(CHUNKS)).all())
+        self.assertEqual(snapshot["meta"]["page"].tolist(), [3, 3, 1, 9])
+        self.assertEqual(snapshot["duplicates"], {0: ["b.pdf"]})
+        self.assertEqual(snapshot["bm25"].search("vlan", 1)[1][0], 0)
+
+    def test_refresh_rewrites_only_changed_sections(self):
+        """Удаление документа переписывает метаданные, новый сегмент дописывает тексты."""
+        files = set(os.listdir(self.folder))
+        removed = dict(MANIFEST, removed_documents=[2], chunk_owners={"3": 1})
+        meta = self.meta.copy()
+        meta["doc"][3] = 1
+
+        def must_not_rewrite():
+            raise AssertionError("индекс не менялся")
+
+        written = write_snapshot(self.path, removed, must_not_rewrite, CHUNKS, hash_chunks(CHUNKS), meta,
+                                 self.bm25, {})
+        self.assertLess(written, meta.nbytes + 4096)
+        self.assertEqual(len(set(os.listdir(self.folder)) - files), 1)
+        snapshot = read_snapshot(self.path, removed)
+        self.assertEqual(snapshot["meta"]["doc"].tolist(), [1, 1, 2, 1])
+        self.assertEqual(list(snapshot["chunks"]), CHUNKS)
+        # Прежний индекс открыт через IO_FLAG_MMAP из своего файла
+        self.assertTrue(snapshot["index_path"].endswith(".faiss"))
+        self.assertEqual(snapshot["index"].ntotal, len(CHUNKS))
+
+        extended = dict(removed, segments=[{"name": "seg_000002", "count": 1}])
+        chunks = CHUNKS + ["Сброс: кнопка RESET"]
+        self.index.add(np.ones((1, DIM), dtype="float32"))
+        bm25 = BM25Index()
+        bm25.add(chunks)
+        blob = [f for f in os.listdir(self.folder) if f.endswith(".blob")]
+        write_snapshot(self.path, extended, self.index, chunks, hash_chunks(chunks),
+                       np.concatenate([meta, meta[:1]]), bm25, {})
+        self.assertEqual([f for f in os.listdir(self.folder) if f.endswith(".blob")], blob)
+        snapshot = read_snapshot(self.path, extended)
+        self.assertEqual(list(snapshot["chunks"]), chunks)
+        self.assertEqual(snapshot["index"].ntotal, len(chunks))
+        self.assertEqual(snapshot["bm25"].search("reset", 1)[1][0], 4)
+        self.assertIsNone(read_snapshot(self.path, removed))
+
+    def test_stale_or_broken_snapshot_is_ignored(self):
+        changed = dict(MANIFEST, segments=[{"name": "seg_000002", "count": 1}])
+        self.assertIsNone(read_snapshot(self.path, changed))
+        self.assertIsNotNone(read_snapshot(self.path))
+        with open(self.path, "r+b") as f:
+            f.write(b"garbage!")
+        self.assertIsNone(read_snapshot(self.path, MANIFEST))
+        self.assertIsNone(read_snapshot(os.path.join(self.folder, "missing.snapshot")))
+
+
+if __name__ == "__main__":
+    unittest.main()
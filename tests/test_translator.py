@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.translator import Translator, cyrillic_ratio, detect_language, needs_translation, split_sentences
+
+
+class UpperBackend:
+    """«Перевод»: предложение в верхнем регистре с пометкой; запоминает размеры пачек."""
+
+    def __init__(self, prefix="RU:"):
+        self.prefix = prefix
+        self.batches = []
+
+    def translate_batch(self, sentences):
+        self.batches.append(list(sentences))
+        return [self.prefix + sentence.upper() for sentence in sentences]
+
+
+class MissingPackageBackend:
+    def translate_batch(self, sentences):
+        raise RuntimeError("Пакет Argos de→ru не установлен")
+
+
+ENGLISH = "Connect the power cable to the DC-IN port. Press the reset button for ten seconds."
+RUSSIAN = "Настройка VLAN: введите команду vlan database и сохраните конфигурацию."
+TABLE = "Table 3 Port settings\nPort 1 1000BASE-T\nThe port speed is negotiated automatically."
+GERMAN = "Schließen Sie das Netzkabel an die Buchse DC-IN an. Die LED wird grün."
+FRENCH = "Branchez le câble sur le port DC-IN et appuyez sur le bouton pour vous connecter."
+
+
+class TestTranslator(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_language_detection(self):
+        self.assertEqual(cyrillic_ratio("12-34"), 1.0)
+        self.assertLess(cyrillic_ratio(ENGLISH), 0.01)
+        self.assertTrue(needs_translation(ENGLISH))
+        self.assertFalse(needs_translation(RUSSIAN))
+        self.assertFalse(needs_translation("Port 1"))
+        self.assertEqual(
+            [detect_language(text) for text in (ENGLISH, GERMAN, FRENCH, "Power LED Status")],
+            ["en", "de", "fr", None],
+        )
+        self.assertEqual(split_sentences(ENGLISH), [[
+            "Connect the power cable to the DC-IN port.", "Press the reset button for ten seconds.",
+        ]])
+
+    def test_sentences_of_all_chunks_in_one_batch(self):
+        backend = UpperBackend()
+        translator = Translator(backends={"en": backend})
+        out = translator.translate([ENGLISH, RUSSIAN, TABLE, ENGLISH])
+        self.assertEqual(len(backend.batches), 1)
+        # Повторы предложений и чанков переводятся один раз, строки таблицы без слов — как есть
+        self.assertEqual(len(backend.batches[0]), 4)
+        self.assertEqual(out[0], out[3])
+        self.assertTrue(out[0].startswith("RU:CONNECT"))
+        self.assertEqual(out[1], RUSSIAN)
+        self.assertEqual(out[2].split("\n")[1], "Port 1 1000BASE-T")
+        self.assertEqual(len(out[2].split("\n")), 3)
+
+    def test_each_language_uses_its_own_model(self):
+        english, german = UpperBackend(), UpperBackend("DE:")
+        translator = Translator(backends={"en": english, "de": german}, languages=("en", "de"))
+        out = translator.translate([ENGLISH, GERMAN, FRENCH])
+        self.assertTrue(out[0].startswith("RU:CONNECT"))
+        self.assertTrue(out[1].startswith("DE:SCHLIESSEN"))
+        # Французского нет среди языков — чанк остаётся оригиналом, а не идёт в английскую модель
+        self.assertEqual(out[2], FRENCH)
+        self.assertEqual((len(english.batches), len(german.batches)), (1, 1))
+        self.assertEqual(translator.stats()["skipped"], 1)
+
+    def test_language_without_package_is_skipped(self):
+        english = UpperBackend()
+        translator = Translator(backends={"en": english, "de": MissingPackageBackend()})
+        out = translator.translate([GERMAN, ENGLISH])
+        self.assertEqual(out[0], GERMAN)
+        self.assertTrue(out[1].startswith("RU:"))
+        self.assertEqual(translator.stats()["unavailable"], ["de"])
+        # Язык без пакета больше не пробуется и не кэшируется
+        self.assertEqual(translator.translate([GERMAN]), [GERMAN])
+        self.assertEqual(translator.stats()["skipped"], 1)
+
+    def test_persistent_cache(self):
+        path = os.path.join(self.temp_dir, "translations.sqlite")
+        backend = UpperBackend()
+        first = Translator(path, backends={"en": backend}).translate([ENGLISH])
+        again = Translator(path, backends={"en": backend})
+        self.assertEqual(again.translate([ENGLISH, RUSSIAN]), [first[0], RUSSIAN])
+        self.assertEqual(len(backend.batches), 1)
+        stats = again.stats()
+        self.assertEqual((stats["cache_hits"], stats["translated"], stats["entries"]), (1, 0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()